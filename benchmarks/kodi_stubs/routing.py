@@ -0,0 +1,44 @@
+'''
+stand-in for the routing module of script.module.routing, dispatching the plugin url given in sys.argv like Kodi does
+'''
+
+import re
+import sys
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+
+class Plugin(object):
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url or 'plugin://plugin.program.steam.library'
+        self.handle = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else -1
+        self.args = {}
+        self.path = '/'
+        self._routes = []  # (pattern, function)
+
+    def route(self, pattern):
+        def decorator(function):
+            self._routes.append((pattern, function))
+            return function
+        return decorator
+
+    def url_for(self, function, *args, **kwargs):
+        pattern = next(pattern for pattern, route_function in self._routes if route_function is function)
+        path = pattern
+        query = {}
+        for key, value in kwargs.items():
+            if '<{0}>'.format(key) in path:
+                path = path.replace('<{0}>'.format(key), str(value))
+            else:
+                query[key] = value
+        return self.base_url + path + ('?' + urlencode(query) if query else '')
+
+    def run(self, argv=None):
+        argv = argv or sys.argv
+        self.path = urlsplit(argv[0]).path or '/'
+        self.args = parse_qs(argv[2].lstrip('?')) if len(argv) > 2 else {}
+        for pattern, function in self._routes:
+            match = re.match('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', pattern) + '$', self.path)
+            if match:
+                return function(**match.groupdict())
+        raise KeyError('No route matches ' + self.path)
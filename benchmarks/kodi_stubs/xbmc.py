@@ -0,0 +1,51 @@
+'''
+stand-in for Kodi's xbmc module, so that the addon can be imported by the benchmarks
+'''
+
+import sys
+import time
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGWARNING = 2
+LOGERROR = 3
+LOGFATAL = 4
+
+# Set by the benchmarks to simulate the info labels of the Kodi GUI
+info_labels = {}
+# Builtins executed by the addon, in order
+executed_builtins = []
+
+
+def log(msg, level=LOGDEBUG):
+    if level >= LOGWARNING:
+        sys.stderr.write(msg + '\n')
+
+
+def executebuiltin(function, wait=False):
+    executed_builtins.append(function)
+
+
+def executeJSONRPC(jsonrpccommand):
+    return '{"id": 1, "jsonrpc": "2.0", "result": "OK"}'
+
+
+def getInfoLabel(cLine):
+    return info_labels.get(cLine, '')
+
+
+def getCondVisibility(condition):
+    return False
+
+
+def sleep(timemillis):
+    time.sleep(timemillis / 1000.0)
+
+
+class Monitor(object):
+
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=None):
+        return False
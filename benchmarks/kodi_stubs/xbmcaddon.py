@@ -0,0 +1,40 @@
+'''
+stand-in for Kodi's xbmcaddon module. The settings default to the ones of resources/settings.xml, and can be overridden by the benchmarks.
+The profile folder is a temporary folder, unless the KODI_PROFILE environment variable is set.
+'''
+
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+ADDON_FOLDER = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROFILE_FOLDER = os.environ.get('KODI_PROFILE') or tempfile.mkdtemp(prefix='steam-library-benchmark-')
+
+settings = {setting.get('id'): setting.get('default', '')
+            for setting in ElementTree.parse(os.path.join(ADDON_FOLDER, 'resources', 'settings.xml')).iter('setting')}
+settings.update({'steam-id': '76561197960434622', 'steam-key': 'benchmark'})
+
+addon_info = {
+    'id': 'plugin.program.steam.library',
+    'version': ElementTree.parse(os.path.join(ADDON_FOLDER, 'addon.xml')).getroot().get('version'),
+    'path': ADDON_FOLDER,
+    'profile': PROFILE_FOLDER,
+}
+
+
+class Addon(object):
+
+    def __init__(self, id=None):
+        pass
+
+    def getSetting(self, id):
+        return settings.get(id, '')
+
+    def setSetting(self, id, value):
+        settings[id] = value
+
+    def getAddonInfo(self, id):
+        return addon_info.get(id, '')
+
+    def openSettings(self):
+        pass
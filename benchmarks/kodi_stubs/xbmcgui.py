@@ -0,0 +1,62 @@
+'''
+stand-in for Kodi's xbmcgui module
+'''
+
+NOTIFICATION_INFO = 'info'
+NOTIFICATION_WARNING = 'warning'
+NOTIFICATION_ERROR = 'error'
+
+
+class ListItem(object):
+
+    def __init__(self, label='', label2='', path='', offscreen=False):
+        self.label = label
+        self.art = {}
+        self.info = {}
+        self.properties = {}
+
+    def setUniqueIDs(self, values, defaultrating=''):
+        self.unique_ids = values
+
+    def setInfo(self, type, infoLabels):
+        self.info.update(infoLabels)
+
+    def setContentLookup(self, enable):
+        pass
+
+    def addContextMenuItems(self, items, replaceItems=False):
+        self.context_menu_items = items
+
+    def setArt(self, values):
+        self.art.update(values)
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key, '')
+
+
+class Dialog(object):
+
+    def notification(self, heading, message, icon='', time=0, sound=True):
+        pass
+
+    def input(self, heading, defaultt='', type=0, option=0, autoclose=0):
+        return ''
+
+
+class Window(object):
+    properties = {}
+
+    def __init__(self, existingWindowId=-1):
+        pass
+
+    def setProperty(self, key, value):
+        Window.properties[key] = value
+
+    def getProperty(self, key):
+        return Window.properties.get(key, '')
+
+    def clearProperty(self, key):
+        Window.properties.pop(key, None)
@@ -0,0 +1,44 @@
+'''
+stand-in for Kodi's xbmcplugin module. The directory items added by the addon are recorded for the benchmarks
+'''
+
+import time
+
+SORT_METHOD_UNSORTED = 0
+SORT_METHOD_LABEL = 1
+SORT_METHOD_PLAYCOUNT = 2
+SORT_METHOD_LASTPLAYED = 3
+
+# Directory items added by the addon, as (url, listitem, isFolder) tuples
+directory_items = []
+# Number of endOfDirectory calls
+ended_directories = []
+# time.perf_counter() of each endOfDirectory call, when Kodi displays the listing
+ended_at = []
+
+
+def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+    directory_items.append((url, listitem, isFolder))
+    return True
+
+
+def addDirectoryItems(handle, items, totalItems=0):
+    directory_items.extend(items)
+    return True
+
+
+def addSortMethod(handle, sortMethod, labelMask='', label2Mask=''):
+    pass
+
+
+def setContent(handle, content):
+    pass
+
+
+def setResolvedUrl(handle, succeeded, listitem):
+    pass
+
+
+def endOfDirectory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
+    ended_directories.append(succeeded)
+    ended_at.append(time.perf_counter())
@@ -0,0 +1,7 @@
+'''
+stand-in for Kodi's xbmcvfs module
+'''
+
+
+def translatePath(path):
+    return path
@@ -0,0 +1,266 @@
+'''
+End to end benchmark of the games listings (/all, /installed and /recent) outside Kodi, on synthetic libraries of several sizes.
+The Kodi modules are replaced by the stand-ins of kodi_stubs, and a local HTTP server stands in for both the Steam Web API and the Steam CDN,
+answering after an injected latency and with 404 for a share of the arts.
+
+Every route is run in a fresh interpreter like Kodi does : first on an empty profile (cold), then again on the profile left by the first run (warm).
+The time until the listing is displayed, the total time of the invocation (including the work deferred after the listing), the requests received
+by the stand-in server, the peak memory, and the spans and counters of resources/perf.py are recorded for every scenario,
+and saved as JSON so that regressions show up.
+
+Usage: python benchmarks/listings.py [--games 100,1000,20000] [--routes all,installed,recent] [--latency-ms 5] [--not-found-ratio 0.3]
+                                     [--installed-ratio 0.2] [--limit N] [--output listings-results.json] [--baseline previous-results.json]
+'''
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+ADDON_FOLDER = os.path.dirname(BENCHMARKS_FOLDER)
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), ADDON_FOLDER]
+
+from owned_games import make_response  # noqa: E402
+
+DEFAULT_GAME_COUNTS = [100, 1000, 20000]
+DEFAULT_ROUTES = ['all', 'installed', 'recent']
+
+# Body of the arts served by the stand-in CDN, only downloaded when the local arts cache is enabled
+ART_BODY = b'\xff\xd8\xff\xe0' + b'\x00' * 2048
+# Path of the appdetails endpoint of the stand-in Steam Store
+STORE_PATH = '/api/appdetails'
+
+
+def make_app_details(appid):
+    """:return: the body of a synthetic appdetails response of the Steam Store. The apps whose appid is a multiple of 7 have no store page"""
+    if not appid.isdigit() or int(appid) % 7 == 0:
+        return json.dumps({appid: {'success': False}}).encode('utf-8')
+    return json.dumps({appid: {'success': True, 'data': {
+        'name': 'Game {0}'.format(appid),
+        'genres': [{'id': '1', 'description': 'Action'}],
+        'release_date': {'coming_soon': False, 'date': '{0} Oct, 20{1:02d}'.format(int(appid) % 28 + 1, int(appid) % 25)},
+        'developers': ['Studio {0}'.format(appid)],
+        'short_description': 'The <b>synthetic</b> game {0}'.format(appid),
+    }}}).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the GetOwnedGames requests with the synthetic library of the server, the appdetails requests of the Steam Store with synthetic details,
+    and every other url as an art of the CDN.
+    """
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so that the connection pools of the addon are exercised like on the real CDN
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self, send_body):
+        server = self.server
+        path, separator, query = self.path.partition('?')
+        kind = 'api' if path.startswith('/IPlayerService/') else 'store' if path == STORE_PATH else 'art'
+        with server.counters_lock:
+            key = '{0}_{1}'.format(self.command.lower(), kind)
+            server.counters[key] = server.counters.get(key, 0) + 1
+        time.sleep(server.latency)
+
+        if kind == 'api':
+            status, body, content_type = 200, server.owned_games_body, 'application/json'
+        elif kind == 'store':
+            status, body, content_type = server.store_status, make_app_details(parse_qs(query).get('appids', [''])[0]), 'application/json'
+        elif zlib.crc32(path.encode('utf-8')) % 1000 < server.not_found_ratio * 1000:
+            status, body, content_type = 404, b'', 'text/html'
+        else:
+            status, body, content_type = 200, ART_BODY, 'image/jpeg'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._answer(send_body=True)
+
+    def do_HEAD(self):
+        self._answer(send_body=False)
+
+
+def start_server(latency, not_found_ratio):
+    """:return: the stand-in server, serving in a background thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.not_found_ratio = not_found_ratio
+    server.owned_games_body = b''
+    server.store_status = 200
+    server.counters = {}
+    server.counters_lock = threading.Lock()
+    server_thread = threading.Thread(target=server.serve_forever, name='stand-in-server')
+    server_thread.daemon = True
+    server_thread.start()
+    return server
+
+
+def write_steam_folder(folder, appids, installed_ratio, seed=0):
+    """
+    Writes a synthetic Steam folder holding a registry.vdf, which lists every owned game and marks a share of them as installed.
+
+    :return: the number of installed games
+    """
+    random_generator = random.Random(seed)
+    installed_count = 0
+    os.makedirs(folder, exist_ok=True)
+    with io.open(os.path.join(folder, 'registry.vdf'), 'w', encoding='utf-8') as vdf_file:
+        vdf_file.write('"Registry"\n{\n\t"HKCU"\n\t{\n\t\t"Software"\n\t\t{\n\t\t\t"Valve"\n\t\t\t{\n\t\t\t\t"Steam"\n\t\t\t\t{\n')
+        vdf_file.write('\t\t\t\t\t"language"\t\t"english"\n\t\t\t\t\t"Apps"\n\t\t\t\t\t{\n')
+        for appid in appids:
+            installed = random_generator.random() < installed_ratio
+            installed_count += installed
+            vdf_file.write('\t\t\t\t\t\t"{0}"\n\t\t\t\t\t\t{{\n\t\t\t\t\t\t\t"installed"\t\t"{1}"\n'.format(appid, int(installed)))
+            vdf_file.write('\t\t\t\t\t\t\t"Running"\t\t"0"\n\t\t\t\t\t\t\t"Updating"\t\t"0"\n\t\t\t\t\t\t}\n')
+        vdf_file.write('\t\t\t\t\t}\n\t\t\t\t\t"RunningAppID"\t\t"0"\n\t\t\t\t}\n\t\t\t}\n\t\t}\n\t}\n}\n')
+    return installed_count
+
+
+def get_peak_memory_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)  # Bytes on macOS, kB elsewhere
+
+
+def run_route(route, query):
+    """Runs a single listing in the current interpreter, configured by the environment, and prints its measures as JSON."""
+    start = time.perf_counter()
+    import xbmcaddon
+    import xbmcplugin
+    xbmcaddon.settings.update(json.loads(os.environ['BENCHMARK_SETTINGS']))
+    sys.argv = ['plugin://plugin.program.steam.library/' + route, '1', query]
+
+    from resources import main, perf, steam
+    steam.WEB_API_URL = os.environ['BENCHMARK_WEB_API_URL']
+    main.main()
+    finished = time.perf_counter()
+    summary = perf.get_summary('/' + route)
+
+    print(json.dumps({
+        'listing_ms': round((xbmcplugin.ended_at[0] - start) * 1000, 1) if xbmcplugin.ended_at else None,
+        'total_ms': round((finished - start) * 1000, 1),
+        'items': sum(1 for url, listitem, is_folder in xbmcplugin.directory_items if not is_folder),
+        'peak_memory_mb': get_peak_memory_mb(),
+        'spans': summary['spans'],
+        'counters': summary['counters'],
+    }))
+
+
+def run_invocation(server, environment, route, query):
+    """:return: the measures of a listing run in a fresh interpreter, along with the requests received by the stand-in server"""
+    with server.counters_lock:
+        server.counters.clear()
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--route', route, '--query', query], env=environment)
+    measures = json.loads(output.decode('utf-8').splitlines()[-1])
+    with server.counters_lock:
+        measures['requests'] = dict(server.counters)
+    measures['head_requests'] = measures['requests'].get('head_art', 0)
+    return measures
+
+
+def run(game_counts, routes, latency, not_found_ratio, installed_ratio, limit=None):
+    results = []
+    server = start_server(latency, not_found_ratio)
+    base_url = 'http://127.0.0.1:{0}'.format(server.server_port)
+    try:
+        for game_count in game_counts:
+            server.owned_games_body = make_response(game_count)
+            appids = [game['appid'] for game in json.loads(server.owned_games_body.decode('utf-8'))['response']['games']]
+            for route in routes:
+                folder = tempfile.mkdtemp(prefix='steam-library-listings-')
+                try:
+                    steam_folder = os.path.join(folder, 'steam')
+                    installed_count = write_steam_folder(steam_folder, appids, installed_ratio)
+                    settings = {
+                        'steam-path': steam_folder,
+                        'steam-exe': shutil.which('true') or sys.executable,
+                        'cdn-hosts': base_url,
+                        'enable-local-appinfo': 'false',
+                        'enable-store-metadata': 'false',
+                    }
+                    environment = dict(os.environ, KODI_PROFILE=os.path.join(folder, 'profile'), BENCHMARK_SETTINGS=json.dumps(settings),
+                                       BENCHMARK_WEB_API_URL=base_url)
+                    query = '?limit={0}'.format(limit) if limit else ''
+                    result = {'games': game_count, 'installed_games': installed_count, 'route': route, 'limit': limit,
+                              'latency_ms': round(latency * 1000, 1), 'not_found_ratio': not_found_ratio}
+                    for run_name in ('cold', 'warm'):
+                        result[run_name] = run_invocation(server, environment, route, query)
+                    results.append(result)
+                    print_result(result)
+                finally:
+                    shutil.rmtree(folder, ignore_errors=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def print_result(result, baseline=None):
+    line = '{games:>6} games /{route:<10}'.format(**result)
+    for run_name in ('cold', 'warm'):
+        measures = result[run_name]
+        line += ' {0}: listing {1:>8} ms, total {2:>8} ms, {3:>6} HEAD, {4} MB'.format(
+            run_name, measures['listing_ms'], measures['total_ms'], measures['head_requests'], measures['peak_memory_mb'])
+        if baseline is not None and baseline[run_name]['listing_ms'] and measures['listing_ms']:
+            line += ' (x{0:.2f})'.format(measures['listing_ms'] / baseline[run_name]['listing_ms'])
+    print(line)
+
+
+def compare(results, baseline_results):
+    """Prints the results along with the ratio of their listing latency to the ones of a previous run of the same scenarios."""
+    baselines = dict(((result['games'], result['route'], result['limit']), result) for result in baseline_results)
+    print('Compared to the baseline:')
+    for result in results:
+        print_result(result, baselines.get((result['games'], result['route'], result['limit'])))
+
+
+def parse_list(value, item_type=str):
+    return [item_type(item) for item in value.split(',') if item]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End to end benchmark of the games listings')
+    parser.add_argument('--games', type=lambda value: parse_list(value, int), default=DEFAULT_GAME_COUNTS, help='library sizes, separated by commas')
+    parser.add_argument('--routes', type=parse_list, default=DEFAULT_ROUTES, help='routes among all, installed and recent, separated by commas')
+    parser.add_argument('--latency-ms', type=float, default=5, help='latency of every answer of the stand-in server')
+    parser.add_argument('--not-found-ratio', type=float, default=0.3, help='share of the arts answered with 404')
+    parser.add_argument('--installed-ratio', type=float, default=0.2, help='share of the games marked as installed')
+    parser.add_argument('--limit', type=int, default=None, help='page size of the listings, all the games by default')
+    parser.add_argument('--output', default='listings-results.json', help='JSON file the results are written to')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare the results to')
+    parser.add_argument('--route', help=argparse.SUPPRESS)
+    parser.add_argument('--query', default='', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.route:
+        run_route(arguments.route, arguments.query)
+        sys.exit(0)
+
+    benchmark_results = run(arguments.games, arguments.routes, arguments.latency_ms / 1000.0, arguments.not_found_ratio,
+                            arguments.installed_ratio, arguments.limit)
+    with io.open(arguments.output, 'w', encoding='utf-8') as output_file:
+        json.dump({'created_at': time.time(), 'python': sys.version.split()[0], 'results': benchmark_results}, output_file, indent=2)
+    print('Results written to ' + arguments.output)
+    if arguments.baseline:
+        with io.open(arguments.baseline, encoding='utf-8') as baseline_file:
+            compare(benchmark_results, json.load(baseline_file)['results'])
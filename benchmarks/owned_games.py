@@ -0,0 +1,110 @@
+'''
+Benchmark of the parsing of GetOwnedGames responses, comparing the whole document parse used up to 0.9.0 (response.json() keeping every field)
+with the incremental parse of the games array into compact records of resources/steam.py, on synthetic responses of several sizes.
+The parse time, the peak memory during the parse and the memory retained by the parsed games are reported, along with the cost of filtering the installed games.
+
+Usage: python benchmarks/owned_games.py [number of games ...]
+'''
+
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(BENCHMARKS_FOLDER)]
+
+from resources import steam  # noqa: E402
+
+DEFAULT_GAME_COUNTS = [1000, 20000]
+
+
+def make_response(game_count, seed=0):
+    """:return: the body of a synthetic GetOwnedGames response, as bytes, with the fields returned by the Steam Web API"""
+    random_generator = random.Random(seed)
+    games = []
+    for appid in random_generator.sample(range(10, 3000000), game_count):
+        playtime = random_generator.choice([0, 0, random_generator.randint(1, 100000)])
+        games.append({
+            'appid': appid,
+            'name': 'Game {0} : {1}'.format(appid, 'é' * random_generator.randint(0, 20)),
+            'playtime_forever': playtime,
+            'img_icon_url': '%040x' % random_generator.getrandbits(160),
+            'has_community_visible_stats': True,
+            'playtime_windows_forever': playtime,
+            'playtime_mac_forever': 0,
+            'playtime_linux_forever': 0,
+            'playtime_deck_forever': 0,
+            'rtime_last_played': random_generator.randint(0, 1700000000) if playtime else 0,
+            'content_descriptorids': [2, 5],
+            'playtime_disconnected': 0,
+        })
+        if playtime and random_generator.random() < 0.1:  # Played in the last two weeks
+            games[-1]['playtime_2weeks'] = random_generator.randint(1, min(playtime, 20160))
+    return json.dumps({'response': {'game_count': game_count, 'games': games}}).encode('utf-8')
+
+
+def legacy_parse(body):
+    return json.loads(body.decode('utf-8')).get('response', {}).get('games', {})
+
+
+def incremental_parse(body):
+    return list(steam.iter_games(body[index:index + steam.RESPONSE_CHUNK_SIZE] for index in range(0, len(body), steam.RESPONSE_CHUNK_SIZE)))
+
+
+def measure(parse, body):
+    """:return: (parse duration in seconds, peak memory in MB, retained memory in MB, parsed games)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    games = parse(body)
+    duration = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 1048576.0, retained / 1048576.0, games
+
+
+def best_duration(function, repeat=3):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def run(game_counts):
+    results = []
+    for game_count in game_counts:
+        body = make_response(game_count)
+        legacy_duration, legacy_peak, legacy_retained, legacy_games = measure(legacy_parse, body)
+        duration, peak, retained, games = measure(incremental_parse, body)
+        assert [steam.Game.from_entry(entry) for entry in legacy_games] == games
+
+        installed_appids = set(str(game.appid) for game in games[::5])
+        installed_int_appids = set(int(appid) for appid in installed_appids)
+        legacy_filter_duration = best_duration(lambda: list(filter(lambda app_entry: str(app_entry['appid']) in installed_appids, legacy_games)))
+        filter_duration = best_duration(lambda: [game for game in games if game.appid in installed_int_appids])
+
+        results.append({
+            'games': game_count,
+            'response_mb': round(len(body) / 1048576.0, 2),
+            'legacy_parse_s': round(min(legacy_duration, best_duration(lambda: legacy_parse(body))), 4),
+            'incremental_parse_s': round(min(duration, best_duration(lambda: incremental_parse(body))), 4),
+            'legacy_peak_mb': round(legacy_peak, 2),
+            'incremental_peak_mb': round(peak, 2),
+            'legacy_retained_mb': round(legacy_retained, 2),
+            'incremental_retained_mb': round(retained, 2),
+            'legacy_installed_filter_ms': round(legacy_filter_duration * 1000, 2),
+            'installed_filter_ms': round(filter_duration * 1000, 2),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    game_counts = [int(argument) for argument in sys.argv[1:]] or DEFAULT_GAME_COUNTS
+    for result in run(game_counts):
+        print(', '.join('{0}={1}'.format(key, value) for key, value in result.items()))
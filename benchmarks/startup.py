@@ -0,0 +1,61 @@
+'''
+Benchmark of the startup cost of the plugin for each route : every route is run in a fresh interpreter, like Kodi runs the plugin,
+and the time spent importing the addon and running the route is reported along with the heavy modules which were imported.
+
+Usage: python benchmarks/startup.py [route ...]
+'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+ADDON_FOLDER = os.path.dirname(BENCHMARKS_FOLDER)
+
+# Routes which don't need the network nor a Steam installation
+DEFAULT_ROUTES = ['/', '/run/440', '/install/440']
+HEAVY_MODULES = ['requests', 'requests_cache', 'urllib3', 'PIL', 'sqlite3', 'concurrent.futures']
+
+
+def run_route(route):
+    """Runs a single route in the current interpreter, and prints its measures as JSON."""
+    start = time.perf_counter()
+    sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), ADDON_FOLDER]
+    import xbmcaddon
+    xbmcaddon.settings['steam-exe'] = shutil.which('true')  # /run and /install call the Steam executable, a no-op command stands in for it
+    sys.argv = ['plugin://plugin.program.steam.library' + route, '1', '']
+
+    from resources import main
+    imported = time.perf_counter()
+    main.main()
+    finished = time.perf_counter()
+
+    print(json.dumps({
+        'route': route,
+        'import_ms': round((imported - start) * 1000, 1),
+        'total_ms': round((finished - start) * 1000, 1),
+        'heavy_modules': [module for module in HEAVY_MODULES if module in sys.modules],
+    }))
+
+
+def run(routes, repeat=5):
+    results = []
+    environment = dict(os.environ, KODI_PROFILE=os.environ.get('KODI_PROFILE') or tempfile.mkdtemp(prefix='steam-library-startup-'))
+    for route in routes:
+        measures = [json.loads(subprocess.check_output([sys.executable, os.path.abspath(__file__), '--route', route], env=environment).decode().splitlines()[-1])
+                    for _ in range(repeat)]
+        best = min(measures, key=lambda measure: measure['total_ms'])
+        results.append(best)
+    return results
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--route']:
+        run_route(sys.argv[2])
+    else:
+        for result in run(sys.argv[1:] or DEFAULT_ROUTES):
+            print(', '.join('{0}={1}'.format(key, value) for key, value in result.items()))
@@ -0,0 +1,129 @@
+'''
+Benchmark of the registry.vdf parsing, comparing the readline based parser used up to 0.9.0 with the tokenizer of resources/registry.py,
+on synthetic registry.vdf files of several sizes.
+
+Usage: python benchmarks/vdf_parse.py [number of apps ...]
+'''
+
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(BENCHMARKS_FOLDER)]
+
+from resources import registry  # noqa: E402
+
+DEFAULT_APP_COUNTS = [1000, 10000, 50000]
+
+
+def legacy_vdf_parse(steam_config_file, config):
+    """The parser of registry.py up to 0.9.0, kept as the baseline of the benchmark."""
+    line = " "
+    while line:
+        try:
+            line = steam_config_file.readline()
+        except UnicodeDecodeError:
+            return config
+        if not line or line.strip() == "}":
+            return config
+        while not line.strip().endswith("\""):
+            nextline = steam_config_file.readline()
+            if not nextline:
+                break
+            line = line[:-1] + nextline
+
+        line_elements = line.strip().split("\"")
+        if len(line_elements) == 3:
+            key = line_elements[1].lower()
+            steam_config_file.readline()  # skip '{'
+            config[key] = legacy_vdf_parse(steam_config_file, {})
+        else:
+            try:
+                config[line_elements[1].lower()] = line_elements[3]
+            except IndexError:
+                pass
+    return config
+
+
+def write_registry_vdf(path, app_count, seed=0):
+    """
+    Writes a synthetic registry.vdf, with an apps section of app_count apps surrounded by other sections, like the real file.
+
+    :return: the set of the appids written as installed
+    """
+    random_generator = random.Random(seed)
+    installed_appids = set()
+    with io.open(path, 'w', encoding='utf-8') as vdf_file:
+        vdf_file.write('"Registry"\n{\n\t"HKCU"\n\t{\n\t\t"Software"\n\t\t{\n\t\t\t"Valve"\n\t\t\t{\n\t\t\t\t"Steam"\n\t\t\t\t{\n')
+        vdf_file.write('\t\t\t\t\t"language"\t\t"english"\n\t\t\t\t\t"SourceModInstallPath"\t\t"/home/user/.steam/steamapps/sourcemods"\n')
+        vdf_file.write('\t\t\t\t\t"Apps"\n\t\t\t\t\t{\n')
+        for appid in random_generator.sample(range(10, 3000000), app_count):
+            installed = random_generator.random() < 0.2
+            if installed:
+                installed_appids.add(str(appid))
+            vdf_file.write('\t\t\t\t\t\t"{0}"\n\t\t\t\t\t\t{{\n'.format(appid))
+            vdf_file.write('\t\t\t\t\t\t\t"{0}"\t\t"{1}"\n'.format('installed' if appid % 2 else 'Installed', int(installed)))
+            vdf_file.write('\t\t\t\t\t\t\t"Running"\t\t"0"\n\t\t\t\t\t\t\t"Updating"\t\t"0"\n')
+            vdf_file.write('\t\t\t\t\t\t\t"name"\t\t"Game {0}"\n\t\t\t\t\t\t}}\n'.format(appid))
+        vdf_file.write('\t\t\t\t\t}\n\t\t\t\t\t"RunningAppID"\t\t"0"\n')
+        vdf_file.write('\t\t\t\t\t"Rate"\n\t\t\t\t\t{\n')
+        for index in range(app_count // 10):
+            vdf_file.write('\t\t\t\t\t\t"{0}"\t\t"{1}"\n'.format(index, random_generator.randint(0, 100000)))
+        vdf_file.write('\t\t\t\t\t}\n\t\t\t\t}\n\t\t\t}\n\t\t}\n\t}\n}\n')
+    return installed_appids
+
+
+def measure(function, repeat=3):
+    """:return: (best duration in seconds, result of the last call)"""
+    best_duration = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        duration = time.perf_counter() - start
+        best_duration = duration if best_duration is None else min(best_duration, duration)
+    return best_duration, result
+
+
+def legacy_installed_apps(path):
+    with io.open(path, 'r', encoding='utf-8') as vdf_file:
+        apps = legacy_vdf_parse(vdf_file, {})['registry']['hkcu']['software']['valve']['steam']['apps']
+    return set(appid for appid, information in apps.items() if information.get('installed', '0') == '1')
+
+
+def run(app_counts):
+    results = []
+    folder = tempfile.mkdtemp(prefix='steam-library-vdf-')
+    for app_count in app_counts:
+        path = os.path.join(folder, 'registry-{0}.vdf'.format(app_count))
+        expected_installed_appids = write_registry_vdf(path, app_count)
+
+        legacy_duration, legacy_result = measure(lambda: legacy_installed_apps(path))
+        full_duration, full_result = measure(lambda: registry.vdf_load(path))
+        subtree_duration, subtree_result = measure(lambda: registry.vdf_load(path, registry.REGISTRY_APPS_PATH))
+        registry._installed_apps_cache.clear()
+        uncached_duration, installed_result = measure(lambda: registry._get_installed_apps_from_registry_vdf(path), repeat=1)
+        cached_duration, cached_result = measure(lambda: registry._get_installed_apps_from_registry_vdf(path))
+
+        assert legacy_result == expected_installed_appids == set(installed_result) == set(cached_result)
+        assert full_result['registry']['hkcu']['software']['valve']['steam']['apps'] == subtree_result
+
+        results.append({
+            'apps': app_count,
+            'file_size_mb': round(os.path.getsize(path) / 1048576.0, 2),
+            'legacy_parser_s': round(legacy_duration, 4),
+            'tokenizer_full_s': round(full_duration, 4),
+            'tokenizer_apps_subtree_s': round(subtree_duration, 4),
+            'installed_apps_uncached_s': round(uncached_duration, 4),
+            'installed_apps_cached_s': round(cached_duration, 6),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    app_counts = [int(argument) for argument in sys.argv[1:]] or DEFAULT_APP_COUNTS
+    for result in run(app_counts):
+        print(', '.join('{0}={1}'.format(key, value) for key, value in result.items()))
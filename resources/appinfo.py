@@ -0,0 +1,249 @@
+'''
+reader of the binary appcache/appinfo.vdf file of the Steam client, which tells which library assets (capsule, hero, logo) each app has
+
+The file is memory-mapped, and an appid -> offset index is built once then persisted in the addon profile folder along with the modification time and size of the file.
+Only the entries which are asked for are decoded.
+'''
+
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+import xbmc
+
+from . import database
+from .util import log
+
+# Candidate appinfo.vdf files, relative to the Steam folder. On Linux, ~/.steam links to the real Steam folder.
+APPINFO_FILES = (os.path.join('appcache', 'appinfo.vdf'), os.path.join('steam', 'appcache', 'appinfo.vdf'), os.path.join('root', 'appcache', 'appinfo.vdf'))
+
+INDEX_FILE = 'appinfo.index'
+
+# https://github.com/SteamDatabase/SteamAppInfo
+MAGIC_V27 = 0x07564427
+MAGIC_V28 = 0x07564428  # Adds the hash of the binary data to the header of each entry
+MAGIC_V29 = 0x07564429  # Keys are indexes in a string table located at the end of the file
+
+HEADER = struct.Struct('<II')  # magic, universe
+STRING_TABLE_OFFSET = struct.Struct('<q')
+ENTRY_HEADER = struct.Struct('<II')  # appid, size of the rest of the entry
+# info_state, last_updated, pics_token, text sha1, change_number, then the binary sha1 since v28
+ENTRY_METADATA_SIZE = {MAGIC_V27: 4 + 4 + 8 + 20 + 4, MAGIC_V28: 4 + 4 + 8 + 20 + 4 + 20, MAGIC_V29: 4 + 4 + 8 + 20 + 4 + 20}
+
+INDEX_HEADER = struct.Struct('<qqI')  # mtime_ns, size, number of entries
+
+# Binary key values types
+TYPE_MAP = 0x00
+TYPE_STRING = 0x01
+TYPE_INT32 = 0x02
+TYPE_FLOAT32 = 0x03
+TYPE_POINTER = 0x04
+TYPE_WIDE_STRING = 0x05
+TYPE_COLOR = 0x06
+TYPE_UINT64 = 0x07
+TYPE_END = 0x08
+TYPE_INT64 = 0x0A
+TYPE_END_ALTERNATE = 0x0B
+FIXED_SIZE_TYPES = {TYPE_INT32: struct.Struct('<i'), TYPE_FLOAT32: struct.Struct('<f'), TYPE_POINTER: struct.Struct('<i'),
+                    TYPE_COLOR: struct.Struct('<i'), TYPE_UINT64: struct.Struct('<Q'), TYPE_INT64: struct.Struct('<q')}
+KEY_INDEX = struct.Struct('<I')
+
+# The reader of the current appinfo.vdf file, see :func:`_get_reader`
+_reader = None
+
+
+class AppInfoReader(object):
+    """
+    Lazily indexed reader of a binary appinfo.vdf file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        file_stat = os.stat(path)
+        self.signature = (file_stat.st_mtime_ns, file_stat.st_size)
+        with open(path, 'rb') as appinfo_file:
+            self._mmap = mmap.mmap(appinfo_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.magic, universe = HEADER.unpack_from(self._mmap, 0)
+        if self.magic not in ENTRY_METADATA_SIZE:
+            raise ValueError('Unsupported appinfo.vdf version {0:#x}'.format(self.magic))
+        self._entries_offset = HEADER.size
+        self._string_table_offset = None
+        if self.magic >= MAGIC_V29:
+            self._string_table_offset, = STRING_TABLE_OFFSET.unpack_from(self._mmap, HEADER.size)
+            self._entries_offset += STRING_TABLE_OFFSET.size
+        self._strings = None
+        self._appids, self._offsets = self._load_index()
+
+    def _load_index(self):
+        """
+        Loads the persisted appid -> offset index if it matches the file, builds and persists it otherwise.
+
+        :return: a tuple of two arrays, the sorted appids and the offsets of their entries
+        """
+        index_path = os.path.join(database.addonUserDataFolder, INDEX_FILE)
+        try:
+            with open(index_path, 'rb') as index_file:
+                mtime_ns, size, count = INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))
+                if (mtime_ns, size) == self.signature:
+                    appids, offsets = array('I'), array('Q')
+                    appids.fromfile(index_file, count)
+                    offsets.fromfile(index_file, count)
+                    return appids, offsets
+        except (IOError, OSError, EOFError, struct.error):
+            pass
+
+        entries = []
+        offset = self._entries_offset
+        end = len(self._mmap) if self._string_table_offset is None else self._string_table_offset
+        while offset + ENTRY_HEADER.size <= end:
+            appid, size = ENTRY_HEADER.unpack_from(self._mmap, offset)
+            if appid == 0:  # End of the entries
+                break
+            entries.append((appid, offset))
+            offset += ENTRY_HEADER.size + size
+        entries.sort()
+        appids = array('I', (appid for appid, offset in entries))
+        offsets = array('Q', (offset for appid, offset in entries))
+
+        try:
+            os.makedirs(database.addonUserDataFolder, exist_ok=True)
+            with open(index_path + '.tmp', 'wb') as index_file:
+                index_file.write(INDEX_HEADER.pack(self.signature[0], self.signature[1], len(appids)))
+                appids.tofile(index_file)
+                offsets.tofile(index_file)
+            os.replace(index_path + '.tmp', index_path)
+        except (IOError, OSError) as e:
+            log('Unable to persist the appinfo.vdf index: {0}'.format(e), xbmc.LOGWARNING)
+        log('Indexed {0} entries of {1}'.format(len(appids), self.path))
+        return appids, offsets
+
+    def _get_strings(self):
+        if self._strings is None:
+            count, = KEY_INDEX.unpack_from(self._mmap, self._string_table_offset)
+            self._strings = [string.decode('utf-8', errors='replace') for string in
+                             self._mmap[self._string_table_offset + KEY_INDEX.size:].split(b'\0', count)[:count]]
+        return self._strings
+
+    def _read_string(self, offset):
+        end = self._mmap.find(b'\0', offset)
+        return self._mmap[offset:end].decode('utf-8', errors='replace'), end + 1
+
+    def _decode_key_values(self, offset):
+        """
+        Decodes a binary key values map, without recursion.
+
+        :return: a tuple (dict with lowercase keys, offset after the map)
+        """
+        root = {}
+        maps = [root]
+        strings = self._get_strings() if self.magic >= MAGIC_V29 else None
+        while maps:
+            value_type = self._mmap[offset]
+            offset += 1
+            if value_type == TYPE_END or value_type == TYPE_END_ALTERNATE:
+                maps.pop()
+                continue
+
+            if strings is not None:
+                key_index, = KEY_INDEX.unpack_from(self._mmap, offset)
+                key = strings[key_index]
+                offset += KEY_INDEX.size
+            else:
+                key, offset = self._read_string(offset)
+            key = key.lower()
+
+            if value_type == TYPE_MAP:
+                value = {}
+                maps[-1][key] = value
+                maps.append(value)
+            elif value_type == TYPE_STRING:
+                maps[-1][key], offset = self._read_string(offset)
+            elif value_type == TYPE_WIDE_STRING:
+                end = offset
+                while self._mmap[end:end + 2] != b'\0\0':
+                    end += 2
+                maps[-1][key] = self._mmap[offset:end].decode('utf-16-le', errors='replace')
+                offset = end + 2
+            elif value_type in FIXED_SIZE_TYPES:
+                value_struct = FIXED_SIZE_TYPES[value_type]
+                maps[-1][key], = value_struct.unpack_from(self._mmap, offset)
+                offset += value_struct.size
+            else:
+                raise ValueError('Unknown binary key values type {0:#x} at offset {1}'.format(value_type, offset - 1))
+        return root, offset
+
+    def get_app_info(self, appid):
+        """
+        Decodes the entry of an app.
+
+        :param appid: appid of the app
+        :return: the key values of the app as a dict with lowercase keys, usually holding an "appinfo" dict. None if the app is not in the file
+        """
+        appid = int(appid)
+        position = bisect_left(self._appids, appid)
+        if position == len(self._appids) or self._appids[position] != appid:
+            return None
+        offset = self._offsets[position] + ENTRY_HEADER.size + ENTRY_METADATA_SIZE[self.magic]
+        return self._decode_key_values(offset)[0]
+
+    def close(self):
+        self._mmap.close()
+
+
+def find_appinfo_file(steam_path):
+    """
+    :param steam_path: Path to the Steam folder
+    :return: the path to the appinfo.vdf file of the Steam client, or None if it can't be found
+    """
+    return next((os.path.join(steam_path, appinfo_file) for appinfo_file in APPINFO_FILES if os.path.isfile(os.path.join(steam_path, appinfo_file))), None)
+
+
+def _get_reader(steam_path):
+    """
+    :return: a reader of the current appinfo.vdf file, reopened when the file changed. None if the file can't be found or read
+    """
+    global _reader
+    path = find_appinfo_file(steam_path)
+    if path is None:
+        return None
+
+    try:
+        file_stat = os.stat(path)
+        if _reader is None or _reader.path != path or _reader.signature != (file_stat.st_mtime_ns, file_stat.st_size):
+            if _reader is not None:
+                _reader.close()
+                _reader = None
+            _reader = AppInfoReader(path)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        log('Unable to read {0}: {1}'.format(path, e), xbmc.LOGWARNING)
+        return None
+    return _reader
+
+
+def get_library_assets(steam_path, appids):
+    """
+    Obtains the library assets available for many apps, according to the local appinfo.vdf of the Steam client.
+
+    :param steam_path: Path to the Steam folder
+    :param appids: list of appids
+    :return: dictionary mapping each appid whose assets are known to the set of its library asset names (library_capsule, library_hero, library_logo...).
+        Apps missing from the file, or without library assets data, are absent.
+    """
+    reader = _get_reader(steam_path)
+    if reader is None:
+        return {}
+
+    library_assets = {}
+    for appid in appids:
+        try:
+            app_info = reader.get_app_info(appid)
+        except (ValueError, IndexError, struct.error) as e:
+            log('Unable to decode the appinfo of {0}: {1}'.format(appid, e), xbmc.LOGWARNING)
+            continue
+        assets = ((app_info or {}).get('appinfo', {}).get('common', {})).get('library_assets')
+        if isinstance(assets, dict):
+            library_assets[appid] = set(asset for asset in assets if asset.startswith('library_'))
+    return library_assets
@@ -0,0 +1,157 @@
+'''
+persistent index of the resolved arts of each game/app, along with the availability of the art urls it was built from
+'''
+
+import json
+import time
+
+from . import database
+
+ART_INDEX_FILE = 'arts.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS resolved_arts (
+    appid TEXT PRIMARY KEY,
+    img_icon_path TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    arts TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS art_availability (
+    url TEXT PRIMARY KEY,
+    available INTEGER NOT NULL,
+    checked_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    streak INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+def _add_availability_streak(connection):
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(art_availability)')]
+    if 'streak' not in columns:  # Indexes written before the re-probe scheduler
+        connection.execute('ALTER TABLE art_availability ADD COLUMN streak INTEGER NOT NULL DEFAULT 0')
+
+
+# Upgrades of the index written by previous versions, see :func:`database.migrate`
+MIGRATIONS = [
+    _add_availability_streak,
+]
+
+
+def _get_connection():
+    return database.get_connection(ART_INDEX_FILE, SCHEMA, MIGRATIONS)
+
+
+def get_resolved_arts(appids):
+    """
+    Reads the resolved arts of many games/apps in bulk.
+
+    :param appids: list of appids (as strings) to read
+    :return: dictionary mapping each indexed appid to a tuple (img_icon_path, {art_type: (art_url, expires_at)}).
+        expires_at is None for art types that never need to be resolved again.
+    """
+    resolved_arts = {}
+    connection = _get_connection()
+    for chunk in database.chunks(list(appids)):
+        rows = connection.execute('SELECT appid, img_icon_path, arts FROM resolved_arts WHERE appid IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+        for appid, img_icon_path, arts in rows:
+            resolved_arts[appid] = (img_icon_path, {art_type: tuple(art) for art_type, art in json.loads(arts).items()})
+    return resolved_arts
+
+
+def set_resolved_arts(entries, checked_at=None):
+    """
+    Writes the resolved arts of many games/apps in a single transaction, replacing their previous rows.
+
+    :param entries: iterable of (appid, img_icon_path, {art_type: (art_url, expires_at)}) tuples
+    :param checked_at: timestamp at which the arts were resolved. Defaults to the current time
+    """
+    checked_at = time.time() if checked_at is None else checked_at
+    with _get_connection() as connection:
+        connection.executemany('INSERT OR REPLACE INTO resolved_arts (appid, img_icon_path, checked_at, arts) VALUES (?, ?, ?, ?)',
+                               ((appid, img_icon_path, checked_at, json.dumps(arts, separators=(',', ':'))) for appid, img_icon_path, arts in entries))
+
+
+def delete_resolved_arts(appids):
+    """
+    Deletes the resolved arts of many games/apps, for example the ones removed from the library.
+
+    :param appids: list of appids (as strings) to delete
+    """
+    with _get_connection() as connection:
+        for chunk in database.chunks(list(appids)):
+            connection.execute('DELETE FROM resolved_arts WHERE appid IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+
+
+def get_availabilities(urls, now=None, include_expired=False):
+    """
+    Reads the known availability of many art urls in bulk.
+
+    :param urls: list of art urls
+    :param now: timestamp used to filter out expired results. Defaults to the current time
+    :param include_expired: whether to also return expired results, for example to serve them when the network is unavailable
+    :return: dictionary mapping each known url to a boolean, True if the art is available
+    """
+    now = time.time() if now is None else now
+    availabilities = {}
+    connection = _get_connection()
+    for chunk in database.chunks(list(urls)):
+        rows = connection.execute('SELECT url, available, expires_at FROM art_availability WHERE url IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+        for url, available, expires_at in rows:
+            if include_expired or expires_at > now:
+                availabilities[url] = bool(available)
+    return availabilities
+
+
+def get_availability_entries(urls):
+    """
+    Reads the known availability of many art urls in bulk, along with when they expire, expired or not.
+
+    :param urls: list of art urls
+    :return: dictionary mapping each known url to a tuple (available, expires_at, streak).
+        streak is the number of consecutive checks which confirmed the result before the last one.
+    """
+    entries = {}
+    connection = _get_connection()
+    for chunk in database.chunks(list(urls)):
+        rows = connection.execute('SELECT url, available, expires_at, streak FROM art_availability WHERE url IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+        for url, available, expires_at, streak in rows:
+            entries[url] = (bool(available), expires_at, streak)
+    return entries
+
+
+def set_availabilities(entries, checked_at=None):
+    """
+    Writes the availability of many art urls in a single transaction.
+
+    :param entries: dictionary mapping art urls to a tuple (available, expires_at, streak), see :func:`get_availability_entries`
+    :param checked_at: timestamp at which the urls were checked. Defaults to the current time
+    """
+    checked_at = time.time() if checked_at is None else checked_at
+    with _get_connection() as connection:
+        connection.executemany('INSERT OR REPLACE INTO art_availability (url, available, checked_at, expires_at, streak) VALUES (?, ?, ?, ?, ?)',
+                               ((url, int(available), checked_at, expires_at, streak) for url, (available, expires_at, streak) in entries.items()))
+
+
+def import_availabilities(entries):
+    """
+    Writes the availability of many art urls checked earlier, for example by previous versions of the addon, in a single transaction.
+    The urls already in the index are left unchanged, their availability being more recent.
+
+    :param entries: iterable of (url, available, checked_at, expires_at) tuples
+    :return: number of urls written
+    """
+    with _get_connection() as connection:
+        changes = connection.total_changes
+        connection.executemany('INSERT OR IGNORE INTO art_availability (url, available, checked_at, expires_at) VALUES (?, ?, ?, ?)',
+                               ((url, int(available), checked_at, expires_at) for url, available, checked_at, expires_at in entries))
+        return connection.total_changes - changes
+
+
+def clear():
+    """
+    Deletes every resolved art and art availability of the index
+    """
+    with _get_connection() as connection:
+        connection.execute('DELETE FROM resolved_arts')
+        connection.execute('DELETE FROM art_availability')
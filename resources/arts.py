@@ -1,37 +1,90 @@
 import xbmcaddon
 import xbmcvfs
 
+import hashlib
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
-import requests
-import requests_cache
-
+from . import appinfo
+from . import artindex
+from . import cdn
+from . import perf
+from . import singleflight
+from . import transport
 from .util import log
 
 __addon__ = xbmcaddon.Addon()
 artFallbackEnabled = __addon__.getSetting("enable-art-fallback") == 'true'  # Kodi stores boolean settings as strings
 monthsBeforeArtsExpiration = int(__addon__.getSetting("arts-expire-after-months"))  # Default is 2 months
+artProbeWorkers = max(1, int(__addon__.getSetting("art-probe-workers") or 8))  # Default is 8 concurrent availability checks
+localAppInfoEnabled = __addon__.getSetting("enable-local-appinfo") != 'false'  # Default is true
+daysBeforeMissingArtsExpiration = max(1, int(__addon__.getSetting("missing-arts-expire-after-days") or 7))  # Default is 7 days
+artReprobeBudget = max(0, int(__addon__.getSetting("art-reprobe-budget") or 50))  # Default is 50 expired urls checked again per listing, 0 for no limit
 
-# define the cache file to reside in the ..\Kodi\userdata\addon_data\(your addon)
+# The requests-cache file which used to hold the arts availability, before the arts index replaced it.
 addonUserDataFolder = xbmcvfs.translatePath(__addon__.getAddonInfo('profile'))
 ART_AVAILABILITY_CACHE_FILE = xbmcvfs.translatePath(os.path.join(addonUserDataFolder, 'requests_cache_arts'))
 
-cached_requests = requests_cache.core.CachedSession(ART_AVAILABILITY_CACHE_FILE, backend='sqlite',
-                                                    expire_after= timedelta(weeks=4*monthsBeforeArtsExpiration),
-                                                    allowable_methods=('HEAD',), allowable_codes=(200, 404),
-                                                    old_data_on_error=True,
-                                                    fast_save=True)
-# Existing Steam art types urls, to format to format with appid / img_icon_path
+# Time to live of the availability checks, see :func:`get_availability_ttl`.
+# Available arts rarely disappear, missing ones (mostly heroes and logos) are checked again sooner in case they were published since.
+ART_AVAILABILITY_EXPIRATION = timedelta(weeks=4 * monthsBeforeArtsExpiration).total_seconds()
+MISSING_ART_EXPIRATION = min(timedelta(days=daysBeforeMissingArtsExpiration).total_seconds(), ART_AVAILABILITY_EXPIRATION)
+# Every check confirming the previous result doubles the time to live, up to this factor for the available arts
+AVAILABLE_ART_MAX_BACKOFF = 4
+# The times to live are spread by this fraction, so that the urls checked together don't all expire together
+EXPIRATION_JITTER = 0.2
+# Delay before the arts resolved from an expired availability, whose check was deferred by the re-probe budget, are resolved again
+DEFERRED_REPROBE_DELAY = 3600
+
+# Number of expired availabilities which may still be checked again by this invocation, None for no limit. See :func:`set_reprobe_budget`
+_reprobe_budget = artReprobeBudget or None
+_reprobe_budget_lock = threading.Lock()
+
+# Session of the availability checks, created on first use by :func:`get_session`
+_session = None
+_session_lock = threading.Lock()
+
+# Prefix of the single-flight locks of the availability checks, so that concurrent invocations don't check the same urls. The urls are hashed to this many locks
+ART_CHECK_LOCK_PREFIX = 'art-check-'
+ART_CHECK_LOCK_BUCKETS = 256
+_check_locks = [threading.Lock() for bucket in range(ART_CHECK_LOCK_BUCKETS)]
+# Maximum number of seconds a check waits for another invocation checking a url of the same lock, after which the url is checked anyway
+ART_CHECK_LOCK_TIMEOUT = 10
+# Maximum number of seconds waited for the checks which missed the deadline of their listing, see :func:`complete_late_arts`
+LATE_ARTS_TIMEOUT = 30
+
+# Serializes the writes of the checks of this invocation to the arts index, which would otherwise wait for each other in the busy handler of sqlite
+_index_lock = threading.Lock()
+
+# Availability checks which missed the deadline of their listing keep running in the background. url -> future
+_checks_in_progress = {}
+# Games/apps whose arts were not fully resolved before the deadline of their listing. appid -> img_icon_path
+_late_apps = {}
+
+# Number of hosts of the CDN pool tried by an availability check before giving up
+CDN_ATTEMPTS = 2
+
+# Existing Steam art types paths on the CDN, to format with appid / img_icon_path. Every host of the CDN pool serves them, see :mod:`cdn`
 STEAM_ARTS_TYPES = {  # img_icon_path is provided by steam API to get the icon. https://developer.valvesoftware.com/wiki/Steam_Web_API#GetOwnedGames_.28v0001.29
-    'poster': 'http://cdn.akamai.steamstatic.com/steam/apps/{appid}/library_600x900.jpg',  # Can return 404
-    'hero': 'http://cdn.akamai.steamstatic.com/steam/apps/{appid}/library_hero.jpg',  # Can return 404
-    'header': 'http://cdn.akamai.steamstatic.com/steam/apps/{appid}/header.jpg',
-    'generated_bg': 'http://cdn.akamai.steamstatic.com/steam/apps/{appid}/page_bg_generated_v6b.jpg',  # Auto generated background with a shade of blue.
-    'icon': 'https://steamcdn-a.akamaihd.net/steamcommunity/public/images/apps/{appid}/{img_icon_path}.jpg',
-    'clearlogo': 'http://cdn.akamai.steamstatic.com/steam/apps/{appid}/logo.png'  # Can return 404
+    'poster': '/steam/apps/{appid}/library_600x900.jpg',  # Can return 404
+    'hero': '/steam/apps/{appid}/library_hero.jpg',  # Can return 404
+    'header': '/steam/apps/{appid}/header.jpg',
+    'generated_bg': '/steam/apps/{appid}/page_bg_generated_v6b.jpg',  # Auto generated background with a shade of blue.
+    'icon': '/steamcommunity/public/images/apps/{appid}/{img_icon_path}.jpg',
+    'clearlogo': '/steam/apps/{appid}/logo.png'  # Can return 404
+}
+
+# Library assets of the local appinfo.vdf telling whether the art urls which can return 404 are available, see :mod:`appinfo`
+APPINFO_ASSETS = {
+    STEAM_ARTS_TYPES['poster']: 'library_capsule',
+    STEAM_ARTS_TYPES['hero']: 'library_hero',
+    STEAM_ARTS_TYPES['clearlogo']: 'library_logo'
 }
 
-# Dictionary containing for each art type, a url for the art (to format with appid / img_icon_path afterwards), and a fallback art type.
+# Dictionary containing for each art type, a path for the art (to format with appid / img_icon_path afterwards), and a fallback art type.
 # Having no fallback also means that the art url won't be tested
 ARTS_ASSIGNMENTS = {
     'poster': {'url': STEAM_ARTS_TYPES['poster'], 'fallback': 'landscape'},
@@ -45,23 +98,255 @@ ARTS_ASSIGNMENTS = {
     'clearlogo': {'url': STEAM_ARTS_TYPES['clearlogo'], 'fallback': None}
 }
 
+# Art types set on the list items of the games. Multiple fanart https://kodi.wiki/view/Artwork_types#fanart.23
+SUPPORTED_ART_TYPES = ['poster', 'landscape', 'banner', 'clearlogo', 'thumb', 'fanart', 'fanart1', 'fanart2', 'icon']
+
+
+def get_session():
+    """
+    Obtains the session of the availability checks and art downloads, creating it on first use so that the routes which don't use the network skip importing requests.
+    The first use may happen concurrently in several worker threads.
+
+    :return: a :class:`requests.Session`
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = transport.create_session(pool_size=artProbeWorkers)
+        return _session
+
+
+def get_availability_ttl(available, streak=0, random_generator=random):
+    """
+    Schedules the next check of an art url. Missing arts are checked again after `missing-arts-expire-after-days`, available ones after `arts-expire-after-months`.
+    Every check confirming the previous result doubles the time to live : up to `arts-expire-after-months` for the missing arts, and 4 times that for the available ones.
+    A random jitter spreads the checks of the urls first checked together over several invocations.
+
+    :param available: result of the check, True if the art is available
+    :param streak: number of consecutive checks which confirmed the result before this one
+    :param random_generator: source of the jitter. Defaults to the random module
+    :return: number of seconds after which the url must be checked again
+    """
+    backoff = 2 ** min(streak, 16)
+    if available:
+        ttl = ART_AVAILABILITY_EXPIRATION * min(backoff, AVAILABLE_ART_MAX_BACKOFF)
+    else:
+        ttl = min(MISSING_ART_EXPIRATION * backoff, ART_AVAILABILITY_EXPIRATION)
+    return ttl * random_generator.uniform(1 - EXPIRATION_JITTER, 1 + EXPIRATION_JITTER)
+
+
+def set_reprobe_budget(budget):
+    """
+    Sets the number of expired availabilities which may still be checked again by this invocation.
+    The expired availabilities beyond the budget are served as they are, and checked again by a later invocation.
+
+    :param budget: number of checks, None for no limit
+    """
+    global _reprobe_budget
+    with _reprobe_budget_lock:
+        _reprobe_budget = budget
+
+
+def _take_reprobe_budget(count):
+    """
+    :return: how many of `count` expired availabilities may be checked again, taken from the budget of the invocation
+    """
+    global _reprobe_budget
+    with _reprobe_budget_lock:
+        if _reprobe_budget is None:
+            return count
+        taken = min(count, _reprobe_budget)
+        _reprobe_budget -= taken
+        return taken
+
+
+def _get_known_availabilities(urls, now=None):
+    """
+    Reads the availability of many art urls from the arts index. The expired ones are only checked again within the re-probe budget of the invocation,
+    the other expired ones are served as if they were fresh.
+
+    :return: dictionary mapping the urls which don't need a check to a boolean, True if the art is available
+    """
+    now = time.time() if now is None else now
+    entries = artindex.get_availability_entries(urls)
+    availabilities = {}
+    expired_urls = []
+    for url, (available, expires_at, streak) in entries.items():
+        if expires_at > now:
+            availabilities[url] = available
+        else:
+            expired_urls.append((expires_at, url))
+
+    expired_urls.sort()  # The longest expired are checked first
+    reprobe_count = _take_reprobe_budget(len(expired_urls))
+    for expires_at, url in expired_urls[reprobe_count:]:
+        availabilities[url] = entries[url][0]
+    perf.count('art_availability_hits', len(entries) - len(expired_urls))
+    perf.count('art_reprobes', reprobe_count)
+    perf.count('art_reprobes_deferred', len(expired_urls) - reprobe_count)
+    return availabilities
+
+
+def check_art_url(url, timeout=2):
+    """
+    Sends a HEAD request to check if an art is available on the CDN, without any cache.
+    When the preferred host of the CDN pool does not answer, it is failed over and the request is sent to the next host.
+
+    :param url: path of the art on the CDN to check availability
+    :param timeout: timeout of each request in seconds. Default is 2
+    :return: boolean False if the status code is between 400&600 , True otherwise. None if the requests themselves failed.
+    """
+    for host in cdn.get_hosts()[:CDN_ATTEMPTS]:
+        perf.count('head_requests')
+        try:
+            response = get_session().head(host + url, timeout=timeout)
+        except IOError:
+            perf.count('head_failures')
+            cdn.report_failure(host)
+            continue
+        return not 400 <= response.status_code < 600  # We consider valid any status codes below 400 or above 600
+    return None
+
+
+def _get_check_lock_bucket(url):
+    """
+    :return: index of the single-flight lock of the availability check of an art url. Only the urls hashed to the same lock wait for each other
+    """
+    return int(hashlib.sha1(url.encode('utf-8')).hexdigest()[:8], 16) % ART_CHECK_LOCK_BUCKETS
+
+
+def check_and_index_art_url(url, timeout=2):
+    """
+    Checks the availability of an art and writes it to the arts index, unless another invocation indexed it while we were waiting for the lock of the url.
+    The lock is only held during the check of this url, so that the invocations only wait for each other on identical checks.
+
+    :param url: path of the art on the CDN to check availability
+    :param timeout: timeout of each request in seconds. Default is 2
+    :return: boolean, True if the art is available. None if the requests failed, in which case nothing is indexed.
+    """
+    bucket = _get_check_lock_bucket(url)
+    # The threads of this invocation wait for each other on the lock of the bucket, instead of polling its lock file
+    with _check_locks[bucket], singleflight.lock(ART_CHECK_LOCK_PREFIX + str(bucket), timeout=ART_CHECK_LOCK_TIMEOUT):
+        indexed_availabilities = artindex.get_availabilities([url])
+        if url in indexed_availabilities:  # Checked by another invocation while we were waiting
+            return indexed_availabilities[url]
+        available = check_art_url(url, timeout)
+        _index_availabilities({url: available})
+    return available
+
+
+def check_art_urls(urls, map_function=map):
+    """
+    Checks the availability of many arts. Uses the arts index to speed things up or serve offline if a connection is unavailable.
+    The arts are identified by their host independent path, so that the index stays valid when the CDN host changes.
+    When another invocation is already checking one of the urls, we wait for it instead of checking it again, see :func:`check_and_index_art_url`.
+
+    :param urls: list of art paths to check availability
+    :param map_function: function used to run :func:`check_and_index_art_url` on the urls which are not in the index, for example the map method of an executor
+    :return: dictionary mapping each url to a boolean, True if the resource is available
+    """
+    availabilities = _get_known_availabilities(urls)
+    urls_to_check = [url for url in urls if url not in availabilities]
+    if urls_to_check:
+        availabilities.update(_replace_failed_checks(dict(zip(urls_to_check, map_function(check_and_index_art_url, urls_to_check)))))
+    return availabilities
+
+
+def _check_art_urls_until(urls, executor, deadline):
+    """
+    Checks the availability of many online resources on an executor, waiting for the results until a deadline at most.
+    The checks which miss the deadline keep running, see :func:`complete_late_arts`.
+
+    :return: dictionary mapping each url checked before the deadline to a boolean, True if the resource is available
+    """
+    availabilities = _get_known_availabilities(urls)
+    if len(availabilities) == len(urls):
+        return availabilities
+
+    futures = {}
+    for url in urls:
+        if url not in availabilities:
+            if url not in _checks_in_progress:
+                _checks_in_progress[url] = executor.submit(check_and_index_art_url, url)
+            futures[url] = _checks_in_progress[url]
+
+    with perf.span('art_probes'):
+        wait(futures.values(), timeout=None if deadline is None else max(0, deadline - time.time()))
+    checked_availabilities = {}
+    for url, future in futures.items():
+        if future.done():
+            checked_availabilities[url] = future.result()
+            del _checks_in_progress[url]
+
+    availabilities.update(_replace_failed_checks(checked_availabilities))
+    return availabilities
+
+
+def _index_availabilities(checked_availabilities):
+    """
+    Writes the results of availability checks to the arts index, each with its own expiration, see :func:`get_availability_ttl`. Failed checks are not written.
+    """
+    now = time.time()
+    successful_checks = dict((url, available) for url, available in checked_availabilities.items() if available is not None)
+    if not successful_checks:
+        return
+    previous_entries = artindex.get_availability_entries(list(successful_checks))
+    entries = {}
+    for url, available in successful_checks.items():
+        previous_available, previous_expires_at, previous_streak = previous_entries.get(url, (None, None, -1))
+        streak = previous_streak + 1 if previous_available == available else 0
+        entries[url] = (available, now + get_availability_ttl(available, streak), streak)
+    with _index_lock:
+        artindex.set_availabilities(entries, now)
+
+
+def _replace_failed_checks(checked_availabilities):
+    """
+    Replaces the failed checks by the expired result of the index if there is one, or considers their art unavailable otherwise.
+
+    :return: the checked availabilities, without None
+    """
+    failed_urls = [url for url, available in checked_availabilities.items() if available is None]
+    if failed_urls:  # We could not reach the server, serve expired results if we have some. Otherwise, we consider the art unavailable.
+        expired_availabilities = artindex.get_availabilities(failed_urls, include_expired=True)
+        checked_availabilities.update({url: expired_availabilities.get(url, False) for url in failed_urls})
+    return checked_availabilities
+
+
+def get_local_library_assets(appids):
+    """
+    Reads the library assets of many games/apps from the appinfo.vdf of the local Steam client, when it is enabled and available.
+
+    :param appids: list of appids
+    :return: dictionary mapping each appid whose assets are known locally to the set of its library asset names, see :func:`appinfo.get_library_assets`
+    """
+    steam_path = __addon__.getSetting('steam-path')
+    if not localAppInfoEnabled or not steam_path:
+        return {}
+    if os.path.isfile(steam_path):  # On Windows, the setting holds the path to Steam.exe
+        steam_path = os.path.dirname(steam_path)
+    return appinfo.get_library_assets(steam_path, appids)
+
+
+def _get_local_availability(requested_art, appid, library_assets):
+    """
+    :return: the availability of an art according to the library assets of the local appinfo.vdf, or None if they don't tell
+    """
+    asset = APPINFO_ASSETS.get(requested_art.get('url'))
+    if asset is None or appid not in library_assets:
+        return None
+    return asset in library_assets[appid]
+
 
 def is_art_url_available(url, timeout=2):
     """
-    Sends a HEAD request to check if an online resource is available. Uses a cache mechanism to speed things up or serve offline if a connection is unavailable.
+    Sends a HEAD request to check if an online resource is available. Uses the arts index to speed things up or serve offline if a connection is unavailable.
 
     :param url: url to check availability
     :param timeout: timeout of the request in seconds. Default is 2
     :return: boolean False if the status code is between 400&600 , True otherwise
     """
-    result = False
-    try:
-        response = cached_requests.head(url, timeout=timeout)
-        if not 400 <= response.status_code < 600:  # We consider valid any status codes below 400 or above 600
-            result = True
-    except IOError:
-        result = False
-    return result
+    return check_art_urls([url], map_function=lambda check, urls: (check(url, timeout) for url in urls))[url]
 
 
 def resolve_art_url(art_type, appid, img_icon_path='', art_fallback_enabled=artFallbackEnabled):
@@ -73,39 +358,260 @@ def resolve_art_url(art_type, appid, img_icon_path='', art_fallback_enabled=artF
     :param appid: appid of the game/app we want to get the art for.
     :param img_icon_path: A path provided by steam to get the icon art url. https://developer.valvesoftware.com/wiki/Steam_Web_API#GetOwnedGames_.28v0001.29
     :param art_fallback_enabled: Whether to fall back to another art type if an art is unavailable. Defaults to the user addon settings, which default to true
-    :return: resolved art URL. Can be the URL of another available art if .
+    :return: resolved art URL, on the preferred host of the CDN pool. Can be the URL of another available art if .
     """
     valid_art_url = None
     requested_art = ARTS_ASSIGNMENTS.get(art_type, None)
+    library_assets = get_local_library_assets([appid]) if art_fallback_enabled else {}
 
     while valid_art_url is None and requested_art is not None:  # If the current media type is defined and we did not find a valid url yet
         art_url = requested_art.get('url').format(appid=appid, img_icon_path=img_icon_path)  # We replace "{appid}" and "{img_icon_path}" in the url
         fallback_art_type = requested_art.get("fallback", None)
-        if (not art_fallback_enabled) or (fallback_art_type is None) or is_art_url_available(art_url):
+        local_availability = _get_local_availability(requested_art, appid, library_assets)
+        if (not art_fallback_enabled) or (fallback_art_type is None) or local_availability \
+                or (local_availability is None and is_art_url_available(art_url)):
             # If art fallback is disabled, or if there is no fallback defined, we directly assume the art url as valid.
-            # Otherwise, if art fallback is enabled and there is a fallback defined, we check if is_art_url_available before proceeding
+            # Otherwise, if art fallback is enabled and there is a fallback defined, we check the local Steam client data, then is_art_url_available, before proceeding
             valid_art_url = art_url
         else:  # If art fallback is enabled and art is not available, we set the current art data to the defined fallback, before retrying.
             requested_art = ARTS_ASSIGNMENTS.get(fallback_art_type, None)  # Art data will be None if the fallback_art_type does not exist in the art_urls dict
 
     if valid_art_url is None:  # If the previous loop could not find a valid media url among the defined art types
         log("Issue resolving media {0} for app id {1}".format(art_type, appid))
+        return None
+
+    return cdn.get_url(valid_art_url)
+
+
+def resolve_art_urls(art_requests, art_fallback_enabled=artFallbackEnabled, max_workers=artProbeWorkers, deadline=None):
+    """
+    Resolve the art urls of many games/apps at once, for example every art type of every game of a directory listing.
+    Each distinct url is checked at most once, and the availability checks are run concurrently on a bounded pool of worker threads.
+    Fallback chains are walked in rounds : every round checks all the urls currently needed by the unresolved requests, then moves the unavailable ones to their fallback.
+    Requests still waiting for a check when the deadline is reached get the url being checked, without fallback, and their app is recorded as late.
+    The library assets of the local Steam client, when known, decide the availability of the urls they cover without any check.
+
+    :param art_requests: iterable of (appid, art_type, img_icon_path) tuples, with art_type being a valid art type defined in :const:`ARTS_ASSIGNMENTS`
+    :param art_fallback_enabled: Whether to fall back to another art type if an art is unavailable. Defaults to the user addon settings, which default to true
+    :param max_workers: maximum number of availability checks running at the same time. Defaults to the user addon settings
+    :param deadline: timestamp after which the resolution stops waiting for availability checks. None to wait for every check
+    :return: dictionary mapping each (appid, art_type) tuple to its resolved art path on the CDN, or None if it could not be resolved.
+    """
+    pending = {}  # (appid, art_type) -> (art data currently tried, img_icon_path)
+    for appid, art_type, img_icon_path in art_requests:
+        pending[(appid, art_type)] = (ARTS_ASSIGNMENTS.get(art_type, None), img_icon_path)
 
-    return valid_art_url
+    resolved_urls = {}
+    availability = {}  # url -> boolean, filled as the availability checks complete
+    late_urls = set()  # urls whose availability check missed the deadline
+    library_assets = get_local_library_assets(set(appid for appid, art_type in pending)) if art_fallback_enabled else {}
+    # The executor is not waited for on exit, checks which missed the deadline finish in the background
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending:
+            urls_to_check = set()
+            for (appid, art_type), (requested_art, img_icon_path) in list(pending.items()):
+                # Walk the fallback chain as far as the already known availabilities allow
+                valid_art_url = None
+                while valid_art_url is None and requested_art is not None:
+                    art_url = requested_art.get('url').format(appid=appid, img_icon_path=img_icon_path)
+                    fallback_art_type = requested_art.get("fallback", None)
+                    if art_url not in availability:
+                        local_availability = _get_local_availability(requested_art, appid, library_assets)
+                        if local_availability is not None:
+                            perf.count('art_local_hits')
+                            availability[art_url] = local_availability
+                    if (not art_fallback_enabled) or (fallback_art_type is None) or availability.get(art_url, False):
+                        valid_art_url = art_url
+                    elif art_url in late_urls:  # Too late to check, we assume the art url as valid until the check completes
+                        valid_art_url = art_url
+                        _late_apps[appid] = img_icon_path
+                    elif art_url not in availability:  # Unknown availability, this url needs to be checked before going any further
+                        urls_to_check.add(art_url)
+                        break
+                    else:
+                        perf.count('art_fallbacks')
+                        requested_art = ARTS_ASSIGNMENTS.get(fallback_art_type, None)
+
+                if valid_art_url is None and requested_art is not None:  # Waiting for an availability check, we will retry in the next round
+                    pending[(appid, art_type)] = (requested_art, img_icon_path)
+                    continue
+
+                if valid_art_url is None:  # The fallback chain could not find a valid media url
+                    log("Issue resolving media {0} for app id {1}".format(art_type, appid))
+                resolved_urls[(appid, art_type)] = valid_art_url
+                del pending[(appid, art_type)]
+
+            if urls_to_check:
+                availability.update(_check_art_urls_until(list(urls_to_check), executor, deadline))
+                late_urls.update(urls_to_check.difference(availability))
+    finally:
+        executor.shutdown(wait=False)
+
+    return resolved_urls
+
+
+def complete_late_arts(timeout=LATE_ARTS_TIMEOUT):
+    """
+    Waits for the availability checks which missed the deadline of their listing, then resolves and indexes the arts of the late games/apps.
+    The checks are indexed as they complete, see :func:`check_and_index_art_url`.
+
+    :param timeout: maximum number of seconds to wait for the checks, and then for the resolution of the late arts. Defaults to :const:`LATE_ARTS_TIMEOUT`
+    :return: True if late arts were resolved and indexed from successful checks, False if there were no late arts or if some checks failed or missed the timeout.
+    """
+    if not _late_apps:
+        return False
+
+    deadline = time.time() + timeout
+    done, not_done = wait(_checks_in_progress.values(), timeout=timeout)
+    checks_succeeded = not not_done and all(future.result() is not None for future in done)
+    for url in [url for url, future in _checks_in_progress.items() if future.done()]:
+        del _checks_in_progress[url]  # The checks still running are reused by the resolution of the late arts
+
+    late_apps = list(_late_apps.items())
+    _late_apps.clear()
+    resolve_apps_arts(late_apps, deadline=deadline)
+    return checks_succeeded and not any(appid in _late_apps for appid, img_icon_path in late_apps)
+
+
+def resolve_apps_arts(apps, art_types=SUPPORTED_ART_TYPES, art_fallback_enabled=artFallbackEnabled, max_workers=artProbeWorkers, deadline=None):
+    """
+    Resolve the art urls of many games/apps, using the arts index so that only the missing or expired art types are resolved again.
+    The newly resolved arts are written back to the index in a single transaction, except the ones of apps which missed the deadline.
+
+    :param apps: list of (appid, img_icon_path) tuples
+    :param art_types: list of valid art types, defined in :const:`ARTS_ASSIGNMENTS`. Defaults to :const:`SUPPORTED_ART_TYPES`
+    :param art_fallback_enabled: Whether to fall back to another art type if an art is unavailable. Defaults to the user addon settings, which default to true
+    :param max_workers: maximum number of availability checks running at the same time. Defaults to the user addon settings
+    :param deadline: timestamp after which the resolution stops waiting for availability checks, see :func:`resolve_art_urls`. None to wait for every check
+    :return: dictionary mapping each appid to a dictionary of its arts {art_type: art_url}, on the preferred host of the CDN pool
+    """
+    host = cdn.get_hosts()[0]  # Every url of the listing is built on the same host
+    if not art_fallback_enabled:  # Nothing to check, the art urls are only formatted. The index only holds arts resolved with fallback.
+        resolved_urls = resolve_art_urls([(appid, art_type, img_icon_path) for appid, img_icon_path in apps for art_type in art_types], art_fallback_enabled=False)
+        return _group_by_appid({key: _get_art_url(art_path, host) for key, art_path in resolved_urls.items()})
+
+    now = time.time()
+    with perf.span('art_index'):
+        indexed_arts = artindex.get_resolved_arts([appid for appid, img_icon_path in apps])
+
+    apps_arts = {}
+    art_requests = []
+    for appid, img_icon_path in apps:
+        indexed_img_icon_path, indexed_app_arts = indexed_arts.get(appid, (None, {}))
+        if indexed_img_icon_path != img_icon_path:  # The icon changed, every art of the app is resolved again
+            indexed_app_arts = {}
+        apps_arts[appid] = indexed_app_arts
+        art_requests.extend((appid, art_type, img_icon_path) for art_type in art_types
+                            if art_type not in indexed_app_arts or not _is_resolved_art_valid(indexed_app_arts[art_type], now))
+
+    perf.count('art_index_misses', len(art_requests))
+    perf.count('art_index_hits', len(apps) * len(art_types) - len(art_requests))
+    if art_requests:
+        resolved_urls = resolve_art_urls(art_requests, art_fallback_enabled=True, max_workers=max_workers, deadline=deadline)
+        img_icon_paths = dict((appid, img_icon_path) for appid, art_type, img_icon_path in art_requests)
+        checked_paths = dict((key, _get_checked_paths(key[0], key[1], img_icon_paths[key[0]], art_url)) for key, art_url in resolved_urls.items())
+        availability_entries = artindex.get_availability_entries(set(path for paths in checked_paths.values() for path in paths))
+        for (appid, art_type), art_url in resolved_urls.items():
+            apps_arts[appid][art_type] = (art_url, _get_resolution_expiration(checked_paths[(appid, art_type)], availability_entries, now))
+
+        # The arts of late apps are only indexed once their checks complete
+        updated_appids = set(appid for appid, art_type, img_icon_path in art_requests if appid not in _late_apps)
+        artindex.set_resolved_arts((appid, img_icon_path, apps_arts[appid]) for appid, img_icon_path in apps if appid in updated_appids)
+
+    # The index holds host independent paths, the urls are built on the current preferred host
+    return {appid: {art_type: _get_art_url(app_arts[art_type][0], host) for art_type in art_types} for appid, app_arts in apps_arts.items()}
+
+
+def get_unresolved_apps(apps, art_types=SUPPORTED_ART_TYPES, now=None):
+    """
+    Selects the games/apps which have art types to resolve, see :func:`resolve_apps_arts`, reading the arts index only.
+
+    :param apps: list of (appid, img_icon_path) tuples
+    :param art_types: list of valid art types, defined in :const:`ARTS_ASSIGNMENTS`. Defaults to :const:`SUPPORTED_ART_TYPES`
+    :param now: timestamp used to find the expired arts. Defaults to the current time
+    :return: list of the (appid, img_icon_path) tuples whose arts are missing, expired, or were resolved for another icon
+    """
+    now = time.time() if now is None else now
+    indexed_arts = artindex.get_resolved_arts([appid for appid, img_icon_path in apps])
+    unresolved_apps = []
+    for appid, img_icon_path in apps:
+        indexed_img_icon_path, indexed_app_arts = indexed_arts.get(appid, (None, {}))
+        if indexed_img_icon_path != img_icon_path or any(art_type not in indexed_app_arts or not _is_resolved_art_valid(indexed_app_arts[art_type], now)
+                                                         for art_type in art_types):
+            unresolved_apps.append((appid, img_icon_path))
+    return unresolved_apps
+
+
+def count_checked_urls(art_types=SUPPORTED_ART_TYPES):
+    """
+    Counts the distinct art urls which may need an availability check when resolving the given art types of a single game/app.
+    Only the first art url of each fallback chain is counted, it is an estimate used to rate limit the checks.
+
+    :param art_types: list of valid art types, defined in :const:`ARTS_ASSIGNMENTS`. Defaults to :const:`SUPPORTED_ART_TYPES`
+    :return: number of art urls
+    """
+    return len(set(ARTS_ASSIGNMENTS[art_type]['url'] for art_type in art_types if ARTS_ASSIGNMENTS[art_type]['fallback'] is not None))
+
+
+def _get_checked_paths(appid, art_type, img_icon_path, art_path):
+    """
+    :return: the paths whose availability decided the resolution of an art type : the ones of its fallback chain up to the resolved one, except the last resort which is never checked
+    """
+    checked_paths = []
+    requested_art = ARTS_ASSIGNMENTS.get(art_type, None)
+    while requested_art is not None and requested_art.get('fallback') is not None:
+        path = requested_art.get('url').format(appid=appid, img_icon_path=img_icon_path)
+        checked_paths.append(path)
+        if path == art_path:
+            break
+        requested_art = ARTS_ASSIGNMENTS.get(requested_art.get('fallback'), None)
+    return checked_paths
+
+
+def _get_resolution_expiration(checked_paths, availability_entries, now):
+    """
+    :return: the timestamp at which a resolved art must be resolved again : as soon as the availability of one of its checked paths expires.
+        None if the art type does not depend on any check and never expires.
+    """
+    if not checked_paths:
+        return None
+    expirations = [availability_entries[path][1] if path in availability_entries else now + get_availability_ttl(True)  # Decided by the local Steam client data
+                   for path in checked_paths]
+    # An availability already expired was served because its check was deferred, it will be checked by a later invocation
+    return max(min(expirations), now + DEFERRED_REPROBE_DELAY)
+
+
+def _get_art_url(art_path, host):
+    return None if art_path is None else cdn.get_url(art_path, host)
+
+
+def _is_resolved_art_valid(resolved_art, now):
+    art_url, expires_at = resolved_art
+    return expires_at is None or expires_at > now
+
+
+def _group_by_appid(resolved_urls):
+    apps_arts = {}
+    for (appid, art_type), art_url in resolved_urls.items():
+        apps_arts.setdefault(appid, {})[art_type] = art_url
+    return apps_arts
 
 
 def delete_cache():
     """
     Deletes the cache containing the data about which art types are available or not
     """
-    # If Kodi's request-cache module is updated to >0.7.3 , we will only need to issue cached_requests.cache.clear() which will handle all scenarios. Until then, we must recreate the backend ourselves    
-    try:
-        cached_requests.cache.clear()
-    except Exception:
-        log('Failed to clear cache. Attempting manual deletion')
+    artindex.clear()
+    delete_legacy_cache()
+
+
+def delete_legacy_cache():
+    """
+    Deletes the cache of the arts availability left over by the versions using requests-cache, see :mod:`migrations`
+    """
+    if os.path.isfile(ART_AVAILABILITY_CACHE_FILE + ".sqlite"):
         try:
             os.remove(ART_AVAILABILITY_CACHE_FILE + ".sqlite")
-        except:
+        except OSError:
             log('Failed to delete cache file')
-        cached_requests.cache.responses = requests_cache.backends.storage.dbdict.DbPickleDict(ART_AVAILABILITY_CACHE_FILE + ".sqlite", 'responses', fast_save=True)
-        cached_requests.cache.keys_map = requests_cache.backends.storage.dbdict.DbDict(ART_AVAILABILITY_CACHE_FILE + ".sqlite", 'urls')
@@ -0,0 +1,190 @@
+'''
+pool of equivalent Steam CDN hosts serving the arts, ordered by their sampled latency, with failover when a host stops answering
+
+The arts are identified by their path on the CDN (/steam/apps/{appid}/header.jpg...), which every host of the pool serves.
+The latency and health of the hosts are persisted, so that every invocation starts with the host chosen by the previous ones.
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import xbmc
+import xbmcaddon
+
+from . import database
+from . import transport
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+
+DEFAULT_HOSTS = 'cdn.akamai.steamstatic.com,cdn.cloudflare.steamstatic.com,steamcdn-a.akamaihd.net'
+# Scheme of the hosts configured without one
+DEFAULT_SCHEME = 'https'
+
+CDN_FILE = 'cdn.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    latency REAL,
+    sampled_at REAL NOT NULL,
+    failed_until REAL NOT NULL DEFAULT 0
+);
+'''
+
+# Art requested to measure the latency of the hosts, which every host serves
+SAMPLE_PATH = '/steam/apps/440/header.jpg'
+SAMPLE_TIMEOUT = 3
+# The hosts are sampled again after this many seconds
+SAMPLE_INTERVAL = 6 * 3600
+# A host which timed out is not used for this many seconds, unless every host failed
+FAILOVER_SECONDS = 10 * 60
+
+# Base urls of the hosts configured by the user, parsed on first use by :func:`get_configured_hosts`
+_configured_hosts = None
+# Persisted state of the hosts, loaded on first use. host -> (latency or None, failed_until)
+_hosts_state = None
+_hosts_state_lock = threading.Lock()
+
+
+def _get_connection():
+    return database.get_connection(CDN_FILE, SCHEMA)
+
+
+def _parse_hosts(setting):
+    hosts = []
+    for host in setting.split(','):
+        host = host.strip().rstrip('/')
+        if host:
+            hosts.append(transport.normalize_url(host if '://' in host else DEFAULT_SCHEME + '://' + host))
+    return tuple(hosts)
+
+
+def get_configured_hosts():
+    """
+    :return: tuple of the base urls (scheme://host[:port]) of the hosts configured by the user, in order of preference. The setting is only parsed once per process.
+        The default hosts are used when the setting holds no host.
+    """
+    global _configured_hosts
+    if _configured_hosts is None:
+        _configured_hosts = _parse_hosts(__addon__.getSetting('cdn-hosts')) or _parse_hosts(DEFAULT_HOSTS)
+    return _configured_hosts
+
+
+def _get_hosts_state():
+    global _hosts_state
+    with _hosts_state_lock:
+        if _hosts_state is None:
+            _hosts_state = {host: (latency, failed_until) for host, latency, failed_until in
+                            _get_connection().execute('SELECT host, latency, failed_until FROM hosts')}
+        return _hosts_state
+
+
+def get_hosts(now=None):
+    """
+    Orders the configured hosts by preference : the hosts which did not fail recently, by increasing sampled latency, then the configured order.
+
+    :param now: current timestamp. Defaults to the current time
+    :return: list of the base urls of the hosts, the first one being the one to use
+    """
+    now = time.time() if now is None else now
+    hosts_state = _get_hosts_state()
+    configured_hosts = get_configured_hosts()
+
+    def preference(indexed_host):
+        index, host = indexed_host
+        latency, failed_until = hosts_state.get(host, (None, 0))
+        return failed_until > now, latency is None, latency or 0, index
+
+    return [host for index, host in sorted(enumerate(configured_hosts), key=preference)]
+
+
+def get_url(path, host=None):
+    """
+    :param path: path of an art on the CDN, or an absolute url which is returned unchanged
+    :param host: base url of the host to use, to build many urls on the same host. Defaults to the preferred host
+    :return: the url of the art on the host
+    """
+    if '://' in path:
+        return path
+    return (host or get_hosts()[0]) + path
+
+
+def get_path(url):
+    """
+    :param url: url of an art on any host of the pool, or an art path which is returned unchanged
+    :return: the host independent path of the art
+    """
+    for host in get_configured_hosts():
+        if url.startswith(host + '/'):
+            return url[len(host):]
+    return url
+
+
+def report_failure(host):
+    """
+    Records that a host timed out or refused the connection, so that the next requests fail over to another host.
+
+    :param host: base url of the host
+    """
+    failed_until = time.time() + FAILOVER_SECONDS
+    hosts_state = _get_hosts_state()
+    with _hosts_state_lock:
+        latency, previous_failed_until = hosts_state.get(host, (None, 0))
+        hosts_state[host] = (latency, failed_until)
+    with _get_connection() as connection:
+        connection.execute('INSERT OR IGNORE INTO hosts (host, latency, sampled_at) VALUES (?, NULL, 0)', (host,))
+        connection.execute('UPDATE hosts SET failed_until = ? WHERE host = ?', (failed_until, host))
+    log('CDN host {0} failed, using {1} for the next {2} seconds'.format(host, get_hosts()[0], FAILOVER_SECONDS), xbmc.LOGWARNING)
+
+
+def needs_sampling(now=None):
+    """
+    :return: True if a configured host was never sampled, or if its sample expired
+    """
+    now = time.time() if now is None else now
+    sampled_at = dict(_get_connection().execute('SELECT host, sampled_at FROM hosts'))
+    return any(now - sampled_at.get(host, 0) > SAMPLE_INTERVAL for host in get_configured_hosts())
+
+
+def measure_latency(session, host, path=SAMPLE_PATH, timeout=SAMPLE_TIMEOUT):
+    """
+    Measures the latency of a host with a HEAD request.
+
+    :return: the duration of the request in seconds, or None if the host did not answer successfully
+    """
+    start = time.time()
+    try:
+        response = session.head(host + path, timeout=timeout)
+    except IOError:
+        return None
+    if response.status_code >= 400:
+        return None
+    return time.time() - start
+
+
+def sample_hosts(session, path=SAMPLE_PATH, timeout=SAMPLE_TIMEOUT):
+    """
+    Measures the latency of every configured host concurrently, and persists the results. The hosts which did not answer are failed over.
+
+    :param session: requests session used to send the requests
+    :param path: path of the art requested on every host
+    :param timeout: timeout of each request in seconds
+    :return: dictionary mapping each host to its latency in seconds, or None if it did not answer
+    """
+    hosts = get_configured_hosts()
+    with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        latencies = dict(zip(hosts, executor.map(lambda host: measure_latency(session, host, path, timeout), hosts)))
+
+    now = time.time()
+    hosts_state = _get_hosts_state()
+    with _hosts_state_lock:
+        for host, latency in latencies.items():
+            hosts_state[host] = (latency, 0 if latency is not None else now + FAILOVER_SECONDS)
+        rows = [(host, latency, now, hosts_state[host][1]) for host, latency in latencies.items()]
+    with _get_connection() as connection:
+        connection.executemany('INSERT OR REPLACE INTO hosts (host, latency, sampled_at, failed_until) VALUES (?, ?, ?, ?)', rows)
+
+    log('Sampled CDN hosts latency {0}, using {1}'.format(latencies, get_hosts()[0]))
+    return latencies
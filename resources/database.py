@@ -0,0 +1,94 @@
+'''
+sqlite databases stored in the addon profile folder
+'''
+
+import os
+import sqlite3
+import threading
+
+import xbmcaddon
+import xbmcvfs
+
+__addon__ = xbmcaddon.Addon()
+
+# define the database files to reside in the ..\Kodi\userdata\addon_data\(your addon)
+addonUserDataFolder = xbmcvfs.translatePath(__addon__.getAddonInfo('profile'))
+
+# sqlite limits the number of parameters of a single statement (999 on older versions), bulk reads are split in chunks below that limit
+MAX_QUERY_PARAMETERS = 900
+
+# sqlite connections can only be used by the thread which opened them, the service runs several threads
+_thread_local = threading.local()
+
+
+def _get_schema_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(connection, migrations):
+    """
+    Upgrades the tables of a database created by previous versions of the addon.
+    The version of a database is the number of migrations it went through, kept in its user_version. Only the migrations it did not go through yet are run,
+    in a single transaction, so that concurrent invocations don't run them twice.
+
+    :param connection: a :class:`sqlite3.Connection` to the database
+    :param migrations: list of functions called with the connection, each upgrading the tables from a version to the next one.
+        They also run on the databases just created from the current schema, and must leave the tables which are already up to date unchanged.
+    """
+    if _get_schema_version(connection) >= len(migrations):
+        return
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        for migration in migrations[_get_schema_version(connection):]:
+            migration(connection)
+        connection.execute('PRAGMA user_version = {0:d}'.format(len(migrations)))
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+def connect(filename, schema, migrations=()):
+    """
+    Opens (and creates if needed) a sqlite database in the addon profile folder.
+
+    :param filename: name of the database file, relative to the addon profile folder
+    :param schema: SQL script creating the tables and indexes of the database. Must be idempotent ("IF NOT EXISTS").
+    :param migrations: list of functions upgrading the tables created by previous versions, run once the schema is created, see :func:`migrate`
+    :return: a :class:`sqlite3.Connection` to the database
+    """
+    os.makedirs(addonUserDataFolder, exist_ok=True)
+
+    connection = sqlite3.connect(os.path.join(addonUserDataFolder, filename), timeout=10)
+    connection.execute('PRAGMA journal_mode = WAL')  # Readers of other plugin invocations don't block on our writes
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.executescript(schema)
+    migrate(connection, migrations)
+    return connection
+
+
+def get_connection(filename, schema, migrations=()):
+    """
+    Obtains the connection of the current thread to a database of the addon profile folder, opening it on first use.
+
+    :param filename: name of the database file, relative to the addon profile folder
+    :param schema: SQL script creating the tables and indexes of the database, see :func:`connect`
+    :param migrations: list of functions upgrading the tables created by previous versions, see :func:`migrate`
+    :return: a :class:`sqlite3.Connection` to the database
+    """
+    connections = _thread_local.__dict__.setdefault('connections', {})
+    if filename not in connections:
+        connections[filename] = connect(filename, schema, migrations)
+    return connections[filename]
+
+
+def chunks(values, size=MAX_QUERY_PARAMETERS):
+    """
+    Splits a list of values in chunks small enough to be used as the parameters of a single statement.
+
+    :param values: list of values
+    :param size: maximum number of values per chunk
+    :return: generator of lists of values
+    """
+    for index in range(0, len(values), size):
+        yield values[index:index + size]
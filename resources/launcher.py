@@ -0,0 +1,211 @@
+'''
+non-blocking launch of the Steam commands, supervised by the service
+
+The plugin hands the launch over to the service with a JSON-RPC notification and returns to Kodi right away.
+Any JSON-RPC client can send such a notification, so it only carries the action and the appid : the service builds the Steam command from its own settings.
+The service starts the command, then records its exit status, how long the game took to start according to the RunningAppID of Steam, and how long it was played.
+'''
+
+import json
+import os
+import threading
+import time
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+
+from . import database
+from . import registry
+from . import steam
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+
+# Home window property set while the service is able to supervise launches
+SERVICE_PROPERTY = __addon__.getAddonInfo('id') + '.service'
+# Message of the JSON-RPC notification handing a launch over to the service. Kodi delivers it to the monitors as "Other.<message>"
+LAUNCH_MESSAGE = 'launch'
+# Actions which can be handed over to the service
+LAUNCH_ACTIONS = ('run', 'install')
+
+LAUNCHES_FILE = 'launches.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS launches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    appid TEXT NOT NULL,
+    action TEXT NOT NULL,
+    requested_at REAL NOT NULL,
+    exit_code INTEGER,
+    exited_at REAL,
+    started_at REAL,
+    ended_at REAL
+);
+'''
+
+# Delay between two reads of the running appid of Steam
+POLL_INTERVAL = 1
+# Maximum number of seconds waited for the game/app to start, after which the launch is considered failed
+START_TIMEOUT = 180
+
+
+def _get_connection():
+    return database.get_connection(LAUNCHES_FILE, SCHEMA)
+
+
+def is_service_available():
+    """
+    :return: True if the service is running and supervises the launches
+    """
+    return xbmcgui.Window(10000).getProperty(SERVICE_PROPERTY) == 'true'
+
+
+def get_launch_command(action, appid):
+    """
+    Builds the Steam command of a launch from the addon settings.
+
+    :param action: 'run' or 'install'
+    :param appid: appid of the game/app
+    :return: the Steam command, as a list of arguments
+    """
+    addon = xbmcaddon.Addon()  # The settings of a long running service are only up to date on a new instance
+    if action == 'install':
+        return steam.get_install_command(addon.getSetting('steam-exe'), appid)
+    return steam.get_run_command(addon.getSetting('steam-exe'), addon.getSetting('steam-args'), appid)
+
+
+def request_launch(action, appid):
+    """
+    Hands a launch over to the service, which starts and supervises the Steam command.
+
+    :param action: 'run' or 'install'
+    :param appid: appid of the game/app
+    """
+    data = {'action': action, 'appid': appid, 'requested_at': time.time()}
+    xbmc.executeJSONRPC(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'JSONRPC.NotifyAll',
+                                    'params': {'sender': __addon__.getAddonInfo('id'), 'message': LAUNCH_MESSAGE, 'data': data}}))
+    log('Handed {0} of {1} over to the service'.format(action, appid))
+
+
+def launch(action, appid):
+    """
+    Starts a Steam command without blocking the plugin invocation : the service starts it when it is running, otherwise it is started detached and not supervised.
+
+    :param action: 'run' or 'install'
+    :param appid: appid of the game/app
+    """
+    if is_service_available():
+        request_launch(action, appid)
+    else:
+        command = get_launch_command(action, appid)
+        log('executing ' + ' '.join(command))
+        steam.start_detached(command)
+
+
+def _read_running_appid(registry_path, previous):
+    """
+    Reads the running appid of Steam, parsing registry.vdf only when it changed.
+
+    :param previous: tuple (file signature, running appid) of the previous read
+    :return: tuple (file signature, running appid)
+    """
+    if os.name == 'nt':
+        return None, registry.get_running_appid(registry_path)
+    try:
+        file_stat = os.stat(registry_path)
+    except OSError:
+        return None, None
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    if previous is not None and previous[0] == signature:
+        return previous
+    return signature, registry.get_running_appid(registry_path)
+
+
+def supervise(monitor, action, appid, command, requested_at=None):
+    """
+    Starts a Steam command and supervises it until the game/app it runs is closed, recording the launch in the launches database.
+    The Steam command usually returns as soon as it handed the request to the Steam client, the game/app itself is followed through the RunningAppID of Steam.
+
+    :param monitor: a :class:`xbmc.Monitor`, the supervision stops when Kodi requests an abort
+    :param action: 'run' or 'install'. Only the runs are followed after the Steam command exits
+    :param appid: appid of the game/app
+    :param command: the Steam command, as a list of arguments
+    :param requested_at: timestamp at which the user requested the launch. Defaults to the current time
+    :return: the id of the launch in the launches database
+    """
+    requested_at = time.time() if requested_at is None else requested_at
+    with _get_connection() as connection:
+        launch_id = connection.execute('INSERT INTO launches (appid, action, requested_at) VALUES (?, ?, ?)', (appid, action, requested_at)).lastrowid
+
+    log('executing ' + ' '.join(command))
+    try:
+        process = steam.start_detached(command)
+    except OSError as e:
+        log('Unable to execute {0}: {1}'.format(command, e), xbmc.LOGERROR)
+        with _get_connection() as connection:
+            connection.execute('UPDATE launches SET exited_at = ? WHERE id = ?', (time.time(), launch_id))
+        return launch_id
+
+    registry_path = os.path.join(__addon__.getSetting('steam-path'), 'registry.vdf')
+    running_appid = None
+    started_at = None
+    exit_code = None
+    while not monitor.abortRequested():
+        if exit_code is None:
+            exit_code = process.poll()
+            if exit_code is not None:
+                with _get_connection() as connection:
+                    connection.execute('UPDATE launches SET exit_code = ?, exited_at = ? WHERE id = ?', (exit_code, time.time(), launch_id))
+                if action != 'run':
+                    break
+
+        if action == 'run':
+            running_appid = _read_running_appid(registry_path, running_appid)
+            if started_at is None and running_appid[1] == appid:
+                started_at = time.time()
+                with _get_connection() as connection:
+                    connection.execute('UPDATE launches SET started_at = ? WHERE id = ?', (started_at, launch_id))
+                log('{0} started {1:.1f} seconds after its launch'.format(appid, started_at - requested_at))
+            elif started_at is not None and running_appid[1] != appid:
+                ended_at = time.time()
+                with _get_connection() as connection:
+                    connection.execute('UPDATE launches SET ended_at = ? WHERE id = ?', (ended_at, launch_id))
+                log('{0} was played for {1:.0f} seconds'.format(appid, ended_at - started_at))
+                break
+            elif started_at is None and exit_code is not None and time.time() - requested_at > START_TIMEOUT:
+                log('{0} did not start within {1} seconds'.format(appid, START_TIMEOUT), xbmc.LOGWARNING)
+                break
+
+        monitor.waitForAbort(POLL_INTERVAL)
+    return launch_id
+
+
+def start_supervision(monitor, data):
+    """
+    Supervises a launch handed over by the plugin in a background thread, see :func:`supervise`.
+    Notifications which are not a valid launch are ignored.
+
+    :param monitor: a :class:`xbmc.Monitor`
+    :param data: the data of the launch notification, as a JSON string
+    :return: the supervision thread, or None if the notification was ignored
+    """
+    try:
+        launch_data = json.loads(data)
+    except ValueError:
+        launch_data = None
+    if not isinstance(launch_data, dict):
+        launch_data = {}
+    action = launch_data.get('action')
+    appid = launch_data.get('appid')
+    requested_at = launch_data.get('requested_at')
+    if action not in LAUNCH_ACTIONS or not isinstance(appid, str) or not appid.isdigit() or not isinstance(requested_at, (int, float, type(None))):
+        log('Ignoring the invalid launch notification {0}'.format(data), xbmc.LOGWARNING)
+        return None
+
+    supervision_thread = threading.Thread(target=supervise, name='steam-launch-' + appid,
+                                          args=(monitor, action, appid, get_launch_command(action, appid), requested_at))
+    supervision_thread.daemon = True
+    supervision_thread.start()
+    return supervision_thread
+
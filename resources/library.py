@@ -0,0 +1,430 @@
+'''
+local snapshot of the owned games library, synced from the Steam Web API and shared by every games list
+'''
+
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+
+import xbmcaddon
+
+from . import database
+from . import singleflight
+from . import steam
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+minutesBeforeGamesListsExpiration = int(__addon__.getSetting("games-expire-after-minutes"))  # Default is 3 days
+staleWhileRevalidate = __addon__.getSetting("games-stale-while-revalidate") != 'false'  # Default is true
+
+LIBRARY_FILE = 'library.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    appid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    img_icon_url TEXT NOT NULL,
+    playtime_forever INTEGER NOT NULL,
+    playtime_2weeks INTEGER NOT NULL,
+    rtime_last_played INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_last_played ON games (rtime_last_played);
+CREATE INDEX IF NOT EXISTS games_playtime ON games (playtime_forever);
+CREATE TABLE IF NOT EXISTS name_tokens (
+    token TEXT NOT NULL,
+    appid INTEGER NOT NULL,
+    PRIMARY KEY (token, appid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS name_tokens_appid ON name_tokens (appid);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+# Fields of the games kept in the snapshot, the other fields of the Steam Web API response are never used
+GAME_FIELDS = steam.GAME_FIELDS
+
+# Version of the search index held by the name_tokens table, to increase whenever :func:`tokenize` changes so that the index is built again
+SEARCH_INDEX_VERSION = '1'
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+# Largest number of typos tolerated by the fuzzy matching of a search token, according to its length : (minimum length, typos)
+FUZZY_DISTANCES = ((8, 2), (4, 1))
+
+# Distinct tokens of the search index, used by the fuzzy matching : (index marker, sorted list of tokens)
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+class LibraryDelta(namedtuple('LibraryDelta', ('added', 'removed', 'changed'))):
+    """
+    Changes of the snapshot made by a sync, as sets of appids (integers) : the games added to the library, removed from it, and the games whose fields changed.
+    The delta is falsy when the games did not change.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+NO_CHANGES = LibraryDelta(frozenset(), frozenset(), frozenset())
+
+# (steam_api_key, steam_user_id, changed_at) of the expired snapshot served by this invocation, to sync once the listing is displayed
+_revalidation = None
+
+# Name of the single-flight lock of the syncs, so that concurrent invocations don't all call the Steam Web API
+SYNC_LOCK = 'library-sync'
+
+
+def _get_connection():
+    return database.get_connection(LIBRARY_FILE, SCHEMA)
+
+
+def _get_sync_state():
+    return dict(_get_connection().execute('SELECT key, value FROM sync_state'))
+
+
+def is_snapshot_fresh(steam_user_id, now=None):
+    """
+    Checks whether the snapshot holds the library of a user, synced less than `games-expire-after-minutes` ago.
+
+    :param steam_user_id: steam id of the user
+    :param now: timestamp to compare the sync time to. Defaults to the current time
+    :return: True if the snapshot can be used without syncing it first
+    """
+    now = time.time() if now is None else now
+    sync_state = _get_sync_state()
+    return sync_state.get('steam_user_id') == steam_user_id and float(sync_state.get('synced_at', 0)) + 60 * minutesBeforeGamesListsExpiration > now
+
+
+def sync(steam_api_key, steam_user_id):
+    """
+    Updates the snapshot with the owned games of a user, with a single request to the Steam Web API.
+    The request is conditional on the validators of the previous sync, and only the games which changed are written.
+
+    :param steam_api_key: A steam API key with access to the Steam Web API
+    :param steam_user_id: steam id of the user we want to get the games list for.
+    :return: the :class:`LibraryDelta` of the snapshot, falsy if the games did not change
+    :raises:
+        :class:IOError: request.RequestException raised when there is an issue querying the web api for any reason.
+    """
+    sync_state = _get_sync_state()
+    validators = json.loads(sync_state['validators']) if sync_state.get('steam_user_id') == steam_user_id and 'validators' in sync_state else None
+    games, validators = steam.get_user_games_if_changed(steam_api_key, steam_user_id, validators)
+
+    with _get_connection() as connection:
+        sync_state = [('steam_user_id', steam_user_id), ('synced_at', repr(time.time())), ('validators', json.dumps(validators))]
+        if games is None:
+            delta = NO_CHANGES
+        else:
+            delta = _write_games(connection, dict((game.appid, game.to_row()) for game in games))
+            if delta:
+                sync_state.append(('changed_at', repr(time.time())))
+        connection.executemany('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', sync_state)
+
+    if games is None:
+        log('Synced the library snapshot, the games list did not change')
+    else:
+        log('Synced {0} games to the library snapshot, {1} added, {2} removed and {3} changed'.format(len(games), len(delta.added), len(delta.removed), len(delta.changed)))
+    return delta
+
+
+def _write_games(connection, games):
+    """
+    Writes the games which differ from the snapshot.
+
+    :param connection: connection to the library database, in a transaction
+    :param games: dictionary mapping each appid to the fields of the game, in the order of :const:`GAME_FIELDS`
+    :return: the :class:`LibraryDelta` of the snapshot
+    """
+    previous_games = dict((row[0], row) for row in connection.execute('SELECT {0} FROM games'.format(', '.join(GAME_FIELDS))))
+    added = frozenset(appid for appid in games if appid not in previous_games)
+    removed = frozenset(appid for appid in previous_games if appid not in games)
+    changed = frozenset(appid for appid, row in games.items() if appid in previous_games and previous_games[appid] != row)
+
+    for chunk in database.chunks(list(removed)):
+        connection.execute('DELETE FROM games WHERE appid IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+    connection.executemany('INSERT OR REPLACE INTO games ({0}) VALUES (?, ?, ?, ?, ?, ?)'.format(', '.join(GAME_FIELDS)),
+                           (games[appid] for appid in added | changed))
+
+    # The search index is only updated for the names which changed. An index which was never built is built by the first search instead
+    if connection.execute("SELECT 1 FROM sync_state WHERE key = 'search_index' AND value = ?", (SEARCH_INDEX_VERSION,)).fetchone():
+        renamed = set(appid for appid in changed if previous_games[appid][1] != games[appid][1])
+        _index_names(connection, dict((appid, games[appid][1]) for appid in added | renamed), removed | renamed)
+    return LibraryDelta(added, removed, changed)
+
+
+def tokenize(text):
+    """
+    Splits a game name, or a search query, into normalized tokens : lower case words without accents.
+
+    :param text: the text to split
+    :return: list of tokens
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    return TOKEN_PATTERN.findall(''.join(character for character in text if not unicodedata.combining(character)))
+
+
+def _index_names(connection, names, deleted_appids=()):
+    """
+    Updates the search index of the game names.
+
+    :param connection: connection to the library database, in a transaction
+    :param names: dictionary mapping the appids to index to their name
+    :param deleted_appids: appids whose tokens are deleted first
+    """
+    for chunk in database.chunks(list(deleted_appids)):
+        connection.execute('DELETE FROM name_tokens WHERE appid IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+    connection.executemany('INSERT OR IGNORE INTO name_tokens (token, appid) VALUES (?, ?)',
+                           ((token, appid) for appid, name in names.items() for token in set(tokenize(name))))
+    connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('search_index', ?)", (SEARCH_INDEX_VERSION,))
+    connection.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('search_indexed_at', ?)", (repr(time.time()),))
+
+
+def _ensure_snapshot(steam_api_key, steam_user_id):
+    """
+    Syncs the snapshot if it is missing or expired. When Steam can't be reached, an expired snapshot of the same user is still served.
+    With `games-stale-while-revalidate` enabled, an expired snapshot of the same user is served right away and synced by :func:`revalidate`.
+    When another invocation is already syncing the snapshot, we wait for it instead of syncing it again.
+
+    :raises:
+        :class:IOError: when the snapshot had to be synced and Steam could not be reached, with no previous snapshot of the user to serve.
+    """
+    global _revalidation
+    if is_snapshot_fresh(steam_user_id):
+        return
+
+    sync_state = _get_sync_state()
+    if staleWhileRevalidate and sync_state.get('steam_user_id') == steam_user_id:
+        log('Serving the expired library snapshot, it will be synced once the listing is displayed')
+        _revalidation = (steam_api_key, steam_user_id, sync_state.get('changed_at'))
+        return
+
+    with singleflight.lock(SYNC_LOCK):
+        if is_snapshot_fresh(steam_user_id):  # Synced by another invocation while we were waiting for the lock
+            return
+        try:
+            sync(steam_api_key, steam_user_id)
+        except IOError as e:
+            if _get_sync_state().get('steam_user_id') != steam_user_id:
+                raise
+            log('Unable to sync the library snapshot, serving the previous one: {0}'.format(e))
+
+
+def revalidate():
+    """
+    Syncs the expired snapshot served by this invocation, if any. Called once the listing is displayed, so the user never waits for Steam.
+
+    :return: True if the games of the snapshot changed since it was served, and the listing should be refreshed
+    """
+    global _revalidation
+    if _revalidation is None:
+        return False
+
+    steam_api_key, steam_user_id, served_changed_at = _revalidation
+    _revalidation = None
+    with singleflight.lock(SYNC_LOCK):
+        if is_snapshot_fresh(steam_user_id):  # Synced by another invocation, the games may have changed since we served them
+            return _get_sync_state().get('changed_at') != served_changed_at
+        try:
+            return bool(sync(steam_api_key, steam_user_id))
+        except IOError as e:
+            log('Unable to sync the library snapshot, the previous one will be served again: {0}'.format(e))
+            return False
+
+
+def sync_if_expired(steam_api_key, steam_user_id):
+    """
+    Syncs the snapshot if it is missing or expired, unless another invocation syncs it first. Used to keep the snapshot fresh in the background.
+
+    :param steam_api_key: A steam API key with access to the Steam Web API
+    :param steam_user_id: steam id of the user we want to get the games list for.
+    :return: the :class:`LibraryDelta` of the snapshot, falsy if it was fresh or the games did not change
+    :raises:
+        :class:IOError: request.RequestException raised when there is an issue querying the web api for any reason.
+    """
+    with singleflight.lock(SYNC_LOCK):
+        if is_snapshot_fresh(steam_user_id):
+            return NO_CHANGES
+        return sync(steam_api_key, steam_user_id)
+
+
+def restore(steam_user_id, games, synced_at):
+    """
+    Fills an empty snapshot with games obtained earlier, for example from the caches of previous versions of the addon, so that the first listing does not wait for Steam.
+    The snapshot keeps the sync time of the games, it is synced again like any other snapshot once it expires.
+
+    :param steam_user_id: steam id of the user owning the games
+    :param games: list of :class:`steam.Game` records
+    :param synced_at: timestamp at which the games were obtained from Steam
+    :return: True if the games were written, False if the snapshot already holds games
+    """
+    with singleflight.lock(SYNC_LOCK):
+        with _get_connection() as connection:
+            if connection.execute('SELECT 1 FROM games LIMIT 1').fetchone():
+                return False
+            _write_games(connection, dict((game.appid, game.to_row()) for game in games))
+            connection.execute("DELETE FROM sync_state WHERE key = 'validators'")  # The next sync is not conditional
+            connection.executemany('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)',
+                                   [('steam_user_id', steam_user_id), ('synced_at', repr(synced_at)), ('changed_at', repr(synced_at))])
+    log('Restored {0} games to the library snapshot'.format(len(games)))
+    return True
+
+
+def _query_games(query, parameters=()):
+    return [steam.Game(*row) for row in _get_connection().execute(query, parameters)]
+
+
+def get_games(steam_api_key, steam_user_id):
+    """
+    Obtains the owned games of a user from the snapshot, syncing it first if needed.
+
+    :param steam_api_key: A steam API key with access to the Steam Web API
+    :param steam_user_id: steam id of the user we want to get the games list for.
+    :return: a list of :class:`steam.Game` records, holding the fields appid (as an integer), name, img_icon_url, playtime_forever, playtime_2weeks and rtime_last_played
+    :raises:
+        :class:IOError: when the snapshot is missing and Steam could not be reached.
+    """
+    _ensure_snapshot(steam_api_key, steam_user_id)
+    return _query_games('SELECT {0} FROM games'.format(', '.join(GAME_FIELDS)))
+
+
+def get_recent_games(steam_api_key, steam_user_id):
+    """
+    Obtains the games played by a user in the last two weeks from the snapshot, syncing it first if needed.
+    Same as the GetRecentlyPlayedGames endpoint of the Steam Web API, derived locally from the playtime_2weeks and rtime_last_played fields.
+
+    :param steam_api_key: A steam API key with access to the Steam Web API
+    :param steam_user_id: steam id of the user we want to get the games list for.
+    :return: a list of :class:`steam.Game` records, see :func:`get_games`, the most recently played first
+    :raises:
+        :class:IOError: when the snapshot is missing and Steam could not be reached.
+    """
+    _ensure_snapshot(steam_api_key, steam_user_id)
+    return _query_games('SELECT {0} FROM games WHERE playtime_2weeks > 0 ORDER BY rtime_last_played DESC'.format(', '.join(GAME_FIELDS)))
+
+
+def _ensure_search_index():
+    """
+    Builds the search index of the game names if it was never built, or built by another version of :func:`tokenize`.
+
+    :return: marker of the current state of the index, changing whenever the index is updated
+    """
+    sync_state = _get_sync_state()
+    if sync_state.get('search_index') != SEARCH_INDEX_VERSION:
+        with _get_connection() as connection:
+            connection.execute('DELETE FROM name_tokens')
+            _index_names(connection, dict(connection.execute('SELECT appid, name FROM games')))
+        log('Built the search index of the library')
+        sync_state = _get_sync_state()
+    return sync_state.get('search_indexed_at')
+
+
+def _get_vocabulary(index_marker):
+    global _vocabulary
+    with _vocabulary_lock:
+        if _vocabulary is None or _vocabulary[0] != index_marker:
+            _vocabulary = (index_marker, [token for token, in _get_connection().execute('SELECT DISTINCT token FROM name_tokens ORDER BY token')])
+        return _vocabulary[1]
+
+
+def _is_within_distance(first, second, max_distance):
+    """
+    :return: True if the Levenshtein distance between two tokens is at most max_distance, computed only as far as needed
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return False
+    previous_row = list(range(len(second) + 1))
+    for first_index, first_character in enumerate(first, 1):
+        row = [first_index]
+        for second_index, second_character in enumerate(second, 1):
+            row.append(min(previous_row[second_index] + 1, row[second_index - 1] + 1,
+                           previous_row[second_index - 1] + (first_character != second_character)))
+        if min(row) > max_distance:
+            return False
+        previous_row = row
+    return previous_row[-1] <= max_distance
+
+
+def _match_token(connection, token, vocabulary):
+    """
+    :return: set of the appids with a name token starting with the search token. When there is none, the tokens within a few typos of the search token are matched instead.
+    """
+    appids = set(appid for appid, in connection.execute('SELECT appid FROM name_tokens WHERE token >= ? AND token < ?', (token, token + '\uffff')))
+    if appids:
+        return appids
+
+    max_distance = next((distance for minimum_length, distance in FUZZY_DISTANCES if len(token) >= minimum_length), 0)
+    if not max_distance:
+        return appids
+    close_tokens = [candidate for candidate in vocabulary if _is_within_distance(token, candidate, max_distance)]
+    for chunk in database.chunks(close_tokens):
+        appids.update(appid for appid, in connection.execute('SELECT appid FROM name_tokens WHERE token IN ({0})'.format(','.join('?' * len(chunk))), chunk))
+    return appids
+
+
+def find_games(steam_api_key, steam_user_id, query='', played=None, min_playtime=None, max_playtime=None):
+    """
+    Searches and filters the owned games of a user in the snapshot, syncing it first if needed.
+    The names are matched through the search index : every token of the query must start a token of the name, or be within a few typos of one.
+    The playtime filters use the playtime index of the snapshot.
+
+    :param steam_api_key: A steam API key with access to the Steam Web API
+    :param steam_user_id: steam id of the user we want to get the games list for.
+    :param query: text to search in the names of the games. Empty to not filter by name
+    :param played: True to only keep the games which were played, False to only keep the ones which never were, None to keep both
+    :param min_playtime: minimum playtime in minutes, None for no minimum
+    :param max_playtime: maximum playtime in minutes, None for no maximum
+    :return: a list of :class:`steam.Game` records, see :func:`get_games`. The games matching whole words of the query first, then the most played first
+    :raises:
+        :class:IOError: when the snapshot is missing and Steam could not be reached.
+    """
+    _ensure_snapshot(steam_api_key, steam_user_id)
+    conditions = []
+    parameters = []
+    if played is not None:
+        conditions.append('playtime_forever > 0' if played else 'playtime_forever = 0')
+    if min_playtime is not None:
+        conditions.append('playtime_forever >= ?')
+        parameters.append(min_playtime)
+    if max_playtime is not None:
+        conditions.append('playtime_forever <= ?')
+        parameters.append(max_playtime)
+
+    query_tokens = tokenize(query)
+    if not query_tokens:
+        return _query_games('SELECT {0} FROM games{1} ORDER BY playtime_forever DESC'.format(
+            ', '.join(GAME_FIELDS), ' WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters)
+
+    vocabulary = _get_vocabulary(_ensure_search_index())
+    connection = _get_connection()
+    appids = None
+    for token in set(query_tokens):
+        token_appids = _match_token(connection, token, vocabulary)
+        appids = token_appids if appids is None else appids & token_appids
+        if not appids:
+            return []
+
+    games = []
+    for chunk in database.chunks(list(appids), database.MAX_QUERY_PARAMETERS - len(parameters)):
+        games.extend(_query_games('SELECT {0} FROM games WHERE {1}'.format(
+            ', '.join(GAME_FIELDS), ' AND '.join(conditions + ['appid IN ({0})'.format(','.join('?' * len(chunk)))])), parameters + chunk))
+    query_tokens = list(set(query_tokens))
+    whole_word_matches = dict(connection.execute('SELECT appid, COUNT(*) FROM name_tokens WHERE token IN ({0}) GROUP BY appid'.format(','.join('?' * len(query_tokens))), query_tokens))
+    games.sort(key=lambda game: (-whole_word_matches.get(game.appid, 0), -game.playtime_forever))
+    return games
+
+
+def delete_cache():
+    """
+    Deletes the snapshot of the library, the next games list will sync it again.
+    Waits for the sync of another invocation, which would otherwise write its games after the deletion.
+    """
+    with singleflight.lock(SYNC_LOCK):
+        with _get_connection() as connection:
+            connection.execute('DELETE FROM games')
+            connection.execute('DELETE FROM name_tokens')
+            connection.execute('DELETE FROM sync_state')
@@ -0,0 +1,312 @@
+'''
+local cache of the arts images, downscaled per art type and bounded in size, so that Kodi loads the arts from the addon profile folder instead of the Steam CDN
+
+The arts of a listing which are not cached yet are displayed from their urls, and queued once the listing is displayed.
+The service downloads the queued arts in the background. Without the service, every listing downloads a few of them.
+The least recently used images are evicted when the cache grows beyond its disk budget.
+'''
+
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import xbmc
+import xbmcaddon
+
+from . import arts
+from . import cdn
+from . import database
+from . import perf
+from . import singleflight
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+localArtsEnabled = __addon__.getSetting("enable-local-arts") == 'true'  # Default is false
+localArtsBudget = max(1, int(__addon__.getSetting("local-arts-budget-mb") or 200)) * 1024 * 1024  # Default is 200 MB
+localArtsWorkers = max(1, int(__addon__.getSetting("local-arts-workers") or 3))  # Default is 3 concurrent downloads
+
+LOCAL_ARTS_FILE = 'localarts.sqlite'
+LOCAL_ARTS_FOLDER = os.path.join(database.addonUserDataFolder, 'arts')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS local_arts (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS local_arts_last_used ON local_arts (last_used);
+CREATE TABLE IF NOT EXISTS pending_arts (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    art_type TEXT NOT NULL,
+    queued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_arts_queued_at ON pending_arts (queued_at);
+'''
+
+# Maximum (width, height) of the stored images of each art type, the aspect ratio is kept. Art types not listed are stored at their original size.
+ART_MAX_SIZES = {
+    'poster': (400, 600),
+    'banner': (1280, 414),
+    'fanart': (1280, 720),
+    'fanart2': (1280, 720),
+    'clearlogo': (640, 360),
+}
+
+# The last use of a cached image is only written again after this many seconds, so that browsing does not write to the database every time
+TOUCH_INTERVAL = 3600
+# Once the budget is exceeded, images are evicted until the cache is back below this fraction of the budget
+EVICTION_TARGET = 0.9
+DOWNLOAD_TIMEOUT = 10
+
+LOCAL_ARTS_LOCK = 'local-arts'
+# Message of the JSON-RPC notification asking the service to download the queued arts. It carries no data, the service reads the queue
+DOWNLOADS_MESSAGE = 'download-arts'
+# Number of queued arts downloaded between two writes to the database and abort checks
+DOWNLOAD_BATCH_SIZE = 20
+# Number of queued arts downloaded by a listing when the service is not running
+LISTING_DOWNLOAD_LIMIT = 20
+
+# Arts of the current listing which are not cached yet. key -> (url, art_type)
+_missing_arts = {}
+# The Pillow Image module, imported on first use by :func:`_get_image_module`. False once its import failed
+_image_module = None
+
+
+def _get_connection():
+    return database.get_connection(LOCAL_ARTS_FILE, SCHEMA)
+
+
+def get_key(url, art_type):
+    """
+    :return: the key of the cached image of an art url, which depends on the size it is downscaled to but not on the CDN host it was downloaded from
+    """
+    max_size = ART_MAX_SIZES.get(art_type)
+    size_suffix = '' if max_size is None else '@{0}x{1}'.format(*max_size)
+    return hashlib.sha1((cdn.get_path(url) + size_suffix).encode('utf-8')).hexdigest()
+
+
+def get_local_arts(apps_arts):
+    """
+    Replaces the art urls of many games/apps by the paths of their cached images, when they are cached.
+    The other arts are kept as urls, and recorded so that :func:`download_missing_arts` caches them.
+
+    :param apps_arts: dictionary mapping each appid to a dictionary of its arts {art_type: art_url}
+    :return: dictionary with the same structure, holding local paths for the cached arts
+    """
+    keys = {}  # (appid, art_type) -> key
+    for appid, app_arts in apps_arts.items():
+        for art_type, art_url in app_arts.items():
+            if art_url:
+                keys[(appid, art_type)] = get_key(art_url, art_type)
+
+    now = time.time()
+    cached_arts = {}  # key -> path
+    keys_to_touch = []
+    connection = _get_connection()
+    for chunk in database.chunks(list(set(keys.values()))):
+        rows = connection.execute('SELECT key, path, last_used FROM local_arts WHERE key IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+        for key, path, last_used in rows:
+            cached_arts[key] = path
+            if now - last_used > TOUCH_INTERVAL:
+                keys_to_touch.append(key)
+    if keys_to_touch:
+        with connection:
+            connection.executemany('UPDATE local_arts SET last_used = ? WHERE key = ?', ((now, key) for key in keys_to_touch))
+
+    local_apps_arts = {}
+    for appid, app_arts in apps_arts.items():
+        local_app_arts = local_apps_arts[appid] = dict(app_arts)
+        for art_type, art_url in app_arts.items():
+            key = keys.get((appid, art_type))
+            if key in cached_arts:
+                local_app_arts[art_type] = cached_arts[key]
+            elif key is not None:
+                _missing_arts[key] = (art_url, art_type)
+    return local_apps_arts
+
+
+def _get_image_module():
+    """
+    :return: the Image module of Pillow, or None if Pillow is not installed. Without it, the images are stored as downloaded
+    """
+    global _image_module
+    if _image_module is None:
+        try:
+            from PIL import Image
+            _image_module = Image
+        except ImportError:
+            log('Pillow (script.module.pil) is not available, the local arts are stored at their original size', xbmc.LOGWARNING)
+            _image_module = False
+    return _image_module or None
+
+
+def _store_image(content, art_type, path):
+    """
+    Writes an image to the cache, downscaled to the maximum size of its art type when Pillow is available.
+
+    :return: size of the written file in bytes
+    """
+    max_size = ART_MAX_SIZES.get(art_type)
+    Image = _get_image_module() if max_size is not None else None
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(content))
+            if image.width > max_size[0] or image.height > max_size[1]:
+                image.thumbnail(max_size, Image.LANCZOS)
+                output = io.BytesIO()
+                if image.format == 'PNG' or path.endswith('.png'):
+                    image.save(output, 'PNG', optimize=True)  # Keeps the transparency of the logos
+                else:
+                    image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True)
+                content = output.getvalue()
+        except (IOError, ValueError) as e:
+            log('Unable to downscale {0}: {1}'.format(path, e), xbmc.LOGWARNING)
+
+    with open(path + '.tmp', 'wb') as image_file:
+        image_file.write(content)
+    os.replace(path + '.tmp', path)
+    return len(content)
+
+
+def download_art(key, url, art_type):
+    """
+    Downloads an art and stores it in the cache folder.
+
+    :return: a tuple (path, size) of the stored image, or None if the art could not be downloaded
+    """
+    try:
+        response = arts.get_session().get(url, timeout=DOWNLOAD_TIMEOUT)
+    except IOError as e:
+        log('Unable to download {0}: {1}'.format(url, e), xbmc.LOGWARNING)
+        return None
+    if response.status_code != 200:
+        return None
+    perf.count('bytes_received', len(response.content))
+
+    extension = '.png' if url.lower().endswith('.png') else '.jpg'
+    folder = os.path.join(LOCAL_ARTS_FOLDER, key[:2])
+    path = os.path.join(folder, key + extension)
+    try:
+        os.makedirs(folder, exist_ok=True)
+        return path, _store_image(response.content, art_type, path)
+    except (IOError, OSError) as e:
+        log('Unable to store {0}: {1}'.format(path, e), xbmc.LOGWARNING)
+        return None
+
+
+def queue_missing_arts():
+    """
+    Queues the arts recorded as missing by :func:`get_local_arts`, to be downloaded by :func:`download_queued_arts`.
+
+    :return: number of arts recorded as missing
+    """
+    missing_arts = dict(_missing_arts)
+    _missing_arts.clear()
+    if missing_arts:
+        now = time.time()
+        with _get_connection() as connection:
+            connection.executemany('INSERT OR IGNORE INTO pending_arts (key, url, art_type, queued_at) VALUES (?, ?, ?, ?)',
+                                   ((key, url, art_type, now) for key, (url, art_type) in missing_arts.items()))
+    return len(missing_arts)
+
+
+def request_downloads():
+    """
+    Asks the service to download the queued arts, see :func:`download_queued_arts`.
+    """
+    xbmc.executeJSONRPC(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'JSONRPC.NotifyAll',
+                                    'params': {'sender': __addon__.getAddonInfo('id'), 'message': DOWNLOADS_MESSAGE, 'data': {}}}))
+
+
+def download_queued_arts(max_workers=localArtsWorkers, budget=localArtsBudget, limit=None, monitor=None):
+    """
+    Downloads the queued arts, the oldest first, batch by batch on a bounded pool of worker threads, then evicts the least recently used images if the cache exceeds its budget.
+    The arts which can't be downloaded are dropped from the queue, a later listing queues them again.
+    Does nothing if another invocation is already downloading arts, it downloads the arts queued meanwhile as well.
+
+    :param max_workers: maximum number of downloads running at the same time. Defaults to the user addon settings
+    :param budget: maximum size of the cache in bytes. Defaults to the user addon settings
+    :param limit: maximum number of arts to download, None to empty the queue
+    :param monitor: optional :class:`xbmc.Monitor`, the downloads stop between two batches when Kodi requests an abort
+    :return: number of downloaded arts
+    """
+    with singleflight.lock(LOCAL_ARTS_LOCK, timeout=0) as acquired:
+        if not acquired:
+            return 0
+
+        downloaded_count = 0
+        attempted_count = 0
+        connection = _get_connection()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while limit is None or attempted_count < limit:
+                if monitor is not None and monitor.abortRequested():
+                    break
+                batch_size = DOWNLOAD_BATCH_SIZE if limit is None else min(DOWNLOAD_BATCH_SIZE, limit - attempted_count)
+                queued_arts = connection.execute('SELECT key, url, art_type FROM pending_arts ORDER BY queued_at LIMIT ?', (batch_size,)).fetchall()
+                if not queued_arts:
+                    break
+                keys = [key for key, url, art_type in queued_arts]
+                cached_keys = set(key for key, in connection.execute('SELECT key FROM local_arts WHERE key IN ({0})'.format(','.join('?' * len(keys))), keys))
+                queued_arts = [queued_art for queued_art in queued_arts if queued_art[0] not in cached_keys]  # Queued by several listings
+                downloads = dict(zip((key for key, url, art_type in queued_arts), executor.map(lambda queued_art: download_art(*queued_art), queued_arts)))
+
+                now = time.time()
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO local_arts (key, path, size, last_used) VALUES (?, ?, ?, ?)',
+                                           ((key, download[0], download[1], now) for key, download in downloads.items() if download is not None))
+                    connection.executemany('DELETE FROM pending_arts WHERE key = ?', ((key,) for key in keys))
+                downloaded_count += sum(1 for download in downloads.values() if download is not None)
+                attempted_count += len(keys)
+        evict(budget)
+
+    if attempted_count:
+        log('Cached {0} of {1} queued arts locally'.format(downloaded_count, attempted_count))
+    return downloaded_count
+
+
+def evict(budget=localArtsBudget):
+    """
+    Deletes the least recently used images until the cache is below its budget.
+
+    :param budget: maximum size of the cache in bytes. Defaults to the user addon settings
+    :return: number of evicted images
+    """
+    connection = _get_connection()
+    total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM local_arts').fetchone()[0]
+    if total_size <= budget:
+        return 0
+
+    evicted_keys = []
+    for key, path, size in connection.execute('SELECT key, path, size FROM local_arts ORDER BY last_used').fetchall():
+        if total_size <= budget * EVICTION_TARGET:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        evicted_keys.append(key)
+        total_size -= size
+
+    with connection:
+        connection.executemany('DELETE FROM local_arts WHERE key = ?', ((key,) for key in evicted_keys))
+    log('Evicted {0} local arts'.format(len(evicted_keys)))
+    return len(evicted_keys)
+
+
+def delete_cache():
+    """
+    Deletes every locally cached art
+    """
+    with _get_connection() as connection:
+        for path, in connection.execute('SELECT path FROM local_arts').fetchall():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        connection.execute('DELETE FROM local_arts')
+        connection.execute('DELETE FROM pending_arts')
@@ -1,17 +1,38 @@
 import os
+import re
 import routing
 import sys
+import time
 import xbmcplugin
 
 from . import arts
+from . import launcher
+from . import library
+from . import localarts
+from . import metadata
+from . import migrations
+from . import perf
 from . import registry
 from . import steam
+from . import transport
+from . import watcher
 from .util import *
 
 __addon__ = xbmcaddon.Addon()
 
 plugin = routing.Plugin()
 
+# Folders of the games by playtime : (label, minimum playtime in minutes, maximum playtime in minutes)
+PLAYTIME_RANGES = [
+    ('Less than 1 hour', 1, 59),
+    ('1 to 10 hours', 60, 599),
+    ('10 to 50 hours', 600, 2999),
+    ('More than 50 hours', 3000, None),
+]
+
+# Query parameters of the filtered games lists, kept in the url of their next pages
+FILTER_PARAMETERS = ('played', 'installed', 'min_playtime', 'max_playtime')
+
 
 # Note : the Kodi routing plugin also obtains and casts the handle. We can use it through plugin.handle instead of redefining it.
 
@@ -20,6 +41,10 @@ def index():
     xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(all_games), listitem=xbmcgui.ListItem('All games'), isFolder=True)
     xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(installed_games), listitem=xbmcgui.ListItem('Installed games'), isFolder=True)
     xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(recent_games), listitem=xbmcgui.ListItem('Recently played games'), isFolder=True)
+    xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(filtered_games, played='true'), listitem=xbmcgui.ListItem('Played games'), isFolder=True)
+    xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(filtered_games, played='false'), listitem=xbmcgui.ListItem('Unplayed games'), isFolder=True)
+    xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(playtime_ranges), listitem=xbmcgui.ListItem('Games by playtime'), isFolder=True)
+    xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(search), listitem=xbmcgui.ListItem('Search'), isFolder=True)
     xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
 
 
@@ -29,7 +54,8 @@ def all_games():
         return
 
     try:
-        steam_games_details = steam.get_user_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
+        with perf.span('library'):
+            steam_games_details = library.get_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
 
     except IOError as e:
         # something went wrong, can't scan the steam library
@@ -37,12 +63,12 @@ def all_games():
                       'If this problem persists please contact support.')
         return
 
-    directory_items = create_directory_items(steam_games_details)
-    xbmcplugin.addDirectoryItems(plugin.handle, directory_items)
+    add_games_page(all_games, steam_games_details)
 
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_LABEL)
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_PLAYCOUNT)
     xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
+    complete_listing()
 
 
 @plugin.route('/installed')
@@ -56,7 +82,8 @@ def installed_games():
         return
 
     try:
-        steam_games_details = steam.get_user_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
+        with perf.span('library'):
+            steam_games_details = library.get_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
 
     except IOError as e:
         # something went wrong, can't scan the steam library
@@ -64,17 +91,16 @@ def installed_games():
                       'If this problem persists please contact support.')
         return
 
-    installed_appids = registry.get_installed_steam_apps(os.path.join(__addon__.getSetting('steam-path'), 'registry.vdf'))
-
     # filter out any applications not listed as installed
-    steam_installed_games = filter(lambda app_entry: str(app_entry['appid']) in installed_appids, steam_games_details)
+    installed_appids = get_installed_appids()
+    steam_installed_games = [app_entry for app_entry in steam_games_details if app_entry.appid in installed_appids]
 
-    directory_items = create_directory_items(steam_installed_games)
-    xbmcplugin.addDirectoryItems(plugin.handle, directory_items)
+    add_games_page(installed_games, steam_installed_games)
 
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_LABEL)
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_PLAYCOUNT)
     xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
+    complete_listing()
 
 
 @plugin.route('/recent')
@@ -83,7 +109,8 @@ def recent_games():
         return
 
     try:
-        steam_games_details = steam.get_user_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'), recent_only=True)
+        with perf.span('library'):
+            steam_games_details = library.get_recent_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
 
     except IOError as e:
         # something went wrong, can't scan the steam library
@@ -91,13 +118,96 @@ def recent_games():
                       'If this problem persists please contact support.')
         return
 
-    directory_items = create_directory_items(steam_games_details)
-    xbmcplugin.addDirectoryItems(plugin.handle, directory_items)
+    add_games_page(recent_games, steam_games_details)
 
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_UNSORTED, "Last played")
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_PLAYCOUNT)
     xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_LABEL)
     xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
+    complete_listing()
+
+
+@plugin.route('/search')
+def search():
+    if not all_required_credentials_available():
+        return
+
+    query = plugin.args.get('query', [''])[0]
+    if not query:
+        query = xbmcgui.Dialog().input('Search games')
+        xbmcplugin.endOfDirectory(plugin.handle, succeeded=False)
+        if query:
+            # The results are listed at their own url, so that going back to them or refreshing them does not ask for the query again
+            xbmc.executebuiltin('Container.Update({0})'.format(plugin.url_for(search, query=query)))
+        return
+
+    try:
+        with perf.span('library'):
+            steam_games_details = library.find_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'), query)
+
+    except IOError as e:
+        # something went wrong, can't scan the steam library
+        show_error(e, 'An unexpected error has occurred while contacting Steam. Please ensure your Steam credentials are correct and then try again. '
+                      'If this problem persists please contact support.')
+        return
+
+    add_games_page(search, steam_games_details, query=query)
+
+    xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_UNSORTED, "Relevance")
+    xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_LABEL)
+    xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_PLAYCOUNT)
+    xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
+    complete_listing()
+
+
+@plugin.route('/playtime')
+def playtime_ranges():
+    for label, min_playtime, max_playtime in PLAYTIME_RANGES:
+        filter_parameters = {'min_playtime': min_playtime}
+        if max_playtime is not None:
+            filter_parameters['max_playtime'] = max_playtime
+        xbmcplugin.addDirectoryItem(handle=plugin.handle, url=plugin.url_for(filtered_games, **filter_parameters), listitem=xbmcgui.ListItem(label), isFolder=True)
+    xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
+
+
+@plugin.route('/filter')
+def filtered_games():
+    """
+    Lists the games matching the filters given as query parameters, the most played first :
+    "played" (true or false), "installed" (true), "min_playtime" and "max_playtime" (in minutes).
+    """
+    if not all_required_credentials_available():
+        return
+
+    played = {'true': True, 'false': False}.get(plugin.args.get('played', [''])[0])
+    installed_only = plugin.args.get('installed', [''])[0] == 'true'
+    if installed_only and not os.path.isdir(__addon__.getSetting('steam-path')):
+        # ensure required data is available
+        show_error(NameError("steam-path not found"), 'Unable to find your Steam path, please check your settings.')
+        return
+
+    try:
+        with perf.span('library'):
+            steam_games_details = library.find_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'), played=played,
+                                                     min_playtime=get_query_int('min_playtime'), max_playtime=get_query_int('max_playtime'))
+
+    except IOError as e:
+        # something went wrong, can't scan the steam library
+        show_error(e, 'An unexpected error has occurred while contacting Steam. Please ensure your Steam credentials are correct and then try again. '
+                      'If this problem persists please contact support.')
+        return
+
+    if installed_only:
+        installed_appids = get_installed_appids()
+        steam_games_details = [app_entry for app_entry in steam_games_details if app_entry.appid in installed_appids]
+
+    add_games_page(filtered_games, steam_games_details,
+                   **dict((name, plugin.args[name][0]) for name in FILTER_PARAMETERS if name in plugin.args))
+
+    xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_PLAYCOUNT)
+    xbmcplugin.addSortMethod(plugin.handle, xbmcplugin.SORT_METHOD_LABEL)
+    xbmcplugin.endOfDirectory(plugin.handle, succeeded=True)
+    complete_listing()
 
 
 @plugin.route('/install/<appid>')
@@ -107,7 +217,10 @@ def install(appid):
         show_error(NameError('steam-exe not found'), 'Unable to find your Steam executable, please check your settings.')
         return
 
-    steam.install(__addon__.getSetting('steam-exe'), appid)
+    if __addon__.getSetting('enable-detached-launch') == 'false':
+        steam.install(__addon__.getSetting('steam-exe'), appid)
+    else:
+        launcher.launch('install', appid)
 
 
 @plugin.route('/run/<appid>')
@@ -117,20 +230,100 @@ def run(appid):
         show_error(NameError('steam-exe not found'), 'Unable to find your Steam executable, please check your settings.')
         return
 
-    steam.run(__addon__.getSetting('steam-exe'), __addon__.getSetting('steam-args'), appid)
+    if __addon__.getSetting('enable-detached-launch') == 'false':
+        steam.run(__addon__.getSetting('steam-exe'), __addon__.getSetting('steam-args'), appid)
+    else:
+        launcher.launch('run', appid)
 
 
 @plugin.route('/delete_cache')
 def delete_cache():
     steam.delete_cache()
+    library.delete_cache()
     arts.delete_cache()
+    localarts.delete_cache()
+    metadata.delete_cache()
+
+
+# Sort keys accepted by the "sort" query parameter of the games lists, along with whether they sort in descending order
+SORT_KEYS = {
+    'name': (lambda app_entry: app_entry.name.lower(), False),
+    'playtime': (lambda app_entry: app_entry.playtime_forever, True),
+    'last_played': (lambda app_entry: app_entry.rtime_last_played, True),
+}
+
+
+def get_installed_appids():
+    """
+    Obtains the appids of the games/apps installed in the Steam folder of the settings, from the indexes of the service when it keeps them up to date.
+
+    :return: set of appids (integers)
+    """
+    registry_path = os.path.join(__addon__.getSetting('steam-path'), 'registry.vdf')
+    installed_appids = None
+    with perf.span('registry'):
+        if xbmcgui.Window(10000).getProperty(watcher.WATCHER_PROPERTY) == __addon__.getSetting('steam-path'):
+            # The service keeps the installed apps indexes up to date, no need to read the Steam files
+            installed_appids = registry.get_indexed_installed_steam_apps(registry_path)
+        if installed_appids is None:
+            installed_appids = registry.get_installed_steam_apps(registry_path)
+        return set(int(appid) for appid in installed_appids)
+
+
+def get_query_int(name, minimum=0):
+    """
+    Reads an integer query parameter of the current plugin url.
+
+    :param name: name of the query parameter
+    :param minimum: smallest valid value of the parameter. Defaults to 0
+    :return: the value of the parameter, or None if it is missing or invalid
+    """
+    try:
+        value = int(plugin.args.get(name, [''])[0])
+    except ValueError:
+        return None
+    return value if value >= minimum else None
+
+
+def add_games_page(route, app_entries, **route_parameters):
+    """
+    Adds the list items of the requested page of the game entries to the directory, followed by a "next page" folder item if there are more entries.
+    The page is selected with the "sort", "offset" and "limit" query parameters of the current plugin url, so that widgets only pay for the items they display.
+    Without these parameters, every entry is added in its original order.
+
+    :param route: route function of the current listing, used to build the url of the next page
+    :param app_entries: iterable of :class:`steam.Game` records, see :func:`create_directory_items`
+    :param route_parameters: query parameters of the current listing (search query, filters...), kept in the url of the next page
+    """
+    app_entries = list(app_entries)
+    sort = plugin.args.get('sort', [''])[0]
+    offset = get_query_int('offset') or 0
+    limit = get_query_int('limit', minimum=1)  # An empty page would link to itself as its next page
+
+    if sort in SORT_KEYS:
+        sort_key, descending = SORT_KEYS[sort]
+        app_entries.sort(key=sort_key, reverse=descending)
+
+    end = len(app_entries) if limit is None else offset + limit
+    directory_items = create_directory_items(app_entries[offset:end])
+
+    if end < len(app_entries):
+        next_page_parameters = dict(route_parameters, offset=end, limit=limit)
+        if sort in SORT_KEYS:
+            next_page_parameters['sort'] = sort
+        next_page_item = xbmcgui.ListItem('Next page')
+        next_page_item.setProperty('SpecialSort', 'bottom')  # Keeps the item at the end of the list, whatever the sort method chosen by the user
+        directory_items.append((plugin.url_for(route, **next_page_parameters), next_page_item, True))
+
+    with perf.span('add_directory_items'):
+        xbmcplugin.addDirectoryItems(plugin.handle, directory_items)
 
 
 def create_directory_items(app_entries):
     """
     Creates a list item for each game/app entry provided
 
-    :param app_entries: array of game entries, with each entry containing at least keys : appid, name, img_icon_url, img_logo_url, playtime_forever
+    :param app_entries: iterable of :class:`steam.Game` records
     :returns: an array of list items of the game entries, formatted like so : [(url,listItem,bool),..]
     """
 
@@ -138,49 +331,78 @@ def create_directory_items(app_entries):
     xbmcplugin.setContent(plugin.handle, "movies")
     # TODO setContent to games when more skins support this content type.
 
+    app_entries = list(app_entries)
+    with perf.span('arts'):
+        arts_dictionaries = create_arts_dictionaries(app_entries)
+    # The details of the Steam Store are only read from the metadata store, they are fetched in the background by the service
+    with perf.span('metadata'):
+        apps_metadata = metadata.get_metadata([app_entry.appid for app_entry in app_entries]) if metadata.storeMetadataEnabled else {}
+
     directory_items = []
-    for app_entry in app_entries:
-        appid = str(app_entry['appid'])
-        name = app_entry['name']
+    with perf.span('list_items'):
+        for app_entry in app_entries:
+            appid = str(app_entry.appid)
+            name = app_entry.name
 
-        run_url = plugin.url_for(run, appid=appid)
-        item = xbmcgui.ListItem(name)
-        item.setUniqueIDs({'steam': appid, 'steam_img_icon': app_entry['img_icon_url']})
-        item.setInfo('video', {'playcount': app_entry.get('playtime_forever', 0)})
-        item.setContentLookup(False)  # Tells Kodi not to send HEAD requests (used to determine MIME type for example) to the item's run URL.
+            run_url = plugin.url_for(run, appid=appid)
+            item = xbmcgui.ListItem(name)
+            item.setUniqueIDs({'steam': appid, 'steam_img_icon': app_entry.img_icon_url})
+            info_labels = dict(apps_metadata.get(app_entry.appid, {}))
+            info_labels['playcount'] = app_entry.playtime_forever
+            item.setInfo('video', info_labels)
+            item.setContentLookup(False)  # Tells Kodi not to send HEAD requests (used to determine MIME type for example) to the item's run URL.
 
-        item.addContextMenuItems([('Play', 'RunPlugin(' + run_url + ')'),
-                                  ('Install', 'RunPlugin(' + plugin.url_for(install, appid=appid) + ')')],
-                                 replaceItems=True)  # Since we set the content type to "movies", default movie context elements may appear. We replace them.
+            item.addContextMenuItems([('Play', 'RunPlugin(' + run_url + ')'),
+                                      ('Install', 'RunPlugin(' + plugin.url_for(install, appid=appid) + ')')],
+                                     replaceItems=True)  # Since we set the content type to "movies", default movie context elements may appear. We replace them.
 
-        art_dictionary = create_arts_dictionary(app_entry)
-        item.setArt(art_dictionary)
+            item.setArt(arts_dictionaries[appid])
 
-        directory_items.append((run_url, item, False))
+            directory_items.append((run_url, item, False))
 
     return directory_items
 
 
-def create_arts_dictionary(app_entry):
+def create_arts_dictionaries(app_entries):
     """
-    Creates a dictionary of arts keys and their associated links, for a given app entry.
-    :param app_entry: dictionary of app information, containing at least the keys : appid, img_icon_url, img_logo_url
-    :return: dictionary of arts for the app.
-    """
-
-    appid = str(app_entry['appid'])
-    img_icon_url = app_entry['img_icon_url']
-    art_dictionary = {}
-
-    # Multiple fanart https://kodi.wiki/view/Artwork_types#fanart.23
-    SUPPORTED_ART_TYPES = ['poster', 'landscape', 'banner', 'clearlogo', 'thumb', 'fanart', 'fanart1', 'fanart2', 'icon']
+    Creates a dictionary of arts keys and their associated links, for each given app entry.
+    The arts of all the entries are read from the arts index in bulk, and only the missing ones are resolved, together.
+    When the local arts cache is enabled, the cached arts are given as local paths.
 
-    for art_type in SUPPORTED_ART_TYPES:
-        art_dictionary[art_type] = arts.resolve_art_url(art_type, appid, img_icon_url)
-    return art_dictionary
+    :param app_entries: list of :class:`steam.Game` records
+    :return: dictionary mapping each appid (as a string) to its dictionary of arts.
+    """
+    art_resolution_timeout = int(__addon__.getSetting('art-resolution-timeout') or 0)
+    deadline = time.time() + art_resolution_timeout if art_resolution_timeout > 0 else None
+    apps_arts = arts.resolve_apps_arts([(str(app_entry.appid), app_entry.img_icon_url) for app_entry in app_entries], deadline=deadline)
+    return localarts.get_local_arts(apps_arts) if localarts.localArtsEnabled else apps_arts
 
 
-def main():
+def complete_listing():
+    """
+    Once the listing is displayed, finishes the work it deferred : the art availability checks which missed its deadline, and the sync of an expired library snapshot.
+    The container is then refreshed once, if the user is still looking at the listing and something changed.
+    The arts missing from the local arts cache are queued last, for the service to download them. They are used from the next listings on.
+    """
+    listing_path = plugin.base_url + plugin.path
+    with perf.span('complete_listing'):
+        late_arts_resolved = arts.complete_late_arts()
+        games_changed = library.revalidate()
+        if (late_arts_resolved or games_changed) and xbmc.getInfoLabel('Container.FolderPath').startswith(listing_path):
+            log('Listing completed, refreshing ' + listing_path)
+            xbmc.executebuiltin('Container.Refresh')
+        if localarts.localArtsEnabled and localarts.queue_missing_arts():
+            if launcher.is_service_available():
+                localarts.request_downloads()
+            else:  # Without the service, every listing downloads a few of the queued arts
+                localarts.download_queued_arts(limit=localarts.LISTING_DOWNLOAD_LIMIT)
+    transport.log_pool_stats()
+
+
+def load_settings():
+    """
+    Logs the settings, fills in the missing ones with their best guess, and runs the upgrade mechanisms of the addon versions.
+    """
     log('steam-id = ' + __addon__.getSetting('steam-id'))
     log('steam-key = ' + __addon__.getSetting('steam-key'))
     log('steam-exe = ' + __addon__.getSetting('steam-exe'))
@@ -228,28 +450,42 @@ def main():
             __addon__.setSetting('steam-exe', os.path.expandvars('%ProgramFiles(x86)%\\Steam\\Steam.exe'))
             __addon__.setSetting('steam-path', os.path.expandvars('%ProgramFiles(x86)%\\Steam\\Steam.exe'))
 
-    if __addon__.getSetting('version') == '':
+    previous_version = __addon__.getSetting('version')
+    new_version = __addon__.getAddonInfo('version')
+    if previous_version == '':
         # first time run, store version
-        __addon__.setSetting('version', __addon__.getAddonInfo('version'))
+        __addon__.setSetting('version', new_version)
 
-    else:
-        previous_version= __addon__.getSetting('version').split(".")
-        previous_version= list(map(int, previous_version))
+    elif previous_version != new_version:
+        if parse_version(previous_version) < parse_version(new_version):
+            log('Updating from version {0} to {1}'.format(previous_version, new_version), xbmc.LOGINFO)
 
-        new_version= __addon__.getSetting('version').split(".")
-        new_version= list(map(int,new_version))
+            # Insert version upgrade mechanisms here before the following call, comparing parse_version(previous_version) to the first version not needing them
 
-        if previous_version[0] == 0 & previous_version[1] < 8:
-            #Starting with 0.8.0, the cache encoding changed and previous caches needs to be reset.
-            delete_cache()
+        __addon__.setSetting('version', new_version)
 
-        # Insert version upgrade mechanisms here before the following call
+    # The caches left by previous versions, including the ones whose encoding changed with 0.8.0, are converted instead of being deleted
+    migrations.upgrade_caches()
 
-        __addon__.setSetting('version', __addon__.getAddonInfo('version'))
+
+def parse_version(version):
+    """
+    :param version: version of the addon, for example '0.9.0'
+    :return: tuple of the numbers of the version, to compare versions with
+    """
+    return tuple(int(number) for number in re.findall(r'\d+', version))
 
 
+def main():
+    perf.start()
+    with perf.span('settings'):
+        load_settings()
+
     # prompt the user to configure the plugin with their steam details
     if not all_required_credentials_available():
         __addon__.openSettings()
 
-    plugin.run()
+    try:
+        plugin.run()
+    finally:
+        perf.report(plugin.path)
@@ -0,0 +1,244 @@
+'''
+persistent store of the Steam Store details of each game/app (genres, release year, developers, description), enriched in the background
+
+The listings only read the store, the details are fetched by the service on a rate limited pool of worker threads, for the games which are not stored yet or whose details expired.
+'''
+
+import html
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import xbmcaddon
+
+from . import database
+from . import singleflight
+from . import transport
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+storeMetadataEnabled = __addon__.getSetting("enable-store-metadata") != 'false'  # Default is true
+storeRequestsPerMinute = max(1, int(__addon__.getSetting("store-requests-per-minute") or 40))  # Default is 40, the Steam Store allows about 200 requests every 5 minutes
+storeWorkers = max(1, int(__addon__.getSetting("store-workers") or 2))  # Default is 2 concurrent requests
+daysBeforeMetadataExpiration = max(1, int(__addon__.getSetting("metadata-expire-after-days") or 30))  # Default is 30 days
+
+# Endpoint of the Steam Store returning the details of an app, see :func:`parse_app_details`
+STORE_API_URL = 'https://store.steampowered.com/api/appdetails'
+
+METADATA_FILE = 'metadata.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS app_metadata (
+    appid INTEGER PRIMARY KEY,
+    available INTEGER NOT NULL,
+    genres TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    developers TEXT NOT NULL,
+    plot TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+'''
+
+METADATA_EXPIRATION = timedelta(days=daysBeforeMetadataExpiration).total_seconds()
+# The apps without store page (tools, delisted games...) are asked again less often than the stored details expire
+UNAVAILABLE_EXPIRATION = 4 * METADATA_EXPIRATION
+
+# Number of apps whose details are fetched between two writes to the store and abort checks
+BATCH_SIZE = 20
+REQUEST_TIMEOUT = 10
+
+# Name of the single-flight lock of the enrichment, so that a single process queries the Steam Store at a time
+ENRICHMENT_LOCK = 'store-metadata'
+
+RELEASE_YEAR = re.compile(r'\b(\d{4})\b')
+HTML_TAGS = re.compile(r'<[^>]+>')
+
+# Session of the Steam Store requests, created on first use by :func:`get_session`
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_connection():
+    return database.get_connection(METADATA_FILE, SCHEMA)
+
+
+def get_session():
+    """
+    Obtains the session of the Steam Store requests, creating it on first use.
+
+    :return: a :class:`requests.Session`
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = transport.create_session(pool_size=storeWorkers)
+        return _session
+
+
+class RateLimiter(object):
+    """
+    Spaces the requests of several threads so that at most `requests_per_minute` requests are sent every minute.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute
+        self.next_request_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            request_at = max(now, self.next_request_at)
+            self.next_request_at = request_at + self.interval
+        if request_at > now:
+            time.sleep(request_at - now)
+
+
+def get_metadata(appids):
+    """
+    Reads the stored details of many games/apps in bulk, to set as the info labels of their list items. Never queries the network.
+
+    :param appids: list of appids (integers)
+    :return: dictionary mapping each appid with stored details to a dictionary of info labels : genre (list), year (integer), studio (list) and plot, only holding the known ones
+    """
+    apps_metadata = {}
+    connection = _get_connection()
+    for chunk in database.chunks(list(appids)):
+        rows = connection.execute('SELECT appid, genres, year, developers, plot FROM app_metadata WHERE available = 1 AND appid IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+        for appid, genres, year, developers, plot in rows:
+            info_labels = {'genre': json.loads(genres), 'year': year, 'studio': json.loads(developers), 'plot': plot}
+            apps_metadata[appid] = dict((label, value) for label, value in info_labels.items() if value)
+    return apps_metadata
+
+
+def get_stale_appids(appids, now=None):
+    """
+    :param appids: list of appids (integers)
+    :param now: timestamp used to find the expired details. Defaults to the current time
+    :return: list of the appids whose details are not stored or expired, in the given order
+    """
+    now = time.time() if now is None else now
+    fresh_appids = set()
+    connection = _get_connection()
+    for chunk in database.chunks(list(appids)):
+        rows = connection.execute('SELECT appid FROM app_metadata WHERE expires_at > ? AND appid IN ({0})'.format(','.join('?' * len(chunk))), [now] + chunk)
+        fresh_appids.update(appid for appid, in rows)
+    return [appid for appid in appids if appid not in fresh_appids]
+
+
+def parse_app_details(appid, details):
+    """
+    Extracts the stored fields from an appdetails response of the Steam Store.
+
+    :param appid: appid (integer) of the game/app
+    :param details: decoded JSON response, formatted like so : {"<appid>": {"success": true, "data": {"genres": [{"description": "Action"}], "release_date": {"date": "10 Oct, 2007"}, "developers": ["Valve"], "short_description": "..."}}}
+    :return: tuple (available, genres, year, developers, plot), available is False if the game/app has no store page
+    """
+    app_details = details.get(str(appid)) or {}
+    data = app_details.get('data') if app_details.get('success') else None
+    if not isinstance(data, dict):
+        return False, [], 0, [], ''
+
+    genres = [genre.get('description', '') for genre in data.get('genres') or [] if genre.get('description')]
+    year_match = RELEASE_YEAR.search((data.get('release_date') or {}).get('date') or '')
+    developers = [developer for developer in data.get('developers') or [] if developer]
+    plot = html.unescape(HTML_TAGS.sub('', data.get('short_description') or '')).strip()
+    return True, genres, int(year_match.group(1)) if year_match else 0, developers, plot
+
+
+def fetch_app_details(appid, rate_limiter=None, api_url=STORE_API_URL):
+    """
+    Queries the Steam Store for the details of a game/app.
+
+    :param appid: appid (integer) of the game/app
+    :param rate_limiter: optional :class:`RateLimiter` shared by the workers
+    :param api_url: url of the appdetails endpoint. Defaults to the one of the Steam Store
+    :return: tuple (available, genres, year, developers, plot), see :func:`parse_app_details`
+    :raises:
+        :class:IOError: request.RequestException raised when there is an issue querying the Steam Store for any reason, or ValueError when the response is not valid JSON.
+    """
+    if rate_limiter is not None:
+        rate_limiter.wait()
+    response = get_session().get(transport.normalize_url(api_url), params={'appids': appid}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return parse_app_details(appid, response.json() or {})
+
+
+def _fetch_app_details_or_none(appid, rate_limiter, api_url):
+    try:
+        return fetch_app_details(appid, rate_limiter, api_url)
+    except (IOError, ValueError) as e:
+        log('Unable to fetch the store details of {0}: {1}'.format(appid, e))
+        return None
+
+
+def enrich(appids, monitor=None, max_workers=storeWorkers, requests_per_minute=storeRequestsPerMinute, batch_size=BATCH_SIZE, api_url=STORE_API_URL):
+    """
+    Fetches the Steam Store details of the games/apps which are not stored yet or whose details expired, and stores them batch by batch.
+    The appdetails endpoint only returns the full details of one app per request, the requests of a batch are spread over a pool of worker threads and rate limited together.
+    Stops early when a whole batch fails, for example when Steam rate limits us or can't be reached, the remaining apps are fetched by a later enrichment.
+    Does nothing if another process is already enriching the store, the apps are then fetched by a later enrichment as well.
+
+    :param appids: list of appids (integers), the first ones are fetched first
+    :param monitor: optional :class:`xbmc.Monitor`, the enrichment stops between two batches when Kodi requests an abort
+    :param max_workers: maximum number of requests running at the same time. Defaults to the user addon settings
+    :param requests_per_minute: maximum number of requests sent every minute. Defaults to the user addon settings
+    :param batch_size: number of apps whose details are stored in a single transaction
+    :param api_url: url of the appdetails endpoint. Defaults to the one of the Steam Store
+    :return: True if the details of every app which was not stored yet or expired are now stored, False if some of them must be fetched by a later enrichment
+    """
+    with singleflight.lock(ENRICHMENT_LOCK, timeout=0) as acquired:
+        if not acquired:
+            return False
+
+        stale_appids = get_stale_appids(appids)
+        if not stale_appids:
+            return True
+
+        log('Fetching the store details of {0} apps'.format(len(stale_appids)))
+        rate_limiter = RateLimiter(requests_per_minute)
+        stored_count = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for start in range(0, len(stale_appids), batch_size):
+                if monitor is not None and monitor.abortRequested():
+                    break
+                batch = stale_appids[start:start + batch_size]
+                results = list(executor.map(lambda appid: _fetch_app_details_or_none(appid, rate_limiter, api_url), batch))
+                rows = [(appid,) + result for appid, result in zip(batch, results) if result is not None]
+                if not rows:
+                    log('Stopping the store details enrichment, every request of the batch failed')
+                    break
+
+                now = time.time()
+                with _get_connection() as connection:
+                    connection.executemany('INSERT OR REPLACE INTO app_metadata (appid, available, genres, year, developers, plot, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                           ((appid, int(available), json.dumps(genres), year, json.dumps(developers), plot, now,
+                                             now + (METADATA_EXPIRATION if available else UNAVAILABLE_EXPIRATION))
+                                            for appid, available, genres, year, developers, plot in rows))
+                stored_count += len(rows)
+
+    log('Stored the store details of {0} of {1} apps'.format(stored_count, len(stale_appids)))
+    return stored_count == len(stale_appids)
+
+
+def delete_metadata(appids):
+    """
+    Deletes the stored details of many games/apps, for example the ones removed from the library.
+
+    :param appids: list of appids (integers)
+    """
+    with _get_connection() as connection:
+        for chunk in database.chunks(list(appids)):
+            connection.execute('DELETE FROM app_metadata WHERE appid IN ({0})'.format(','.join('?' * len(chunk))), chunk)
+
+
+def delete_cache():
+    """
+    Deletes every stored detail, they are fetched again by the service
+    """
+    with _get_connection() as connection:
+        connection.execute('DELETE FROM app_metadata')
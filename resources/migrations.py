@@ -0,0 +1,229 @@
+'''
+upgrades of the caches left by previous versions of the addon, converted to the current formats instead of being deleted
+
+The caches are versioned by the hidden "cache-version" setting : each upgrade converts the caches of a version to the next one, once.
+Only the data which can't be converted is deleted, so that an update of the addon does not cost a cold start against Steam and its CDN.
+'''
+
+import calendar
+import datetime
+import io
+import os
+import pickle
+import sqlite3
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import xbmc
+import xbmcaddon
+
+from . import artindex
+from . import arts
+from . import library
+from . import singleflight
+from . import steam
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+
+# Number of converted entries written to the caches in a single transaction
+BATCH_SIZE = 500
+
+# Name of the single-flight lock of the upgrades, so that the service and the plugin invocations don't convert the same caches
+UPGRADE_LOCK = 'cache-upgrade'
+
+# Classes which are really loaded from the pickled responses of requests-cache, any other class is replaced by :class:`_LegacyObject`
+PICKLE_SAFE_CLASSES = {
+    ('datetime', 'datetime'), ('datetime', 'date'), ('datetime', 'time'), ('datetime', 'timedelta'), ('datetime', 'timezone'),
+    ('collections', 'OrderedDict'), ('copyreg', '_reconstructor'), ('copy_reg', '_reconstructor'), ('_codecs', 'encode'),
+    ('builtins', 'object'), ('__builtin__', 'object'), ('builtins', 'dict'), ('__builtin__', 'dict'), ('builtins', 'list'), ('__builtin__', 'list'),
+    ('builtins', 'set'), ('__builtin__', 'set'), ('builtins', 'frozenset'), ('__builtin__', 'frozenset'), ('builtins', 'bytearray'), ('__builtin__', 'bytearray'),
+}
+
+
+class _LegacyObject(object):
+    """
+    Stands in for the classes of the pickled responses (requests, urllib3, http.client...), which may have changed or disappeared since they were pickled.
+    Only keeps their attributes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        for state_part in state if isinstance(state, tuple) else (state,):  # (__dict__, slots) for the classes with __slots__
+            if isinstance(state_part, dict):
+                self.__dict__.update((key, value) for key, value in state_part.items() if isinstance(key, str))
+
+    def __setitem__(self, key, value):
+        self.__dict__.setdefault('_legacy_items', {})[key] = value
+
+    def append(self, value):
+        self.__dict__.setdefault('_legacy_values', []).append(value)
+
+    def extend(self, values):
+        self.__dict__.setdefault('_legacy_values', []).extend(values)
+
+
+class _PermissiveUnpickler(pickle.Unpickler):
+    """
+    Unpickles the responses stored by requests-cache, whatever the versions of Python and of the modules which pickled them.
+    """
+
+    def find_class(self, module, name):
+        if (module, name) in PICKLE_SAFE_CLASSES:
+            return super(_PermissiveUnpickler, self).find_class(module, name)
+        return _LegacyObject
+
+
+def _to_timestamp(created_at, default):
+    if isinstance(created_at, datetime.datetime):
+        if created_at.tzinfo is None:  # requests-cache stored utcnow()
+            return min(calendar.timegm(created_at.timetuple()), time.time())
+        return min(created_at.timestamp(), time.time())
+    return default
+
+
+def _iter_legacy_responses(cache_path):
+    """
+    Reads the responses stored in a requests-cache sqlite file one at a time, without loading the whole file.
+
+    :param cache_path: path to the sqlite file
+    :return: generator of tuples (response, created_at). response has the attributes of a :class:`requests.Response` (url, status_code, _content...),
+        created_at is the timestamp at which it was stored. (None, None) for the entries which can't be read.
+    :raises:
+        :class:sqlite3.Error: when the file is not a requests-cache sqlite file
+    """
+    default_created_at = os.path.getmtime(cache_path)
+    connection = sqlite3.connect(cache_path)
+    try:
+        for key, value in connection.execute('SELECT key, value FROM responses'):
+            try:
+                entry = _PermissiveUnpickler(io.BytesIO(bytes(value)), encoding='latin1').load()  # latin1 reads the datetimes pickled by Python 2
+            except Exception as e:  # Pickles of other versions can raise anything
+                log('Unable to read the cached response {0}: {1}'.format(key, e))
+                yield None, None
+                continue
+            # requests-cache 0.5 stored (response, datetime) tuples, later versions a response with a created_at attribute
+            response, created_at = entry if isinstance(entry, tuple) and len(entry) == 2 else (entry, getattr(entry, 'created_at', None))
+            yield response, _to_timestamp(created_at, default_created_at)
+    finally:
+        connection.close()
+
+
+def _get_status_code(response):
+    status_code = getattr(response, 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def _get_content(response):
+    content = getattr(response, '_content', None)
+    return content.encode('latin1') if isinstance(content, str) else content  # Bodies pickled by Python 2 are read as latin1 strings
+
+
+def _convert_art_availabilities(cache_path):
+    """
+    Converts the arts availability cached by requests-cache (the HEAD requests of the art urls) to the arts index, batch by batch.
+
+    :return: tuple (number of availabilities written to the index, number of entries which could not be converted)
+    """
+    converted_count = 0
+    skipped_count = 0
+    batch = []
+    for response, created_at in _iter_legacy_responses(cache_path):
+        status_code = _get_status_code(response)
+        url = getattr(response, 'url', None)
+        if status_code is None or not isinstance(url, str) or not urlsplit(url).path.startswith('/'):
+            skipped_count += 1
+            continue
+        available = not 400 <= status_code < 600
+        # The arts are identified by their host independent path, see :mod:`cdn`
+        batch.append((urlsplit(url).path, available, created_at, created_at + arts.get_availability_ttl(available)))
+        if len(batch) >= BATCH_SIZE:
+            converted_count += artindex.import_availabilities(batch)
+            batch = []
+    if batch:
+        converted_count += artindex.import_availabilities(batch)
+    return converted_count, skipped_count
+
+
+def _convert_owned_games(cache_path, steam_user_id):
+    """
+    Converts the newest owned games list of a user cached by requests-cache (the responses of the Steam Web API) to the library snapshot, if the snapshot is empty.
+
+    :return: number of games written to the snapshot
+    """
+    newest_content = None
+    newest_created_at = None
+    for response, created_at in _iter_legacy_responses(cache_path):
+        url = getattr(response, 'url', None)
+        if _get_status_code(response) != 200 or not isinstance(url, str) or 'GetOwnedGames' not in url:
+            continue
+        if parse_qs(urlsplit(url).query).get('steamid') == [steam_user_id] and (newest_created_at is None or created_at > newest_created_at):
+            newest_content = _get_content(response)
+            newest_created_at = created_at
+
+    if not newest_content:
+        return 0
+    try:
+        games = list(steam.iter_games([newest_content]))
+    except IOError as e:
+        log('Unable to read the cached games list: {0}'.format(e), xbmc.LOGWARNING)
+        return 0
+    return len(games) if games and library.restore(steam_user_id, games, newest_created_at) else 0
+
+
+def _convert_requests_caches():
+    """
+    Converts the caches of the versions using requests-cache, then deletes them. A cache file which can't be read at all is deleted as well.
+    """
+    art_cache_path = arts.ART_AVAILABILITY_CACHE_FILE + '.sqlite'
+    if os.path.isfile(art_cache_path):
+        try:
+            converted_count, skipped_count = _convert_art_availabilities(art_cache_path)
+            log('Converted {0} cached art availabilities to the arts index, {1} could not be converted'.format(converted_count, skipped_count), xbmc.LOGINFO)
+        except (sqlite3.Error, IOError, OSError) as e:
+            log('Unable to convert the cached art availabilities, deleting them: {0}'.format(e), xbmc.LOGWARNING)
+        arts.delete_legacy_cache()
+
+    games_cache_path = steam.STEAM_GAMES_CACHE_FILE + '.sqlite'
+    if os.path.isfile(games_cache_path):
+        steam_user_id = __addon__.getSetting('steam-id')
+        try:
+            if steam_user_id:
+                log('Converted {0} cached games to the library snapshot'.format(_convert_owned_games(games_cache_path, steam_user_id)), xbmc.LOGINFO)
+        except (sqlite3.Error, IOError, OSError) as e:
+            log('Unable to convert the cached games, deleting them: {0}'.format(e), xbmc.LOGWARNING)
+        steam.delete_cache()
+
+
+# Upgrades of the caches, each converting the caches of a version to the next one. The version of the caches written by this version of the addon is their number.
+UPGRADES = [
+    _convert_requests_caches,
+]
+
+
+def get_cache_version():
+    """
+    :return: version of the caches of the profile folder, 0 for the caches of the versions using requests-cache
+    """
+    try:
+        return int(__addon__.getSetting('cache-version') or 0)
+    except ValueError:
+        return 0
+
+
+def upgrade_caches():
+    """
+    Runs the upgrades the caches did not go through yet, once. If another invocation is already upgrading them, waits for it to finish.
+    """
+    if get_cache_version() >= len(UPGRADES):
+        return
+
+    with singleflight.lock(UPGRADE_LOCK):
+        version = get_cache_version()
+        for upgrade in UPGRADES[version:]:
+            log('Upgrading the caches from version {0}'.format(version), xbmc.LOGINFO)
+            upgrade()
+            version += 1
+            __addon__.setSetting('cache-version', str(version))
@@ -0,0 +1,150 @@
+'''
+instrumentation of the hot paths : timing spans and counters of a plugin invocation, summarised in the log and appended to a rolling JSONL report in the profile folder
+
+The report lets slow listings be diagnosed from the files of a user. cProfile dumps of the invocations can be enabled in the addon settings as well.
+'''
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import xbmc
+import xbmcaddon
+
+from . import database
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+performanceReportEnabled = __addon__.getSetting("enable-performance-report") != 'false'  # Default is true
+profilingEnabled = __addon__.getSetting("enable-profiling") == 'true'  # Default is false
+
+REPORT_FILE = os.path.join(database.addonUserDataFolder, 'performance.jsonl')
+# Once the report grows beyond this size, only its newest half is kept
+MAX_REPORT_SIZE = 1024 * 1024
+PROFILES_FOLDER = os.path.join(database.addonUserDataFolder, 'profiles')
+# Number of cProfile dumps kept in the profiles folder, the oldest ones are deleted
+MAX_PROFILES = 10
+
+# Ratios of the report, computed from two counters : name -> (counter of the hits, counter of the misses)
+RATIOS = {
+    'art_cache_hit_ratio': ('art_index_hits', 'art_index_misses'),
+    'art_availability_hit_ratio': ('art_availability_hits', 'head_requests'),
+}
+
+# Spans and counters are updated by the worker threads as well
+_lock = threading.Lock()
+# name -> [total duration in seconds, number of spans]
+_spans = {}
+# name -> value
+_counters = {}
+_started_at = time.time()
+_profiler = None
+
+
+def start():
+    """
+    Starts the measures of an invocation, discarding the previous ones, and starts profiling it if enabled.
+    """
+    global _started_at, _profiler
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started_at = time.time()
+    if profilingEnabled and _profiler is None:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+@contextmanager
+def span(name):
+    """
+    Measures the duration of a stage. The spans of the same name are added up, along with their number.
+
+    :param name: name of the stage
+    """
+    span_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - span_start
+        with _lock:
+            span_totals = _spans.setdefault(name, [0.0, 0])
+            span_totals[0] += duration
+            span_totals[1] += 1
+
+
+def count(name, value=1):
+    """
+    Adds a value to a counter.
+
+    :param name: name of the counter
+    :param value: value to add. Defaults to 1
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def get_summary(route):
+    """
+    :param route: path of the invocation, for example '/all'
+    :return: dictionary summarising the invocation : route, started_at, duration_ms, spans {name: {ms, count}}, counters and ratios
+    """
+    with _lock:
+        spans = dict((name, {'ms': round(duration * 1000, 1), 'count': span_count}) for name, (duration, span_count) in _spans.items())
+        counters = dict(_counters)
+    ratios = {}
+    for ratio, (hits_counter, misses_counter) in RATIOS.items():
+        total = counters.get(hits_counter, 0) + counters.get(misses_counter, 0)
+        if total:
+            ratios[ratio] = round(float(counters.get(hits_counter, 0)) / total, 3)
+    return {'route': route, 'started_at': round(_started_at, 3), 'duration_ms': round((time.time() - _started_at) * 1000, 1),
+            'spans': spans, 'counters': counters, 'ratios': ratios}
+
+
+def _append_report(summary):
+    os.makedirs(database.addonUserDataFolder, exist_ok=True)
+    with open(REPORT_FILE, 'a') as report_file:
+        report_file.write(json.dumps(summary, separators=(',', ':')) + '\n')
+    if os.path.getsize(REPORT_FILE) > MAX_REPORT_SIZE:
+        with open(REPORT_FILE) as report_file:
+            lines = report_file.readlines()
+        with open(REPORT_FILE, 'w') as report_file:
+            report_file.writelines(lines[len(lines) // 2:])
+
+
+def _dump_profile(route):
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    profiler.disable()
+    os.makedirs(PROFILES_FOLDER, exist_ok=True)
+    profile_path = os.path.join(PROFILES_FOLDER, '{0}-{1}.prof'.format(time.strftime('%Y%m%d-%H%M%S'), route.strip('/').replace('/', '_') or 'index'))
+    profiler.dump_stats(profile_path)
+    for profile_file in sorted(os.listdir(PROFILES_FOLDER))[:-MAX_PROFILES]:
+        os.remove(os.path.join(PROFILES_FOLDER, profile_file))
+    return profile_path
+
+
+def report(route):
+    """
+    Writes the summary of the invocation to the log and appends it to the report in the profile folder, then dumps the profile of the invocation if enabled.
+
+    :param route: path of the invocation, for example '/all'
+    :return: the summary, see :func:`get_summary`
+    """
+    summary = get_summary(route)
+    if performanceReportEnabled:
+        log('Performance report ' + json.dumps(summary, separators=(',', ':')), xbmc.LOGINFO)
+        try:
+            _append_report(summary)
+        except (IOError, OSError) as e:
+            log('Unable to write the performance report: {0}'.format(e), xbmc.LOGWARNING)
+    if _profiler is not None:
+        try:
+            log('Profile written to ' + _dump_profile(route), xbmc.LOGINFO)
+        except (IOError, OSError) as e:
+            log('Unable to write the profile: {0}'.format(e), xbmc.LOGWARNING)
+    return summary
@@ -3,45 +3,166 @@ get registry values for steam games
 '''
 
 import os
+import re
+import json
 import xbmc
-import io
+from . import database
 from .util import *
 
 if os.name == 'nt':
     import winreg
 
+REGISTRY_CACHE_FILE = 'registry.sqlite'
 
-# https://github.com/lutris/lutris/blob/master/lutris/util/steam.py
-def vdf_parse(steam_config_file, config):
-    """Parse a Steam config file and return the contents as a dict with lowercase keys.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS parsed_files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    installed_appids TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS manifests (
+    path TEXT PRIMARY KEY,
+    library_path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    appid TEXT NOT NULL,
+    state_flags INTEGER NOT NULL,
+    size_on_disk INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS manifests_library_path ON manifests (library_path);
+'''
+
+# Path of the subtree of registry.vdf holding the apps, with lowercase keys
+REGISTRY_APPS_PATH = ('registry', 'hkcu', 'software', 'valve', 'steam', 'apps')
+
+# Path of the subtree of registry.vdf holding the state of the Steam client, with lowercase keys
+REGISTRY_STEAM_PATH = REGISTRY_APPS_PATH[:-1]
+
+# Candidate steamapps folders of the main Steam library, relative to the Steam folder. On Linux, ~/.steam links to the real Steam folder.
+STEAMAPPS_FOLDERS = ('steamapps', os.path.join('steam', 'steamapps'), os.path.join('root', 'steamapps'))
+
+# https://github.com/lutris/lutris/blob/master/lutris/util/steam/appmanifest.py
+STATE_FLAG_FULLY_INSTALLED = 4
+
+# Tokens of the text VDF format : quoted strings (which may span several lines), braces, comments, conditionals such as [$WIN32], and unquoted strings.
+# Only used for the files the faster str.split based tokenizer can't handle, see :func:`_split_tokens`.
+VDF_TOKENS = re.compile(r'"((?:[^"\\]|\\.)*)"|(\{)|(\})|//[^\n]*|\[[^\]\n]*\]|([^\s{}"]+)')
+
+# Installed apps already obtained by this invocation, path -> ((mtime_ns, size), installed_appids)
+_installed_apps_cache = {}
+
+
+def _get_connection():
+    return database.get_connection(REGISTRY_CACHE_FILE, SCHEMA)
+
+
+def _unescape(value):
+    return value.replace('\\"', '"').replace('\\\\', '\\') if '\\' in value else value
+
+
+def _split_tokens(text):
+    """
+    Tokenizes a VDF text by splitting it on its quotes : odd parts are the strings, even parts hold the braces between them.
+    Most of the work is done by str methods, without a per-line or per-character loop.
+
+    :return: a tuple (strings, structures), structures[i] holding the braces found before strings[i], and structures[-1] the braces after the last string.
+        None if the text holds escaped quotes, comments, conditionals or unquoted strings, which need :func:`_regex_tokens`
+    """
+    if '\\"' in text:
+        return None
+    parts = text.split('"')
+    if len(parts) % 2 == 0:  # Unbalanced quotes
+        return None
+
+    structures = list(map(str.strip, parts[0::2]))
+    if any(structure.strip('{} \t\r\n') for structure in structures if structure):
+        return None
+
+    strings = parts[1::2]
+    if '\\' in text:
+        strings = [_unescape(string) for string in strings]
+    return strings, structures
+
+
+def _regex_tokens(text):
+    """
+    Tokenizes any VDF text with a regular expression. Same result as :func:`_split_tokens`, but slower.
+    """
+    strings = []
+    structures = ['']
+    for match in VDF_TOKENS.finditer(text):
+        value, opening_brace, closing_brace, unquoted_value = match.groups()
+        if opening_brace or closing_brace:
+            structures[-1] += opening_brace or closing_brace
+        elif value is not None or unquoted_value is not None:  # Comments and conditionals are ignored
+            strings.append(_unescape(value) if value is not None else unquoted_value)
+            structures.append('')
+    return strings, structures
+
+
+def vdf_loads(text, path=()):
+    """
+    Parses the content of a Steam text VDF file, and returns it as a dict with lowercase keys.
     The motivation behind returning lowercase keys is that the case is not consistent between environments it seems.
+    The text is tokenized in bulk, then parsed without recursion nor line concatenation.
+
+    :param text: content of the VDF file
+    :param path: optional tuple of lowercase keys. Only the subtree at this path is built and returned, and the parsing stops right after it.
+    :return: the parsed dict, or the subtree at the requested path. None if a path was requested and not found.
     """
-    line = " "
-    while line:
-        try:
-            line = steam_config_file.readline()
-        except UnicodeDecodeError:
-            log("Error while reading Steam VDF file {}. Returning {}".format(steam_config_file, config), xbmc.LOGERROR)
-            return config
-        if not line or line.strip() == "}":
-            return config
-        while not line.strip().endswith("\""):
-            nextline = steam_config_file.readline()
-            if not nextline:
-                break
-            line = line[:-1] + nextline
-
-        line_elements = line.strip().split("\"")
-        if len(line_elements) == 3:
-            key = line_elements[1].lower()
-            steam_config_file.readline()  # skip '{'
-            config[key] = vdf_parse(steam_config_file, {})
-        else:
-            try:
-                config[line_elements[1].lower()] = line_elements[3]
-            except IndexError:
-                log('Malformed config file: {}'.format(line), xbmc.LOGERROR)
-    return config
+    strings, structures = _split_tokens(text) or _regex_tokens(text)
+
+    root = {}
+    subtrees = [root]  # Dicts being built, from the root to the current depth. None for the subtrees skipped because they are not on the requested path.
+    keys = []  # Keys of the subtrees being built, from the root to the current depth
+    current = root
+    key = None
+    for index, structure in enumerate(structures):
+        for character in structure:
+            if character == '{':
+                depth = len(keys)
+                keys.append(key)
+                if current is None or (depth < len(path) and key != path[depth]):
+                    current = None
+                else:
+                    subtree = {}
+                    current[key] = subtree
+                    current = subtree
+                subtrees.append(current)
+                key = None
+            elif character == '}':
+                if len(subtrees) == 1:
+                    log('Malformed config file: unexpected closing brace', xbmc.LOGERROR)
+                    return None if path else root
+                subtree = subtrees.pop()
+                if path and tuple(keys) == path:
+                    return subtree
+                keys.pop()
+                current = subtrees[-1]
+
+        if index < len(strings):
+            if key is None:
+                key = strings[index].lower()
+            else:
+                if current is not None:
+                    current[key] = strings[index]
+                key = None
+
+    return None if path else root
+
+
+def vdf_load(vdf_path, path=()):
+    """
+    Reads and parses a Steam text VDF file in one bulk read, see :func:`vdf_loads`.
+
+    :param vdf_path: path to the VDF file
+    :param path: optional tuple of lowercase keys, to only parse the subtree at this path
+    :return: the parsed dict, or the subtree at the requested path. None if a path was requested and not found.
+    """
+    with open(vdf_path, 'rb') as vdf_file:
+        text = vdf_file.read().decode('utf-8', errors='replace')
+    return vdf_loads(text, path)
 
 
 def is_installed_win(app_id):
@@ -64,6 +185,39 @@ def is_installed_win(app_id):
     return False
 
 
+def get_running_appid(registry_path):
+    """
+    Gets the appid of the game/app the Steam client is currently running, from the registry on Windows or from registry.vdf elsewhere.
+
+    :param registry_path: Path to the registry.vdf file, unused on Windows
+    :return: the appid as a string, '0' if no game/app is running. None if it could not be read
+    """
+    if os.name == 'nt':
+        try:
+            steam_key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, "Software\\Valve\\Steam")
+            return str(winreg.QueryValueEx(steam_key, "RunningAppID")[0])
+        except WindowsError:
+            return None
+
+    try:
+        steam = vdf_load(registry_path, REGISTRY_STEAM_PATH)
+    except (IOError, OSError):
+        return None
+    return None if steam is None else steam.get('runningappid', '0')
+
+
+def is_app_installed(state_flags, size_on_disk):
+    """
+    Gets whether an app manifest describes an installed app. An installed app being updated is not flagged as fully installed (StateFlags 1026 for example),
+    it still counts as installed as long as its files are on disk, while an app being installed for the first time has no size on disk yet.
+
+    :param state_flags: StateFlags of the app manifest
+    :param size_on_disk: SizeOnDisk of the app manifest, in bytes
+    :return: True if the app is installed
+    """
+    return bool(state_flags & STATE_FLAG_FULLY_INSTALLED) or size_on_disk > 0
+
+
 def get_installed_steam_apps(registry_path):
     """
     Obtains the steam games/apps installed on the computer.
@@ -85,16 +239,203 @@ def get_installed_steam_apps(registry_path):
             show_error(e, "Error while reading Windows registry")
             pass
     else:
-        with io.open(registry_path, 'r', encoding="utf-8") as file:
+        # The app manifests of every library folder are the source of truth, registry.vdf is only used when no library folder can be found
+        app_manifests = get_app_manifests(os.path.dirname(registry_path))
+        if app_manifests is not None:
+            installed_apps = [appid for appid, (state_flags, size_on_disk) in app_manifests.items() if is_app_installed(state_flags, size_on_disk)]
+        else:
+            installed_apps = _get_installed_apps_from_registry_vdf(registry_path)
+
+    return installed_apps
+
+
+def get_indexed_installed_steam_apps(registry_path):
+    """
+    Obtains the installed steam games/apps from the indexes of the addon only, without reading any Steam file.
+    Only valid while the indexes are kept up to date by the library watcher of the service, see :mod:`watcher`.
+
+    :param registry_path: Path to the registry.vdf file
+    :return: an array of appids that are installed, or None if nothing is indexed for this Steam folder
+    """
+    steamapps_folders = [os.path.realpath(os.path.join(os.path.dirname(registry_path), folder)) for folder in STEAMAPPS_FOLDERS]
+    connection = _get_connection()
+    if connection.execute('SELECT 1 FROM manifests WHERE library_path IN ({0}) LIMIT 1'.format(','.join('?' * len(steamapps_folders))), steamapps_folders).fetchone():
+        # Same condition as :func:`is_app_installed`
+        return [appid for (appid,) in connection.execute('SELECT DISTINCT appid FROM manifests WHERE state_flags & ? OR size_on_disk > 0', (STATE_FLAG_FULLY_INSTALLED,))]
+
+    row = connection.execute('SELECT installed_appids FROM parsed_files WHERE path = ?', (registry_path,)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+
+def get_library_folders(steam_path):
+    """
+    Obtains the steamapps folders of every Steam library, listed in the libraryfolders.vdf file of the main library.
+    Handles both the current format of the file, and the one used before mid-2021.
+
+    :param steam_path: Path to the Steam folder
+    :return: a list of paths to steamapps folders, the main one first. Empty if the main steamapps folder can't be found.
+    """
+    main_steamapps_folder = next((os.path.join(steam_path, folder) for folder in STEAMAPPS_FOLDERS if os.path.isdir(os.path.join(steam_path, folder))), None)
+    if main_steamapps_folder is None:
+        return []
+
+    steamapps_folders = [os.path.realpath(main_steamapps_folder)]
+    try:
+        library_folders = vdf_load(os.path.join(main_steamapps_folder, 'libraryfolders.vdf'), ('libraryfolders',)) or {}
+    except (IOError, OSError):
+        library_folders = {}
+
+    for key, library_folder in library_folders.items():
+        if not key.isdigit():  # TimeNextStatsReport, ContentStatsID...
+            continue
+        library_path = library_folder.get('path') if isinstance(library_folder, dict) else library_folder
+        if library_path:
+            steamapps_folder = os.path.realpath(os.path.join(library_path, 'steamapps'))
+            if steamapps_folder not in steamapps_folders and os.path.isdir(steamapps_folder):
+                steamapps_folders.append(steamapps_folder)
+
+    return steamapps_folders
+
+
+def _parse_app_manifest(manifest_path):
+    """
+    :return: a tuple (appid, state_flags, size_on_disk) read from an appmanifest_<appid>.acf file, or None if the file is not a valid manifest
+    """
+    try:
+        app_state = vdf_load(manifest_path, ('appstate',))
+    except (IOError, OSError) as e:
+        log('Error while reading app manifest {0}: {1}'.format(manifest_path, e), xbmc.LOGERROR)
+        return None
+    if not app_state or 'appid' not in app_state:
+        return None
+
+    try:
+        return app_state['appid'], int(app_state.get('stateflags', 0)), int(app_state.get('sizeondisk', 0))
+    except ValueError:
+        return app_state['appid'], 0, 0
+
+
+def update_app_manifest(manifest_path):
+    """
+    Updates the index entry of a single app manifest, after it was created, modified or deleted.
+
+    :param manifest_path: Path to the appmanifest_<appid>.acf file
+    """
+    try:
+        manifest_stat = os.stat(manifest_path)
+        manifest = _parse_app_manifest(manifest_path)
+    except OSError:
+        manifest = None
+
+    with _get_connection() as connection:
+        if manifest is None:
+            connection.execute('DELETE FROM manifests WHERE path = ?', (manifest_path,))
+        else:
+            appid, state_flags, size_on_disk = manifest
+            connection.execute('INSERT OR REPLACE INTO manifests (path, library_path, mtime_ns, size, appid, state_flags, size_on_disk) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (manifest_path, os.path.dirname(manifest_path), manifest_stat.st_mtime_ns, manifest_stat.st_size, appid, state_flags, size_on_disk))
+
+
+def get_app_manifests(steam_path):
+    """
+    Scans the app manifests of every Steam library folder. The manifests are indexed in the addon profile folder along with their modification time and size,
+    so that only the new or changed ones are parsed.
+
+    :param steam_path: Path to the Steam folder
+    :return: a dictionary mapping the appid of each manifest to a tuple (state_flags, size_on_disk). None if no Steam library folder can be found.
+    """
+    steamapps_folders = get_library_folders(steam_path)
+    if not steamapps_folders:
+        return None
+
+    connection = _get_connection()
+    indexed_manifests = {}
+    for chunk in database.chunks(steamapps_folders):
+        rows = connection.execute('SELECT path, mtime_ns, size, appid, state_flags, size_on_disk FROM manifests WHERE library_path IN ({0})'
+                                  .format(','.join('?' * len(chunk))), chunk)
+        indexed_manifests.update((row[0], row[1:]) for row in rows)
+
+    app_manifests = {}
+    changed_manifests = []
+    scanned_paths = set()
+    for steamapps_folder in steamapps_folders:
+        try:
+            entries = list(os.scandir(steamapps_folder))
+        except OSError as e:
+            log('Error while scanning library folder {0}: {1}'.format(steamapps_folder, e), xbmc.LOGERROR)
+            scanned_paths.update(path for path in indexed_manifests if os.path.dirname(path) == steamapps_folder)  # Kept in the index until the next successful scan
+            continue
+
+        for entry in entries:
+            if not (entry.name.startswith('appmanifest_') and entry.name.endswith('.acf')):
+                continue
             try:
-                vdf = vdf_parse(file, {})
-                apps = vdf['registry']['hkcu']['software']['valve']['steam']['apps']
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            scanned_paths.add(entry.path)
+
+            indexed_manifest = indexed_manifests.get(entry.path)
+            if indexed_manifest is not None and indexed_manifest[:2] == (entry_stat.st_mtime_ns, entry_stat.st_size):
+                mtime_ns, size, appid, state_flags, size_on_disk = indexed_manifest
+            else:
+                manifest = _parse_app_manifest(entry.path)
+                if manifest is None:
+                    continue
+                appid, state_flags, size_on_disk = manifest
+                changed_manifests.append((entry.path, steamapps_folder, entry_stat.st_mtime_ns, entry_stat.st_size, appid, state_flags, size_on_disk))
+
+            # An app may have a manifest in several libraries while being moved, the installed one wins
+            previous_state_flags, previous_size_on_disk = app_manifests.get(appid, (0, 0))
+            if not is_app_installed(previous_state_flags, previous_size_on_disk):
+                app_manifests[appid] = (state_flags, size_on_disk)
+
+    removed_paths = [(path,) for path in indexed_manifests if path not in scanned_paths]
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO manifests (path, library_path, mtime_ns, size, appid, state_flags, size_on_disk) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               changed_manifests)
+        connection.executemany('DELETE FROM manifests WHERE path = ?', removed_paths)
+        # Forget the libraries which are not listed anymore, or not mounted
+        connection.execute('DELETE FROM manifests WHERE library_path NOT IN ({0})'.format(','.join('?' * len(steamapps_folders))), steamapps_folders)
+    if changed_manifests or removed_paths:
+        log('App manifests index updated: {0} changed, {1} removed'.format(len(changed_manifests), len(removed_paths)))
+
+    return app_manifests
+
+
+def _get_installed_apps_from_registry_vdf(registry_path):
+    """
+    Obtains the installed apps listed in a registry.vdf file. The result is cached along with the modification time and size of the file,
+    in memory and in the addon profile folder, so that an unchanged file is never parsed again.
+
+    :param registry_path: Path to the registry.vdf file
+    :return: an array of appids that are installed.
+    """
+    try:
+        file_stat = os.stat(registry_path)
+    except OSError as e:
+        show_error(e, "Error while reading registry.vdf")
+        return []
+    file_signature = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    if _installed_apps_cache.get(registry_path, (None, None))[0] == file_signature:
+        return _installed_apps_cache[registry_path][1]
+
+    row = _get_connection().execute('SELECT mtime_ns, size, installed_appids FROM parsed_files WHERE path = ?', (registry_path,)).fetchone()
+    if row is not None and tuple(row[:2]) == file_signature:
+        installed_apps = json.loads(row[2])
+    else:
+        apps = vdf_load(registry_path, REGISTRY_APPS_PATH)
+        if apps is None:
+            show_error(KeyError('apps'), "Error finding the values from registry.vdf")
+            return []
 
-                # apparently case of 'installed' differs depending on ... ?
-                # We create a list of the apps that have a "installed" key equal to "1".
-                installed_apps = [appid for (appid, information) in apps.items() if (information.get('installed', '0') == '1')]
-            except KeyError as e:
-                show_error(e, "Error finding the values from registry.vdf")
-                pass
+        # apparently case of 'installed' differs depending on ... ?
+        # We create a list of the apps that have a "installed" key equal to "1".
+        installed_apps = [appid for (appid, information) in apps.items() if isinstance(information, dict) and information.get('installed', '0') == '1']
+        with _get_connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO parsed_files (path, mtime_ns, size, installed_appids) VALUES (?, ?, ?, ?)',
+                               (registry_path, file_signature[0], file_signature[1], json.dumps(installed_apps)))
 
+    _installed_apps_cache[registry_path] = (file_signature, installed_apps)
     return installed_apps
@@ -0,0 +1,204 @@
+'''
+background service, started by Kodi at login, keeping the caches of the plugin warm
+'''
+
+import os
+import threading
+import time
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+
+from . import artindex
+from . import arts
+from . import cdn
+from . import launcher
+from . import library
+from . import localarts
+from . import metadata
+from . import migrations
+from . import watcher
+from .util import *
+
+__addon__ = xbmcaddon.Addon()
+
+# Number of games/apps whose arts are resolved between two abort & rate limit checks
+PREWARM_BATCH_SIZE = 20
+# Concurrent availability checks of the service, kept low so the service stays in the background
+PREWARM_WORKERS = 2
+# Delay in seconds before an enrichment which stopped early (rate limited by Steam, offline...) is retried
+ENRICHMENT_RETRY_DELAY = 15 * 60
+
+# The state of the service is published as properties of the home window, for skins and the plugin to read
+STATE_PROPERTY = __addon__.getAddonInfo('id') + '.prewarm.state'
+PROGRESS_PROPERTY = __addon__.getAddonInfo('id') + '.prewarm.progress'
+
+
+class ServiceMonitor(xbmc.Monitor):
+    """
+    Monitor of the service, which also receives the launches handed over by the plugin, see :mod:`launcher`, and its requests to download the queued local arts, see :mod:`localarts`
+    """
+
+    def onNotification(self, sender, method, data):
+        if sender == __addon__.getAddonInfo('id') and method.endswith(launcher.LAUNCH_MESSAGE):
+            launcher.start_supervision(self, data)
+        elif sender == __addon__.getAddonInfo('id') and method.endswith(localarts.DOWNLOADS_MESSAGE):
+            download_thread = threading.Thread(target=localarts.download_queued_arts, kwargs={'monitor': self}, name='local-arts')
+            download_thread.daemon = True
+            download_thread.start()
+
+
+def set_state(state, progress=''):
+    """
+    Publishes the state of the art pre-warming, and logs it.
+
+    :param state: one of 'waiting', 'running', 'done', 'aborted' or 'failed'
+    :param progress: progress of the pre-warming, formatted as "done/total"
+    """
+    home_window = xbmcgui.Window(10000)
+    home_window.setProperty(STATE_PROPERTY, state)
+    home_window.setProperty(PROGRESS_PROPERTY, progress)
+    log('Art pre-warming {0} {1}'.format(state, progress))
+
+
+def refresh_library():
+    """
+    Syncs the library snapshot when it expired, so that the games lists never have to wait for, or serve an outdated answer of, the Steam Web API.
+    The arts and store details of the games removed from the library are dropped.
+
+    :return: the :class:`library.LibraryDelta` of the sync, falsy if the games did not change or could not be synced
+    """
+    try:
+        delta = library.sync_if_expired(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
+    except IOError as e:
+        show_error(e, 'Unable to sync the library', display_notification=False)
+        return library.NO_CHANGES
+
+    if delta.removed:
+        artindex.delete_resolved_arts([str(appid) for appid in delta.removed])
+        metadata.delete_metadata(delta.removed)
+    return delta
+
+
+def prewarm_arts(monitor, appids=None):
+    """
+    Resolves the arts of the owned games/apps, so that the art availability checks are done before the user opens a listing.
+    The games whose arts are already indexed are skipped, and the checks are rate limited.
+
+    :param monitor: a :class:`xbmc.Monitor`, the pre-warming stops as soon as Kodi requests an abort
+    :param appids: set of appids (integers) to pre-warm, for example the games added or changed by a sync. None to pre-warm every game/app
+    :return: True if every game/app was processed, False if the pre-warming was interrupted or failed
+    """
+    try:
+        steam_games_details = library.get_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
+    except IOError as e:
+        show_error(e, 'Unable to pre-warm the arts cache', display_notification=False)
+        set_state('failed')
+        return False
+
+    apps = arts.get_unresolved_apps([(str(app_entry.appid), app_entry.img_icon_url) for app_entry in steam_games_details
+                                     if appids is None or app_entry.appid in appids])
+    checks_per_second = max(1, int(__addon__.getSetting('prewarm-checks-per-second') or 5))
+    # Every batch lasts at least as long as its checks would take at the configured rate
+    minimum_batch_duration = float(PREWARM_BATCH_SIZE * arts.count_checked_urls()) / checks_per_second
+
+    for start in range(0, len(apps), PREWARM_BATCH_SIZE):
+        set_state('running', '{0}/{1}'.format(start, len(apps)))
+        batch_start_time = time.time()
+        arts.resolve_apps_arts(apps[start:start + PREWARM_BATCH_SIZE], max_workers=PREWARM_WORKERS)
+
+        remaining_batch_duration = minimum_batch_duration - (time.time() - batch_start_time)
+        if monitor.waitForAbort(max(remaining_batch_duration, 0.001)):
+            set_state('aborted', '{0}/{1}'.format(start + PREWARM_BATCH_SIZE, len(apps)))
+            return False
+
+    set_state('done', '{0}/{0}'.format(len(apps)))
+    return True
+
+
+def enrich_metadata(monitor, appids=None):
+    """
+    Fetches the Steam Store details of the owned games/apps which are not stored yet or expired, the most recently played first.
+
+    :param monitor: a :class:`xbmc.Monitor`, the enrichment stops when Kodi requests an abort
+    :param appids: set of appids (integers) to enrich, for example the games added by a sync. None to enrich every game/app
+    :return: True if the details of every game/app are stored, False if the library could not be read or some details must be fetched again, see :func:`metadata.enrich`
+    """
+    try:
+        steam_games_details = library.get_games(__addon__.getSetting('steam-key'), __addon__.getSetting('steam-id'))
+    except IOError as e:
+        show_error(e, 'Unable to fetch the store details', display_notification=False)
+        return False
+
+    steam_games_details.sort(key=lambda app_entry: app_entry.rtime_last_played, reverse=True)
+    return metadata.enrich([app_entry.appid for app_entry in steam_games_details if appids is None or app_entry.appid in appids], monitor)
+
+
+def start_library_watcher(monitor):
+    """
+    Starts watching the installed Steam library in a background thread, when inotify is available.
+
+    :param monitor: a :class:`xbmc.Monitor`, the watcher stops when Kodi requests an abort
+    :return: the watcher thread, or None if the library can't be watched
+    """
+    steam_path = __addon__.getSetting('steam-path')
+    if __addon__.getSetting('enable-library-watcher') == 'false' or not watcher.is_supported() or not os.path.isdir(steam_path):
+        return None
+
+    watcher_thread = threading.Thread(target=watcher.run, args=(monitor, steam_path), name='steam-library-watcher')
+    watcher_thread.daemon = True
+    watcher_thread.start()
+    return watcher_thread
+
+
+def main():
+    monitor = ServiceMonitor()
+    home_window = xbmcgui.Window(10000)
+    home_window.setProperty(launcher.SERVICE_PROPERTY, 'true')
+    set_state('waiting')
+    watcher_thread = start_library_watcher(monitor)
+    # The caches of a previous version are converted before they are used, or the pre-warming would check every art again
+    migrations.upgrade_caches()
+
+    # Give Kodi some time to finish starting up before using the network
+    if monitor.waitForAbort(int(__addon__.getSetting('prewarm-delay-seconds') or 30)):
+        home_window.clearProperty(launcher.SERVICE_PROPERTY)
+        return
+
+    prewarmed = False
+    enriched = False
+    # The checks of the service are rate limited by prewarm-checks-per-second instead of the re-probe budget of the listings
+    arts.set_reprobe_budget(None)
+    while not monitor.abortRequested():
+        if cdn.needs_sampling():
+            cdn.sample_hosts(arts.get_session())
+        if all_required_credentials_available():
+            delta = refresh_library()
+            if __addon__.getSetting('enable-art-prewarm') == 'true' and arts.artFallbackEnabled:
+                # Every game is pre-warmed once, then only the games added or changed by the syncs
+                if not prewarmed:
+                    prewarmed = prewarm_arts(monitor)
+                elif delta.added or delta.changed:
+                    prewarm_arts(monitor, delta.added | delta.changed)
+            if metadata.storeMetadataEnabled:
+                # Every game is enriched once, then only the games added by the syncs. Every game is enriched again after an incomplete enrichment
+                if not enriched:
+                    enriched = enrich_metadata(monitor)
+                elif delta.added:
+                    enriched = enrich_metadata(monitor, delta.added)
+
+        # The arts queued while the service was not running. The next ones are downloaded as soon as the listings queue them, see ServiceMonitor
+        localarts.download_queued_arts(monitor=monitor)
+
+        # The arts of newly owned games are resolved once the games list may have changed
+        wait_duration = 60 * int(__addon__.getSetting('games-expire-after-minutes') or 4320)
+        if metadata.storeMetadataEnabled and not enriched:
+            wait_duration = min(wait_duration, ENRICHMENT_RETRY_DELAY)
+        if monitor.waitForAbort(wait_duration):
+            break
+
+    set_state('aborted')
+    home_window.clearProperty(launcher.SERVICE_PROPERTY)
+    if watcher_thread is not None:
+        watcher_thread.join(timeout=5)
@@ -0,0 +1,67 @@
+'''
+cross-process single-flight, based on lock files in the addon profile folder
+
+Kodi runs a separate plugin invocation for every widget and container, so several invocations may want to do the same network work at the same time.
+The invocation holding the lock of a piece of work does it, the other ones wait for the lock and then read its result from the caches.
+'''
+
+import os
+import time
+from contextlib import contextmanager
+
+from . import database
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+LOCKS_FOLDER = os.path.join(database.addonUserDataFolder, 'locks')
+
+# Delay between two attempts to acquire a lock held by another invocation
+POLL_INTERVAL = 0.05
+
+
+def _try_lock(lock_file):
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _unlock(lock_file):
+    if os.name == 'nt':
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock(name, timeout=None):
+    """
+    Context manager holding an exclusive lock shared by every invocation of the addon, waiting for it if another invocation holds it.
+    The lock is released when the holding invocation exits, even if it crashed.
+
+    :param name: name of the lock, identifying the work it protects
+    :param timeout: maximum number of seconds to wait for the lock. None to wait as long as needed
+    :return: a boolean, True if the lock was acquired, False if the timeout was reached first
+    """
+    os.makedirs(LOCKS_FOLDER, exist_ok=True)
+
+    deadline = None if timeout is None else time.time() + timeout
+    with open(os.path.join(LOCKS_FOLDER, name + '.lock'), 'a+') as lock_file:
+        acquired = _try_lock(lock_file)
+        while not acquired and (deadline is None or time.time() < deadline):
+            time.sleep(POLL_INTERVAL)
+            acquired = _try_lock(lock_file)
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _unlock(lock_file)
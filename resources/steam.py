@@ -1,4 +1,8 @@
+import codecs
+import hashlib
+import json
 import os
+import re
 import sys
 import shlex
 import subprocess
@@ -7,49 +11,199 @@ import xbmcaddon
 import xbmcplugin
 import xbmcvfs
 
-import requests
-import requests_cache
-
+from . import perf
+from . import transport
 from .util import log
 
 __addon__ = xbmcaddon.Addon()
-minutesBeforeGamesListsExpiration = int(__addon__.getSetting("games-expire-after-minutes"))  # Default is 3 days
 
 # define the cache file to reside in the ..\Kodi\userdata\addon_data\(your addon)
 addonUserDataFolder = xbmcvfs.translatePath(__addon__.getAddonInfo('profile'))
+# The requests-cache file which used to hold the Steam Web API responses, before the library snapshot replaced it.
 STEAM_GAMES_CACHE_FILE = xbmcvfs.translatePath(os.path.join(addonUserDataFolder, 'requests_cache_games'))
 
-# cache expires after: 86400=1 day   604800=7 days
-cached_requests = requests_cache.CachedSession(STEAM_GAMES_CACHE_FILE, backend='sqlite',
-                                                    expire_after=60 * minutesBeforeGamesListsExpiration,
-                                                    old_data_on_error=True)
+# Base url of the Steam Web API
+WEB_API_URL = 'https://api.steampowered.com'
+
+# Fields of the games used by the addon, the other fields of the Steam Web API responses are dropped while parsing
+GAME_FIELDS = ('appid', 'name', 'img_icon_url', 'playtime_forever', 'playtime_2weeks', 'rtime_last_played')
+
+# Start of the games array in the responses of the Steam Web API
+GAMES_ARRAY_START = re.compile(r'"games"\s*:\s*\[')
+# Characters between two games of the games array
+GAMES_SEPARATORS = ' \t\r\n,'
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+class Game(object):
+    """
+    Compact record of an owned game/app, holding only the fields used by the addon.
+    """
+    __slots__ = GAME_FIELDS
+
+    def __init__(self, appid, name='', img_icon_url='', playtime_forever=0, playtime_2weeks=0, rtime_last_played=0):
+        self.appid = appid
+        self.name = name
+        self.img_icon_url = img_icon_url
+        self.playtime_forever = playtime_forever
+        self.playtime_2weeks = playtime_2weeks
+        self.rtime_last_played = rtime_last_played
+
+    @classmethod
+    def from_entry(cls, entry):
+        """
+        :param entry: a game entry of a Steam Web API response, see :func:`get_user_games`
+        :return: the record of the game
+        """
+        return cls(int(entry['appid']), entry.get('name', ''), entry.get('img_icon_url', ''), entry.get('playtime_forever', 0),
+                   entry.get('playtime_2weeks', 0), entry.get('rtime_last_played', 0))
+
+    def to_row(self):
+        """
+        :return: the fields of the game as a tuple, in the order of :const:`GAME_FIELDS`
+        """
+        return self.appid, self.name, self.img_icon_url, self.playtime_forever, self.playtime_2weeks, self.rtime_last_played
+
+    def __eq__(self, other):
+        return isinstance(other, Game) and self.to_row() == other.to_row()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.to_row())
+
+    def __repr__(self):
+        return 'Game({0})'.format(', '.join(repr(value) for value in self.to_row()))
+
+
+def iter_games(chunks):
+    """
+    Parses the games array of a Steam Web API response incrementally, one game at a time, without building the whole JSON document.
+
+    :param chunks: iterable of the chunks of the response body, as bytes encoded in UTF-8
+    :return: generator of :class:`Game` records
+    :raises:
+        :class:IOError: when the response is not valid JSON
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    chunks = iter(chunks)
+    buffer = ''
+    position = None  # Position of the next game in the buffer, None until the start of the games array is found
+    exhausted = False
+    while True:
+        if position is None:
+            match = GAMES_ARRAY_START.search(buffer)
+            if match is not None:
+                position = match.end()
+        else:
+            while position < len(buffer) and buffer[position] in GAMES_SEPARATORS:
+                position += 1
+            if position < len(buffer):
+                if buffer[position] == ']':
+                    return
+                try:
+                    entry, position = decoder.raw_decode(buffer, position)
+                except ValueError as e:  # The game is incomplete, unless the whole response was read
+                    if exhausted:
+                        raise IOError('Malformed games list in the Steam Web API response: {0}'.format(e))
+                else:
+                    yield Game.from_entry(entry)
+                    continue
+
+        if exhausted:  # No games array, for example when the profile of the user is private
+            if position is not None:
+                raise IOError('Truncated games list in the Steam Web API response')
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            if position is not None:  # The games already parsed are dropped from the buffer
+                buffer = buffer[position:]
+                position = 0
+            buffer += text_decoder.decode(chunk)
+
+
+# The session of the Steam Web API, created on first use by :func:`get_session`
+_session = None
+
+
+def get_session():
+    """
+    Obtains the session of the Steam Web API, creating it on first use.
+    requests is only imported by the routes which query the API.
+
+    :return: a :class:`requests.Session`, see :func:`transport.create_session`
+    """
+    global _session
+    if _session is None:
+        _session = transport.create_session(pool_size=2)
+    return _session
+
+
+def get_install_command(steam_exe_path, appid):
+    """
+    :param steam_exe_path: path to the steam executable
+    :param appid: appid of the game/app to install
+    :return: the command calling Steam to install a game/app, as a list of arguments
+    """
+    # https://developer.valvesoftware.com/wiki/Steam_browser_protocol
+    return [steam_exe_path, 'steam://install/' + appid]
+
+
+def get_run_command(steam_exe_path, steam_launch_args, appid):
+    """
+    :param steam_exe_path: path to the steam executable
+    :param steam_launch_args: A string of Steam launch arguments (format "-arg1 -arg2 ...")
+    :param appid: appid of the game/app to run
+    :return: the command calling Steam to run a game/app, as a list of arguments
+    """
+    user_args = shlex.split(steam_launch_args)
+    # https://developer.valvesoftware.com/wiki/Steam_browser_protocol
+    return [steam_exe_path] + user_args + ['steam://rungameid/' + appid]  # Concatenate the arrays into one
+
+
+def start_detached(command):
+    """
+    Starts a command without waiting for it, detached from the current process so that it survives the plugin invocation.
+
+    :param command: list of arguments
+    :return: the :class:`subprocess.Popen` of the started process
+    """
+    if os.name == 'nt':
+        creation_flags = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, creationflags=creation_flags)
+    return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, start_new_session=True)
 
 
 def install(steam_exe_path, appid):
     """
     Calls Steam to install a game/app. This will display Steam's game install prompt, which displays install configurations and asks for confirmation.
+    Waits for the Steam command, see :mod:`launcher` for the launches which don't block the plugin invocation.
 
     :param steam_exe_path: path to the steam executable
     :param appid: appid of the game/app to install
     """
-    log('executing ' + steam_exe_path + ' steam://install/' + appid)
-    # https://developer.valvesoftware.com/wiki/Steam_browser_protocol
-    subprocess.call([steam_exe_path, 'steam://install/' + appid])
+    command = get_install_command(steam_exe_path, appid)
+    log('executing ' + ' '.join(command))
+    subprocess.call(command)
 
 
 def run(steam_exe_path, steam_launch_args, appid):
     """
     Calls Steam to run a game/app. This will run it, or in not installed display Steam install prompt
+    Waits for the Steam command, see :mod:`launcher` for the launches which don't block the plugin invocation.
 
     :param steam_exe_path: path to the steam executable
     :param steam_launch_args: A string of Steam launch arguments (format "-arg1 -arg2 ...")
     :param appid: appid of the game/app to run
     """
-    user_args = shlex.split(steam_launch_args)
-    log('executing ' + steam_exe_path + ' ' + steam_launch_args + ' steam://rungameid/' + appid)
-
-    # https://developer.valvesoftware.com/wiki/Steam_browser_protocol
-    subprocess.call([steam_exe_path] + user_args + ['steam://rungameid/' + appid])  # Concatenate the arrays into one
+    command = get_run_command(steam_exe_path, steam_launch_args, appid)
+    log('executing ' + ' '.join(command))
+    subprocess.call(command)
 
 
 def get_user_games(steam_api_key, steam_user_id, recent_only=False):
@@ -60,12 +214,13 @@ def get_user_games(steam_api_key, steam_user_id, recent_only=False):
     :param steam_user_id: steam id of the user we want to get the games list for.
         To access their informations, their steam profile must be public, or the Steam API Key provided must belong to that user.
     :param recent_only: A boolean indicating whether to obtain only the recently played games (true) or all owned games (false, default)
-    :returns: A dictionary containing a game_count value, along with a games array containing details for each individual game or app.
+    :returns: A list of :class:`Game` records, parsed incrementally from the games array of the response, see :func:`iter_games`
     :raises:
         :class:IOError: request.RequestException raised when there is an issue querying the web api for any reason.
 
     :example:
-    >>> get_user_games("myAPIKey","76561197960434622")#Random profile number
+    The games array of the response is formatted like so :
+    >>> get_session().get(...).json()['response']#Random profile number
         {
             "game_count": 1,
             "games": [
@@ -84,40 +239,86 @@ def get_user_games(steam_api_key, steam_user_id, recent_only=False):
             ]
         }
     """
+    games, validators = get_user_games_if_changed(steam_api_key, steam_user_id, recent_only=recent_only)
+    return games
+
 
+def get_user_games_if_changed(steam_api_key, steam_user_id, validators=None, recent_only=False):
+    """
+    Queries the Steam Web API for the games of a user, like :func:`get_user_games`, unless they did not change since a previous response.
+    The request is conditional when the previous response had an ETag or a Last-Modified header. Otherwise the body is parsed as it is received,
+    and its content hash compared to the one of the previous response at the end, so that an unchanged games list is not written again.
+
+    :param steam_api_key: A steam API key with access to the Steam Web API
+    :param steam_user_id: steam id of the user we want to get the games list for.
+    :param validators: dictionary returned along with a previous response of the same query, None if there is none
+    :param recent_only: A boolean indicating whether to obtain only the recently played games (true) or all owned games (false, default)
+    :return: tuple (games, validators). games is a list of :class:`Game` records, or None if the games did not change.
+        validators is a dictionary with keys etag, last_modified and content_hash, to pass along with the next query
+    :raises:
+        :class:IOError: request.RequestException raised when there is an issue querying the web api for any reason.
+    """
+    validators = validators or {}
     if recent_only:
         # https://developer.valvesoftware.com/wiki/Steam_Web_API#GetRecentlyPlayedGames_.28v0001.29
-        api_url = 'http://api.steampowered.com/IPlayerService/GetRecentlyPlayedGames/v0001/'
+        api_url = WEB_API_URL + '/IPlayerService/GetRecentlyPlayedGames/v0001/'
     else:
         # https://developer.valvesoftware.com/wiki/Steam_Web_API#GetOwnedGames_.28v0001.29
-        api_url = 'https://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/'
+        api_url = WEB_API_URL + '/IPlayerService/GetOwnedGames/v0001/'
+
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
 
     # We send a request to the API, including needed parameters and "include_appinfo" so that game details are returned with the response.
-    response = cached_requests.get(url=api_url,
-                                   params={'key': steam_api_key,
-                                           'steamid': steam_user_id,
-                                           'include_appinfo': 1,
-                                           'format': 'json'},
-                                   timeout=5)
+    # The body is streamed, so that it is parsed and hashed chunk by chunk without ever being held whole in memory
+    with perf.span('steam_api'):
+        response = get_session().get(url=transport.normalize_url(api_url),
+                                     params={'key': steam_api_key,
+                                             'steamid': steam_user_id,
+                                             'include_appinfo': 1,
+                                             'format': 'json'},
+                                     headers=headers,
+                                     timeout=5,
+                                     stream=True)
+
+    try:
+        if response.status_code == 304:
+            return None, validators
+        response.raise_for_status()  # If the status code indicates an error, raise a HTTPError, which is itself a RequestException, based on the builtin IOError
 
-    response.raise_for_status()  # If the status code indicates an error, raise a HTTPError, which is itself a RequestException, based on the builtin IOError
-    response_data = response.json().get('response', {})
-    return response_data.get('games', {})
+        content_hash = hashlib.sha1()
+
+        def hash_chunks():
+            for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+                content_hash.update(chunk)
+                perf.count('bytes_received', len(chunk))
+                yield chunk
+
+        chunks = hash_chunks()
+        with perf.span('steam_api_parse'):
+            games = list(iter_games(chunks))
+            for chunk in chunks:  # The rest of the body after the games array is only hashed
+                pass
+    finally:
+        response.close()
+
+    new_validators = {'etag': response.headers.get('ETag', ''),
+                      'last_modified': response.headers.get('Last-Modified', ''),
+                      'content_hash': content_hash.hexdigest()}
+    if new_validators['content_hash'] == validators.get('content_hash'):  # Without validators, the unchanged body is only known once it is read
+        return None, new_validators
+    return games, new_validators
 
 
 def delete_cache():
     """
-    Deletes the cache containing the data about which games are owned or not
+    Deletes the cache of the Steam Web API responses left over by the versions using requests-cache, the games are now kept by the library snapshot
     """
-    # If Kodi's request-cache module is updated to >0.7.3 , we will only need to issue cached_requests.cache.clear() which will handle all scenarios. Until then, we must recreate the backend ourselves
-    try:
-        cached_requests.cache.clear()
-    except Exception:
-        log('Failed to clear cache. Attempting manual deletion')
+    if os.path.isfile(STEAM_GAMES_CACHE_FILE + ".sqlite"):
         try:
             os.remove(STEAM_GAMES_CACHE_FILE + ".sqlite")
-        except:
-            log('Failed to delete & recreate cache')
-        cached_requests.cache.responses = requests_cache.backends.storage.dbdict.DbPickleDict(STEAM_GAMES_CACHE_FILE + ".sqlite", 'responses', fast_save=True)
-        cached_requests.cache.keys_map = requests_cache.backends.storage.dbdict.DbDict(STEAM_GAMES_CACHE_FILE + ".sqlite", 'urls')
-        
+        except OSError:
+            log('Failed to delete cache file')
@@ -0,0 +1,109 @@
+'''
+HTTP transport shared by the Steam Web API client and the art checks : pooled keep-alive connections, retries with backoff, and HTTPS everywhere
+
+Every session is mounted with an adapter keeping a connection pool per host, sized to the number of threads using the session, so that connections are reused across requests.
+requests and urllib3 are only imported when a session is created, the routes which don't use the network skip their import cost.
+'''
+
+from urllib.parse import urlsplit, urlunsplit
+
+import xbmcaddon
+
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+httpRetries = max(0, int(__addon__.getSetting("http-retries") or 1))  # Default is 1 retry
+httpRetryBackoff = max(0.0, float(__addon__.getSetting("http-retry-backoff") or 0.3))  # Default is 0.3 seconds, doubled on every retry
+
+# Status codes which mean that the same request may succeed later
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_METHODS = frozenset(['HEAD', 'GET'])
+
+# Hosts whose urls are always requested over HTTPS, so that a single TLS session is kept per host whatever the scheme of the url
+HTTPS_DOMAINS = ('steamstatic.com', 'steampowered.com', 'steamcommunity.com', 'akamaihd.net')
+
+# Adapters mounted by :func:`mount`, whose connection pools are reported by :func:`get_pool_stats`
+_adapters = []
+
+
+def create_retry(retries=httpRetries, backoff=httpRetryBackoff):
+    """
+    :return: a :class:`Retry` retrying failed connections and temporary server errors, with an exponential backoff
+    """
+    from urllib3.util.retry import Retry
+    retry_parameters = {'total': retries, 'connect': retries, 'read': 0, 'status': retries, 'backoff_factor': backoff,
+                        'status_forcelist': RETRY_STATUSES, 'raise_on_status': False}
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **retry_parameters)
+    except TypeError:  # urllib3 older than 1.26
+        return Retry(method_whitelist=RETRY_METHODS, **retry_parameters)
+
+
+def mount(session, pool_size, retries=httpRetries, backoff=httpRetryBackoff):
+    """
+    Mounts a pooled adapter on a session, for both http and https urls.
+
+    :param session: a :class:`requests.Session`
+    :param pool_size: maximum number of connections kept open per host, usually the number of threads sharing the session
+    :param retries: number of retries of failed connections and temporary server errors. Defaults to the user addon settings
+    :param backoff: backoff factor of the retries in seconds. Defaults to the user addon settings
+    :return: the session
+    """
+    from requests.adapters import HTTPAdapter
+    adapter = HTTPAdapter(pool_connections=len(HTTPS_DOMAINS), pool_maxsize=pool_size, max_retries=create_retry(retries, backoff))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    _adapters.append(adapter)
+    return session
+
+
+def create_session(pool_size, retries=httpRetries, backoff=httpRetryBackoff):
+    """
+    :return: a new :class:`requests.Session` with a pooled adapter, see :func:`mount`
+    """
+    import requests
+    return mount(requests.Session(), pool_size, retries, backoff)
+
+
+def is_https_host(hostname):
+    """
+    :return: True if the host is one of :const:`HTTPS_DOMAINS` or one of their subdomains
+    """
+    hostname = hostname.lower().rstrip('.')
+    return any(hostname == domain or hostname.endswith('.' + domain) for domain in HTTPS_DOMAINS)
+
+
+def normalize_url(url):
+    """
+    :param url: an absolute url
+    :return: the url, using HTTPS if it belongs to a Steam host. An explicit port is kept, unless it is the default HTTP port
+    """
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    hostname, separator, port = netloc.partition(':')
+    if scheme == 'http' and is_https_host(hostname):
+        return urlunsplit(('https', hostname if port == '80' else netloc, path, query, fragment))
+    return url
+
+
+def get_pool_stats():
+    """
+    Reports the utilisation of the connection pools of every mounted adapter, to confirm that connections are reused.
+
+    :return: dictionary mapping each scheme://host:port to a dictionary with the number of requests sent and connections opened
+    """
+    stats = {}
+    for adapter in _adapters:
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault('{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port), {'requests': 0, 'connections': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+    return stats
+
+
+def log_pool_stats():
+    for host, host_stats in get_pool_stats().items():
+        log('{0} : {1} requests over {2} connections'.format(host, host_stats['requests'], host_stats['connections']))
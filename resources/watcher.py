@@ -0,0 +1,186 @@
+'''
+inotify based watcher of the installed Steam library, run by the service on Linux
+
+The watcher keeps the installed apps indexes of :mod:`registry` up to date as Steam writes its files, so that the /installed list only reads the indexes.
+'''
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+
+from . import registry
+from .util import log
+
+__addon__ = xbmcaddon.Addon()
+
+# Home window property holding the Steam folder watched by the service, empty when nothing is watched
+WATCHER_PROPERTY = __addon__.getAddonInfo('id') + '.watcher'
+
+# https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# Steam rewrites the manifests of the apps it downloads every few seconds, events are gathered for this long before being processed
+DEBOUNCE_SECONDS = 1.0
+
+
+def is_supported():
+    """
+    :return: True if inotify is available on this system
+    """
+    return sys.platform.startswith('linux') and ctypes.util.find_library('c') is not None
+
+
+class Inotify(object):
+    """
+    Minimal inotify binding, based on ctypes so that it needs no dependency.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watched_folders = {}  # watch descriptor -> folder
+
+    def add_watch(self, folder, mask=WATCH_MASK):
+        watch_descriptor = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+        if watch_descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + folder)
+        self.watched_folders[watch_descriptor] = folder
+
+    def remove_watches(self):
+        for watch_descriptor in list(self.watched_folders):
+            self._libc.inotify_rm_watch(self.fd, watch_descriptor)
+        self.watched_folders.clear()
+
+    def read_events(self, timeout):
+        """
+        Waits for events until the timeout at most.
+
+        :param timeout: maximum number of seconds to wait
+        :return: a list of (path, mask) tuples, path being the path of the file or folder the event is about. The path is None for an IN_Q_OVERFLOW event,
+            meaning that the kernel dropped events
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            watch_descriptor, mask, cookie, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+            folder = self.watched_folders.get(watch_descriptor)
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif folder is not None:
+                events.append((os.path.join(folder, name) if name else folder, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _watch_folders(inotify, steam_path):
+    """
+    (Re)creates the watches on the Steam folder, holding registry.vdf, and on the steamapps folder of every library, holding the manifests and libraryfolders.vdf.
+
+    :return: the list of watched steamapps folders
+    """
+    inotify.remove_watches()
+    inotify.add_watch(steam_path)
+    steamapps_folders = registry.get_library_folders(steam_path)
+    for steamapps_folder in steamapps_folders:
+        try:
+            inotify.add_watch(steamapps_folder)
+        except OSError as e:
+            log('Unable to watch {0}: {1}'.format(steamapps_folder, e), xbmc.LOGWARNING)
+    return steamapps_folders
+
+
+def _refresh_installed_list():
+    """
+    Refreshes the container if the user is looking at the list of installed games
+    """
+    if xbmc.getInfoLabel('Container.FolderPath').startswith('plugin://{0}/installed'.format(__addon__.getAddonInfo('id'))):
+        log('Installed games changed, refreshing the installed games list')
+        xbmc.executebuiltin('Container.Refresh')
+
+
+def run(monitor, steam_path):
+    """
+    Watches the installed Steam library until Kodi requests an abort, updating the installed apps indexes incrementally on each change.
+
+    :param monitor: a :class:`xbmc.Monitor`
+    :param steam_path: Path to the Steam folder, holding registry.vdf
+    """
+    registry_path = os.path.join(steam_path, 'registry.vdf')
+    inotify = Inotify()
+    home_window = xbmcgui.Window(10000)
+    try:
+        steamapps_folders = _watch_folders(inotify, steam_path)
+        # Full scan, the watches only report the changes made from now on
+        installed_apps = set(registry.get_installed_steam_apps(registry_path))
+        home_window.setProperty(WATCHER_PROPERTY, steam_path)
+        log('Watching the installed games of {0} libraries'.format(len(steamapps_folders)))
+
+        while not monitor.abortRequested():
+            events = inotify.read_events(timeout=1)
+            if not events:
+                continue
+            if monitor.waitForAbort(DEBOUNCE_SECONDS):
+                break
+            events.extend(inotify.read_events(timeout=0))
+
+            changed_paths = set(path for path, mask in events if not mask & (IN_IGNORED | IN_Q_OVERFLOW))
+            overflowed = any(mask & IN_Q_OVERFLOW for path, mask in events)
+            if overflowed:
+                # The kernel dropped events, any manifest may have changed unnoticed : watch the libraries again and scan them all
+                log('Too many changes in the Steam library, scanning it again', xbmc.LOGWARNING)
+                steamapps_folders = _watch_folders(inotify, steam_path)
+                registry.get_app_manifests(steam_path)
+            elif any(os.path.basename(path) == 'libraryfolders.vdf' or path in steamapps_folders for path in changed_paths):
+                # A library was added or removed, watch the new set of libraries and scan them
+                steamapps_folders = _watch_folders(inotify, steam_path)
+                registry.get_app_manifests(steam_path)
+            else:
+                for path in changed_paths:
+                    name = os.path.basename(path)
+                    if name.startswith('appmanifest_') and name.endswith('.acf'):
+                        registry.update_app_manifest(path)
+
+            if overflowed or registry_path in changed_paths or not steamapps_folders:
+                registry.get_installed_steam_apps(registry_path)
+
+            new_installed_apps = set(registry.get_indexed_installed_steam_apps(registry_path) or [])
+            if new_installed_apps != installed_apps:
+                installed_apps = new_installed_apps
+                _refresh_installed_list()
+    finally:
+        home_window.clearProperty(WATCHER_PROPERTY)
+        inotify.close()
@@ -0,0 +1,5 @@
+from resources import service
+
+if __name__ == '__main__':
+
+    service.main()
@@ -0,0 +1,149 @@
+'''
+tests of the binary appinfo.vdf reader of resources/appinfo.py, on synthetic files of every supported version
+'''
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks', 'kodi_stubs'), os.path.dirname(TESTS_FOLDER)]
+
+from resources import appinfo  # noqa: E402
+from resources import database  # noqa: E402
+
+APPS = {
+    570: {'appinfo': {'appid': 570, 'common': {'name': 'Dota 2', 'type': 'Game', 'library_assets': {'library_capsule': 'en', 'library_hero': 'en'}}}},
+    440: {'appinfo': {'appid': 440, 'common': {'name': 'Team Fortress 2', 'type': 'Game', 'library_assets': {'library_logo': 'en'}}}},
+    10: {'appinfo': {'appid': 10, 'common': {'name': 'Counter-Strike', 'size': 2 ** 40, 'review_percentage': -1}}},
+}
+
+
+def encode_key_values(key_values, key_encoder):
+    """
+    :return: the binary key values of a dict, ended by TYPE_END
+    """
+    data = b''
+    for key, value in key_values.items():
+        if isinstance(value, dict):
+            data += bytes([appinfo.TYPE_MAP]) + key_encoder(key) + encode_key_values(value, key_encoder)
+        elif isinstance(value, str):
+            data += bytes([appinfo.TYPE_STRING]) + key_encoder(key) + value.encode('utf-8') + b'\0'
+        elif -2 ** 31 <= value < 2 ** 31:
+            data += bytes([appinfo.TYPE_INT32]) + key_encoder(key) + struct.pack('<i', value)
+        else:
+            data += bytes([appinfo.TYPE_UINT64]) + key_encoder(key) + struct.pack('<Q', value)
+    return data + bytes([appinfo.TYPE_END])
+
+
+def encode_appinfo(magic, apps):
+    """
+    :return: the content of an appinfo.vdf file of the given version holding the apps
+    """
+    strings = []
+
+    def key_encoder(key):
+        if magic < appinfo.MAGIC_V29:
+            return key.encode('utf-8') + b'\0'
+        if key not in strings:
+            strings.append(key)
+        return appinfo.KEY_INDEX.pack(strings.index(key))
+
+    header_size = appinfo.HEADER.size + (appinfo.STRING_TABLE_OFFSET.size if magic >= appinfo.MAGIC_V29 else 0)
+    entries = b''
+    for appid, key_values in apps.items():
+        entry = b'\0' * appinfo.ENTRY_METADATA_SIZE[magic] + encode_key_values(key_values, key_encoder)
+        entries += appinfo.ENTRY_HEADER.pack(appid, len(entry)) + entry
+    entries += struct.pack('<I', 0)
+
+    data = appinfo.HEADER.pack(magic, 1)
+    if magic >= appinfo.MAGIC_V29:
+        data += appinfo.STRING_TABLE_OFFSET.pack(header_size + len(entries))
+        entries += appinfo.KEY_INDEX.pack(len(strings)) + b''.join(string.encode('utf-8') + b'\0' for string in strings)
+    return data + entries
+
+
+class AppInfoReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index_path = os.path.join(database.addonUserDataFolder, appinfo.INDEX_FILE)
+        self.delete_index()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def delete_index(self):
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def write_appinfo(self, magic, apps=APPS):
+        path = os.path.join(self.folder, 'appinfo_{0:x}.vdf'.format(magic))
+        with open(path, 'wb') as appinfo_file:
+            appinfo_file.write(encode_appinfo(magic, apps))
+        return path
+
+    def test_reads_every_version(self):
+        for magic in (appinfo.MAGIC_V27, appinfo.MAGIC_V28, appinfo.MAGIC_V29):
+            with self.subTest(version='{0:x}'.format(magic)):
+                self.delete_index()
+                reader = appinfo.AppInfoReader(self.write_appinfo(magic))
+                try:
+                    for appid, key_values in APPS.items():
+                        self.assertEqual(reader.get_app_info(appid), key_values)
+                finally:
+                    reader.close()
+
+    def test_keys_are_lowercase(self):
+        reader = appinfo.AppInfoReader(self.write_appinfo(appinfo.MAGIC_V29, {730: {'AppInfo': {'Common': {'Name': 'CS2'}}}}))
+        try:
+            self.assertEqual(reader.get_app_info('730'), {'appinfo': {'common': {'name': 'CS2'}}})
+        finally:
+            reader.close()
+
+    def test_returns_none_for_a_missing_app(self):
+        reader = appinfo.AppInfoReader(self.write_appinfo(appinfo.MAGIC_V28))
+        try:
+            self.assertIsNone(reader.get_app_info(1))
+            self.assertIsNone(reader.get_app_info(9999999))
+        finally:
+            reader.close()
+
+    def test_rejects_an_unsupported_version(self):
+        path = os.path.join(self.folder, 'appinfo.vdf')
+        with open(path, 'wb') as appinfo_file:
+            appinfo_file.write(appinfo.HEADER.pack(0x07564426, 1) + struct.pack('<I', 0))
+        with self.assertRaises(ValueError):
+            appinfo.AppInfoReader(path)
+
+    def test_persists_the_index(self):
+        path = self.write_appinfo(appinfo.MAGIC_V29)
+        appinfo.AppInfoReader(path).close()
+        self.assertTrue(os.path.isfile(self.index_path))
+
+        reader = appinfo.AppInfoReader(path)
+        try:
+            self.assertEqual(list(reader._appids), sorted(APPS))
+            self.assertEqual(reader.get_app_info(440), APPS[440])
+        finally:
+            reader.close()
+
+    def test_rebuilds_an_outdated_index(self):
+        path = self.write_appinfo(appinfo.MAGIC_V29)
+        appinfo.AppInfoReader(path).close()
+        with open(path, 'wb') as appinfo_file:
+            appinfo_file.write(encode_appinfo(appinfo.MAGIC_V29, {400: {'appinfo': {'common': {'name': 'Portal'}}}}))
+
+        reader = appinfo.AppInfoReader(path)
+        try:
+            self.assertIsNone(reader.get_app_info(440))
+            self.assertEqual(reader.get_app_info(400), {'appinfo': {'common': {'name': 'Portal'}}})
+        finally:
+            reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
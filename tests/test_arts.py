@@ -0,0 +1,202 @@
+'''
+tests of the art resolution of resources/arts.py : deadline and late resolution, times to live of the availability checks and re-probe budget.
+The CDN is a stand-in host of benchmarks/listings.py with injected latency.
+'''
+
+import os
+import sys
+import time
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks')
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(TESTS_FOLDER), BENCHMARKS_FOLDER]
+
+import xbmcaddon  # noqa: E402
+from listings import start_server  # noqa: E402
+from resources import artindex  # noqa: E402
+from resources import arts  # noqa: E402
+from resources import cdn  # noqa: E402
+from resources import singleflight  # noqa: E402
+
+POSTER = '/steam/apps/{0}/library_600x900.jpg'
+HEADER = '/steam/apps/{0}/header.jpg'
+
+
+class MiddleRandom(object):
+    """
+    Stands in for the random module, without any jitter
+    """
+
+    def uniform(self, low, high):
+        return (low + high) / 2.0
+
+
+class ArtsTestCase(unittest.TestCase):
+    """
+    Resolves the arts on a stand-in CDN host, answering every request after `latency` seconds, with 404 for the given share of the arts
+    """
+    latency = 0
+    not_found_ratio = 0
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(latency=cls.latency, not_found_ratio=cls.not_found_ratio)
+        cls.host = 'http://127.0.0.1:{0}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        xbmcaddon.settings['cdn-hosts'] = self.host
+        cdn._configured_hosts = None
+        cdn._hosts_state = None
+        arts.localAppInfoEnabled = False
+        arts.set_reprobe_budget(None)
+        arts._late_apps.clear()
+        arts._checks_in_progress.clear()
+        artindex.clear()
+
+    def tearDown(self):
+        xbmcaddon.settings['cdn-hosts'] = cdn.DEFAULT_HOSTS
+        cdn._configured_hosts = None
+        cdn._hosts_state = None
+
+
+class FallbackTest(ArtsTestCase):
+    not_found_ratio = 1.0
+
+    def test_falls_back_when_the_arts_are_missing(self):
+        apps_arts = arts.resolve_apps_arts([('10', 'icon')], art_types=['poster', 'thumb'])
+        self.assertEqual(apps_arts, {'10': {'poster': self.host + HEADER.format(10), 'thumb': self.host + HEADER.format(10)}})
+        self.assertEqual(artindex.get_availabilities([POSTER.format(10)]), {POSTER.format(10): False})
+
+    def test_serves_the_index_without_any_request(self):
+        arts.resolve_apps_arts([('20', 'icon')])
+        self.server.counters.clear()
+        apps_arts = arts.resolve_apps_arts([('20', 'icon')])
+        self.assertEqual(self.server.counters, {})
+        self.assertEqual(apps_arts['20']['poster'], self.host + HEADER.format(20))
+
+
+class DeadlineTest(ArtsTestCase):
+    latency = 0.5
+
+    def test_serves_the_late_arts_unchecked_then_completes_them(self):
+        start = time.time()
+        apps_arts = arts.resolve_apps_arts([('30', 'icon')], deadline=time.time() + 0.05)
+        self.assertLess(time.time() - start, self.latency)
+        # The url being checked is served without fallback, and the app is only indexed once its checks complete
+        self.assertEqual(apps_arts['30']['poster'], self.host + POSTER.format(30))
+        self.assertIn('30', arts._late_apps)
+        self.assertEqual(artindex.get_resolved_arts(['30']), {})
+
+        self.assertTrue(arts.complete_late_arts(timeout=5))
+        self.assertEqual(arts._late_apps, {})
+        img_icon_path, indexed_arts = artindex.get_resolved_arts(['30'])['30']
+        self.assertEqual(indexed_arts['poster'][0], POSTER.format(30))
+        self.assertTrue(artindex.get_availabilities([POSTER.format(30)])[POSTER.format(30)])
+
+    def test_bounds_the_late_completion(self):
+        arts.resolve_apps_arts([('40', 'icon')], deadline=time.time())
+        start = time.time()
+        self.assertFalse(arts.complete_late_arts(timeout=0.1))
+        self.assertLess(time.time() - start, self.latency)
+
+    def test_nothing_late(self):
+        self.assertFalse(arts.complete_late_arts())
+
+    def test_waits_for_every_check_without_deadline(self):
+        apps_arts = arts.resolve_apps_arts([('50', 'icon')])
+        self.assertEqual(apps_arts['50']['poster'], self.host + POSTER.format(50))
+        self.assertEqual(arts._late_apps, {})
+        self.assertIn('50', artindex.get_resolved_arts(['50']))
+
+
+class CheckLocksTest(ArtsTestCase):
+    latency = 0.05
+
+    def test_only_the_checks_of_the_same_lock_wait(self):
+        url = POSTER.format(70)
+        other_url = next(POSTER.format(appid) for appid in range(71, 1000)
+                         if arts._get_check_lock_bucket(POSTER.format(appid)) != arts._get_check_lock_bucket(url))
+        # Another invocation checks the url
+        with singleflight.lock(arts.ART_CHECK_LOCK_PREFIX + str(arts._get_check_lock_bucket(url))):
+            start = time.time()
+            self.assertTrue(arts.check_and_index_art_url(other_url))
+            self.assertLess(time.time() - start, 1)
+            arts._index_availabilities({url: False})
+        # The url indexed by the other invocation is not checked again
+        self.server.counters.clear()
+        self.assertFalse(arts.check_and_index_art_url(url))
+        self.assertEqual(self.server.counters, {})
+
+
+class AvailabilityTtlTest(unittest.TestCase):
+
+    def test_confirmed_results_back_off(self):
+        ttl = lambda available, streak: arts.get_availability_ttl(available, streak, MiddleRandom())  # noqa: E731
+        self.assertEqual(ttl(True, 0), arts.ART_AVAILABILITY_EXPIRATION)
+        self.assertEqual(ttl(True, 1), 2 * arts.ART_AVAILABILITY_EXPIRATION)
+        self.assertEqual(ttl(True, 10), arts.AVAILABLE_ART_MAX_BACKOFF * arts.ART_AVAILABILITY_EXPIRATION)
+        self.assertEqual(ttl(False, 0), arts.MISSING_ART_EXPIRATION)
+        self.assertEqual(ttl(False, 1), min(2 * arts.MISSING_ART_EXPIRATION, arts.ART_AVAILABILITY_EXPIRATION))
+        self.assertEqual(ttl(False, 100), arts.ART_AVAILABILITY_EXPIRATION)
+
+    def test_jitter_spreads_the_expirations(self):
+        ttls = [arts.get_availability_ttl(True) for index in range(100)]
+        self.assertGreater(len(set(ttls)), 1)
+        for ttl in ttls:
+            self.assertLessEqual(abs(ttl / arts.ART_AVAILABILITY_EXPIRATION - 1), arts.EXPIRATION_JITTER)
+
+    def test_streak_counts_the_confirmations(self):
+        artindex.clear()
+        url = POSTER.format(60)
+        arts._index_availabilities({url: False})
+        arts._index_availabilities({url: False})
+        self.assertEqual(artindex.get_availability_entries([url])[url][2], 1)
+        arts._index_availabilities({url: True})
+        self.assertEqual(artindex.get_availability_entries([url])[url][2], 0)
+        arts._index_availabilities({url: None})  # Failed checks are not written
+        self.assertEqual(artindex.get_availability_entries([url])[url][2], 0)
+
+
+class ReprobeBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        artindex.clear()
+        now = time.time()
+        # Expired 1 to 5 hours ago, and a fresh one
+        self.expired_urls = [POSTER.format(appid) for appid in range(1, 6)]
+        entries = dict((url, (True, now - 3600 * index, 0)) for index, url in enumerate(self.expired_urls, 1))
+        entries[HEADER.format(1)] = (False, now + 3600, 0)
+        artindex.set_availabilities(entries)
+
+    def tearDown(self):
+        arts.set_reprobe_budget(None)
+
+    def test_the_longest_expired_are_checked_first(self):
+        arts.set_reprobe_budget(2)
+        availabilities = arts._get_known_availabilities(self.expired_urls + [HEADER.format(1)])
+        # The 2 longest expired need a check, the other expired ones are served as they are
+        self.assertEqual(set(self.expired_urls) - set(availabilities), set(self.expired_urls[-2:]))
+        self.assertFalse(availabilities[HEADER.format(1)])
+
+        # The budget is spent for the rest of the invocation
+        availabilities = arts._get_known_availabilities(self.expired_urls)
+        self.assertEqual(len(availabilities), len(self.expired_urls))
+
+    def test_no_budget_limit(self):
+        arts.set_reprobe_budget(None)
+        self.assertEqual(arts._get_known_availabilities(self.expired_urls), {})
+
+    def test_deferred_reprobes_are_resolved_again_later(self):
+        now = time.time()
+        entries = artindex.get_availability_entries(self.expired_urls[:1])
+        self.assertEqual(arts._get_resolution_expiration(self.expired_urls[:1], entries, now), now + arts.DEFERRED_REPROBE_DELAY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+'''
+tests of the CDN hosts pool of resources/cdn.py and of the failover of the art checks, against stand-in CDN hosts of benchmarks/listings.py with injected latency
+'''
+
+import os
+import socket
+import sys
+import time
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks')
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(TESTS_FOLDER), BENCHMARKS_FOLDER]
+
+import xbmcaddon  # noqa: E402
+from listings import start_server  # noqa: E402
+from resources import arts  # noqa: E402
+from resources import cdn  # noqa: E402
+
+
+def get_closed_port():
+    """
+    :return: a local port on which nothing listens, so that the connections are refused
+    """
+    closed_socket = socket.socket()
+    closed_socket.bind(('127.0.0.1', 0))
+    port = closed_socket.getsockname()[1]
+    closed_socket.close()
+    return port
+
+
+class CdnTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fast_server = start_server(latency=0, not_found_ratio=0)
+        cls.slow_server = start_server(latency=0.2, not_found_ratio=0)
+        cls.fast_host = 'http://127.0.0.1:{0}'.format(cls.fast_server.server_port)
+        cls.slow_host = 'http://127.0.0.1:{0}'.format(cls.slow_server.server_port)
+        cls.dead_host = 'http://127.0.0.1:{0}'.format(get_closed_port())
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.fast_server, cls.slow_server):
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        self.configure_hosts(','.join([self.dead_host, self.slow_host, self.fast_host]))
+
+    def tearDown(self):
+        self.configure_hosts(cdn.DEFAULT_HOSTS)
+
+    def configure_hosts(self, setting):
+        xbmcaddon.settings['cdn-hosts'] = setting
+        cdn._configured_hosts = None
+        cdn._hosts_state = None
+        with cdn._get_connection() as connection:
+            connection.execute('DELETE FROM hosts')
+
+    def test_parses_the_configured_hosts(self):
+        self.configure_hosts(' cdn.example.com/ , http://127.0.0.1:8080,, https://cdn.akamai.steamstatic.com:443 ')
+        self.assertEqual(cdn.get_configured_hosts(), ('https://cdn.example.com', 'http://127.0.0.1:8080', 'https://cdn.akamai.steamstatic.com:443'))
+
+    def test_falls_back_to_the_default_hosts(self):
+        for setting in ('', ',', ' , ,'):
+            with self.subTest(setting=setting):
+                self.configure_hosts(setting)
+                self.assertEqual(cdn.get_configured_hosts(), cdn._parse_hosts(cdn.DEFAULT_HOSTS))
+                self.assertEqual(cdn.get_hosts()[0], 'https://cdn.akamai.steamstatic.com')
+
+    def test_unsampled_hosts_keep_the_configured_order(self):
+        self.assertEqual(cdn.get_hosts(), [self.dead_host, self.slow_host, self.fast_host])
+        self.assertEqual(cdn.get_url('/steam/apps/440/header.jpg'), self.dead_host + '/steam/apps/440/header.jpg')
+        self.assertEqual(cdn.get_url('/steam/apps/440/header.jpg', self.fast_host), self.fast_host + '/steam/apps/440/header.jpg')
+        self.assertEqual(cdn.get_path(self.slow_host + '/steam/apps/440/header.jpg'), '/steam/apps/440/header.jpg')
+
+    def test_sampling_orders_the_hosts_by_latency(self):
+        self.assertTrue(cdn.needs_sampling())
+        latencies = cdn.sample_hosts(arts.get_session(), timeout=1)
+        self.assertIsNone(latencies[self.dead_host])
+        self.assertGreater(latencies[self.slow_host], latencies[self.fast_host])
+        self.assertEqual(cdn.get_hosts(), [self.fast_host, self.slow_host, self.dead_host])
+        self.assertFalse(cdn.needs_sampling())
+
+        # The samples are persisted for the next invocations
+        cdn._hosts_state = None
+        self.assertEqual(cdn.get_hosts(), [self.fast_host, self.slow_host, self.dead_host])
+
+    def test_failed_hosts_are_avoided_until_the_failover_expires(self):
+        cdn.report_failure(self.dead_host)
+        now = time.time()
+        self.assertEqual(cdn.get_hosts(now), [self.slow_host, self.fast_host, self.dead_host])
+        self.assertEqual(cdn.get_hosts(now + cdn.FAILOVER_SECONDS + 1), [self.dead_host, self.slow_host, self.fast_host])
+
+    def test_every_host_failed(self):
+        for host in (self.fast_host, self.slow_host, self.dead_host):
+            cdn.report_failure(host)
+        self.assertEqual(len(cdn.get_hosts()), 3)
+
+    def test_art_checks_fail_over_to_the_next_host(self):
+        self.assertTrue(arts.check_art_url('/steam/apps/440/header.jpg', timeout=1))
+        self.assertEqual(cdn.get_hosts()[0], self.slow_host)
+        self.assertEqual(cdn._get_hosts_state()[self.dead_host][0], None)
+        self.assertGreater(cdn._get_hosts_state()[self.dead_host][1], time.time())
+
+    def test_art_checks_give_up_after_the_attempts(self):
+        self.configure_hosts(','.join([self.dead_host, 'http://127.0.0.1:{0}'.format(get_closed_port()), self.fast_host]))
+        self.assertIsNone(arts.check_art_url('/steam/apps/440/header.jpg', timeout=1))
+        self.assertEqual(cdn.get_hosts()[0], self.fast_host)
+        self.assertTrue(arts.check_art_url('/steam/apps/440/header.jpg', timeout=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+'''
+tests of the launches handed over to the service, resources/launcher.py : validation of the notifications and supervision of the Steam commands
+'''
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks', 'kodi_stubs'), os.path.dirname(TESTS_FOLDER)]
+
+import xbmc  # noqa: E402
+import xbmcaddon  # noqa: E402
+import xbmcgui  # noqa: E402
+from resources import launcher  # noqa: E402
+from resources import steam  # noqa: E402
+
+REGISTRY_VDF = '"Registry"\n{{\n\t"HKCU"\n\t{{\n\t\t"Software"\n\t\t{{\n\t\t\t"Valve"\n\t\t\t{{\n\t\t\t\t"Steam"\n\t\t\t\t{{\n\t\t\t\t\t"RunningAppID"\t\t"{0}"\n\t\t\t\t}}\n\t\t\t}}\n\t\t}}\n\t}}\n}}\n'
+
+
+class Process(object):
+    """
+    Stands in for the :class:`subprocess.Popen` of the Steam command, exiting with the scripted exit codes
+    """
+
+    def __init__(self, exit_codes):
+        self.exit_codes = list(exit_codes)
+
+    def poll(self):
+        return self.exit_codes.pop(0) if len(self.exit_codes) > 1 else self.exit_codes[0]
+
+
+class Monitor(object):
+    """
+    Stands in for :class:`xbmc.Monitor`. Every wait writes the next running appid of the script to registry.vdf instead of sleeping
+    """
+
+    def __init__(self, registry_path, running_appids):
+        self.registry_path = registry_path
+        self.running_appids = list(running_appids)
+        self.wait_count = 0
+
+    def abortRequested(self):
+        return self.wait_count > 100
+
+    def waitForAbort(self, timeout=None):
+        self.wait_count += 1
+        if self.running_appids:
+            write_registry(self.registry_path, self.running_appids.pop(0))
+        return self.abortRequested()
+
+
+def write_registry(registry_path, running_appid):
+    with open(registry_path, 'w') as registry_file:
+        registry_file.write(REGISTRY_VDF.format(running_appid))
+
+
+def get_launch(launch_id):
+    return launcher._get_connection().execute('SELECT appid, action, requested_at, exit_code, exited_at, started_at, ended_at FROM launches WHERE id = ?',
+                                              (launch_id,)).fetchone()
+
+
+class LaunchNotificationTest(unittest.TestCase):
+
+    def setUp(self):
+        xbmcaddon.settings.update({'steam-exe': '/usr/bin/steam', 'steam-args': '-silent'})
+
+    def test_notification_only_carries_the_action_and_appid(self):
+        with mock.patch.object(xbmc, 'executeJSONRPC') as execute_json_rpc:
+            launcher.request_launch('run', '440')
+        request = json.loads(execute_json_rpc.call_args[0][0])
+        self.assertEqual(request['method'], 'JSONRPC.NotifyAll')
+        self.assertEqual(request['params']['message'], launcher.LAUNCH_MESSAGE)
+        self.assertEqual(sorted(request['params']['data']), ['action', 'appid', 'requested_at'])
+
+    def test_builds_the_command_from_the_settings(self):
+        self.assertEqual(launcher.get_launch_command('run', '440'), ['/usr/bin/steam', '-silent', 'steam://rungameid/440'])
+        self.assertEqual(launcher.get_launch_command('install', '440'), ['/usr/bin/steam', 'steam://install/440'])
+
+    def test_ignores_the_invalid_notifications(self):
+        monitor = object()
+        for data in ('not json', '[]', '"run"', json.dumps({'action': 'uninstall', 'appid': '440'}), json.dumps({'action': 'run', 'appid': 440}),
+                     json.dumps({'action': 'run', 'appid': '440; rm -rf ~'}), json.dumps({'action': 'run', 'appid': '', 'requested_at': 1}),
+                     json.dumps({'action': 'run', 'appid': '440', 'requested_at': 'now'})):
+            with self.subTest(data=data), mock.patch.object(launcher, 'supervise') as supervise:
+                self.assertIsNone(launcher.start_supervision(monitor, data))
+                supervise.assert_not_called()
+
+    def test_ignores_the_command_of_the_notification(self):
+        monitor = object()
+        data = json.dumps({'action': 'run', 'appid': '440', 'requested_at': 12.5, 'command': ['/bin/sh', '-c', 'reboot']})
+        with mock.patch.object(launcher, 'supervise') as supervise:
+            launcher.start_supervision(monitor, data).join(5)
+        supervise.assert_called_once_with(monitor, 'run', '440', ['/usr/bin/steam', '-silent', 'steam://rungameid/440'], 12.5)
+
+    def test_starts_detached_without_the_service(self):
+        xbmcgui.Window(10000).clearProperty(launcher.SERVICE_PROPERTY)
+        with mock.patch.object(steam, 'start_detached') as start_detached, mock.patch.object(launcher, 'request_launch') as request_launch:
+            launcher.launch('install', '440')
+        start_detached.assert_called_once_with(['/usr/bin/steam', 'steam://install/440'])
+        request_launch.assert_not_called()
+
+    def test_hands_over_to_the_service(self):
+        xbmcgui.Window(10000).setProperty(launcher.SERVICE_PROPERTY, 'true')
+        try:
+            with mock.patch.object(steam, 'start_detached') as start_detached, mock.patch.object(launcher, 'request_launch') as request_launch:
+                launcher.launch('run', '440')
+        finally:
+            xbmcgui.Window(10000).clearProperty(launcher.SERVICE_PROPERTY)
+        request_launch.assert_called_once_with('run', '440')
+        start_detached.assert_not_called()
+
+
+class SuperviseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.steam_path = tempfile.mkdtemp(prefix='steam-')
+        self.registry_path = os.path.join(self.steam_path, 'registry.vdf')
+        write_registry(self.registry_path, '0')
+        xbmcaddon.settings['steam-path'] = self.steam_path
+
+    def tearDown(self):
+        xbmcaddon.settings['steam-path'] = ''
+        shutil.rmtree(self.steam_path)
+
+    def supervise(self, action, running_appids, exit_codes, requested_at=None):
+        monitor = Monitor(self.registry_path, running_appids)
+        with mock.patch.object(steam, 'start_detached', return_value=Process(exit_codes)):
+            launch_id = launcher.supervise(monitor, action, '440', ['steam', 'steam://rungameid/440'], requested_at)
+        return monitor, get_launch(launch_id)
+
+    def test_follows_the_game_until_it_is_closed(self):
+        # The command exits once Steam got the request, then the game runs for two polls
+        monitor, launch = self.supervise('run', ['0', '440', '440', '0'], [None, 0])
+        appid, action, requested_at, exit_code, exited_at, started_at, ended_at = launch
+        self.assertEqual((appid, action, exit_code), ('440', 'run', 0))
+        self.assertIsNotNone(exited_at)
+        self.assertLessEqual(requested_at, started_at)
+        self.assertLessEqual(started_at, ended_at)
+        self.assertEqual(monitor.wait_count, 4)
+
+    def test_installs_are_not_followed(self):
+        monitor, launch = self.supervise('install', [], [None, None, 1])
+        self.assertEqual(launch[3], 1)
+        self.assertIsNone(launch[5])
+        self.assertEqual(monitor.wait_count, 2)
+
+    def test_gives_up_on_a_game_which_does_not_start(self):
+        monitor, launch = self.supervise('run', [], [0], requested_at=time.time() - launcher.START_TIMEOUT - 1)
+        self.assertEqual(launch[3], 0)
+        self.assertIsNone(launch[5])
+        self.assertEqual(monitor.wait_count, 0)
+
+    def test_records_a_command_which_can_not_start(self):
+        monitor = Monitor(self.registry_path, [])
+        with mock.patch.object(steam, 'start_detached', side_effect=OSError('No such file or directory')):
+            launch = get_launch(launcher.supervise(monitor, 'run', '440', ['steam'], None))
+        self.assertIsNone(launch[3])
+        self.assertIsNotNone(launch[4])
+        self.assertEqual(monitor.wait_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+'''
+tests of the search of the library snapshot of resources/library.py
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks', 'kodi_stubs'), os.path.dirname(TESTS_FOLDER)]
+
+from resources import library  # noqa: E402
+from resources import singleflight  # noqa: E402
+from resources import steam  # noqa: E402
+
+STEAM_API_KEY = 'test'
+STEAM_USER_ID = '76561197960434622'
+
+GAMES = [
+    steam.Game(620, 'Portal 2', playtime_forever=600),
+    steam.Game(400, 'Portal', playtime_forever=120),
+    steam.Game(1113000, 'Portal Stories: Mel', playtime_forever=0),
+    steam.Game(220, 'Half-Life 2', playtime_forever=1500),
+    steam.Game(380, 'Half-Life 2: Episode One', playtime_forever=30),
+    steam.Game(367520, 'Hollow Knight', playtime_forever=0),
+    steam.Game(1145360, 'Hadès', playtime_forever=2400),
+    steam.Game(403640, 'Dishonored 2', playtime_forever=60),
+    steam.Game(500, 'Portalsmith', playtime_forever=3000),
+]
+
+
+def get_appids(games):
+    return [game.appid for game in games]
+
+
+class FindGamesTest(unittest.TestCase):
+
+    def setUp(self):
+        library.delete_cache()
+        library.restore(STEAM_USER_ID, GAMES, time.time())
+
+    def find_games(self, query='', **filters):
+        return library.find_games(STEAM_API_KEY, STEAM_USER_ID, query, **filters)
+
+    def test_lists_every_game_by_playtime_without_query(self):
+        appids = get_appids(self.find_games())
+        self.assertEqual(appids[:7], [500, 1145360, 220, 620, 400, 403640, 380])
+        self.assertEqual(set(appids[7:]), {1113000, 367520})  # Never played
+
+    def test_tokenize(self):
+        self.assertEqual(library.tokenize('Half-Life 2: Episode One'), ['half', 'life', '2', 'episode', 'one'])
+        self.assertEqual(library.tokenize('Hadès'), ['hades'])
+
+    def test_matches_token_prefixes(self):
+        self.assertEqual(set(get_appids(self.find_games('port'))), {620, 400, 1113000, 500})
+        self.assertEqual(get_appids(self.find_games('hal lif ep')), [380])
+
+    def test_every_token_must_match(self):
+        self.assertEqual(get_appids(self.find_games('portal 2')), [620])
+        self.assertEqual(self.find_games('portal knight'), [])
+
+    def test_ignores_case_and_accents(self):
+        self.assertEqual(get_appids(self.find_games('HADES')), [1145360])
+        self.assertEqual(get_appids(self.find_games('hadès')), [1145360])
+
+    def test_matches_typos(self):
+        self.assertEqual(get_appids(self.find_games('hollow knigt')), [367520])
+        self.assertEqual(set(get_appids(self.find_games('portsl'))), {620, 400, 1113000})
+
+    def test_typos_are_limited_by_the_token_length(self):
+        self.assertEqual(self.find_games('hxl'), [])
+        self.assertEqual(self.find_games('knihgt'), [])  # A transposition is 2 typos, only allowed from 8 characters
+        self.assertEqual(get_appids(self.find_games('dishonroed')), [403640])
+
+    def test_ranks_whole_words_first_then_playtime(self):
+        # "portal" is a whole word of the Portal games, but only the start of "portalsmith"
+        self.assertEqual(get_appids(self.find_games('portal')), [620, 400, 1113000, 500])
+        self.assertEqual(get_appids(self.find_games('half')), [220, 380])
+        self.assertEqual(get_appids(self.find_games('hal')), [220, 380])
+
+    def test_filters_by_playtime(self):
+        self.assertEqual(set(get_appids(self.find_games(played=False))), {1113000, 367520})
+        self.assertEqual(set(get_appids(self.find_games(played=True))), {500, 1145360, 220, 620, 400, 403640, 380})
+        self.assertEqual(get_appids(self.find_games(min_playtime=120, max_playtime=600)), [620, 400])
+        self.assertEqual(get_appids(self.find_games('portal', played=True)), [620, 400, 500])
+        self.assertEqual(get_appids(self.find_games('half', min_playtime=60)), [220])
+
+    def test_index_follows_the_syncs(self):
+        self.assertEqual(self.find_games('stanley'), [])
+        # Portal is removed, The Stanley Parable added and Half-Life 2 renamed
+        games = [game for game in GAMES if game.appid not in (400, 220)] + [steam.Game(221910, 'The Stanley Parable', playtime_forever=90),
+                                                                            steam.Game(220, 'Half-Life 2: Update', playtime_forever=1500)]
+        with mock.patch.object(steam, 'get_user_games_if_changed', return_value=(games, {})):
+            delta = library.sync(STEAM_API_KEY, STEAM_USER_ID)
+        self.assertEqual((delta.added, delta.removed, delta.changed), ({221910}, {400}, {220}))
+
+        self.assertEqual(get_appids(self.find_games('stanley')), [221910])
+        self.assertEqual(get_appids(self.find_games('portal')), [620, 1113000, 500])
+        self.assertEqual(get_appids(self.find_games('update')), [220])
+
+
+class DeleteCacheTest(unittest.TestCase):
+
+    def get_games_count(self):
+        return library._get_connection().execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+    def test_waits_for_the_running_sync(self):
+        library.restore(STEAM_USER_ID, GAMES, time.time())
+        syncing = threading.Event()
+        deleted = threading.Event()
+
+        def delete_cache():
+            syncing.wait()
+            library.delete_cache()
+            deleted.set()
+
+        delete_thread = threading.Thread(target=delete_cache)
+        delete_thread.start()
+        with singleflight.lock(library.SYNC_LOCK):  # Held by a sync of another invocation
+            syncing.set()
+            self.assertFalse(deleted.wait(0.2))
+            self.assertEqual(self.get_games_count(), len(GAMES))
+        delete_thread.join()
+        self.assertEqual(self.get_games_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
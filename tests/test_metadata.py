@@ -0,0 +1,130 @@
+'''
+tests of the Steam Store details of resources/metadata.py
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks')
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(TESTS_FOLDER), BENCHMARKS_FOLDER]
+
+from listings import STORE_PATH, start_server  # noqa: E402
+from resources import metadata  # noqa: E402
+from resources import transport  # noqa: E402
+
+PORTAL_DETAILS = {'400': {'success': True, 'data': {
+    'name': 'Portal',
+    'genres': [{'id': '1', 'description': 'Action'}, {'id': '25', 'description': 'Adventure'}, {'id': '0'}],
+    'release_date': {'coming_soon': False, 'date': '10 Oct, 2007'},
+    'developers': ['Valve', ''],
+    'short_description': 'Portal&trade; is a new <b>single player</b> game from Valve. ',
+}}}
+
+
+class ParseAppDetailsTest(unittest.TestCase):
+
+    def test_extracts_the_stored_fields(self):
+        self.assertEqual(metadata.parse_app_details(400, PORTAL_DETAILS),
+                         (True, ['Action', 'Adventure'], 2007, ['Valve'], 'Portal™ is a new single player game from Valve.'))
+
+    def test_apps_without_store_page(self):
+        for details in ({'400': {'success': False}}, {}, {'400': None}, {'400': {'success': True, 'data': []}}, {'570': PORTAL_DETAILS['400']}):
+            with self.subTest(details=details):
+                self.assertEqual(metadata.parse_app_details(400, details), (False, [], 0, [], ''))
+
+    def test_missing_fields(self):
+        details = {'400': {'success': True, 'data': {'release_date': {'coming_soon': True, 'date': 'Coming soon'}, 'genres': None}}}
+        self.assertEqual(metadata.parse_app_details(400, details), (True, [], 0, [], ''))
+        details = {'400': {'success': True, 'data': {'release_date': {'date': 'Q3 2025'}}}}
+        self.assertEqual(metadata.parse_app_details(400, details)[2], 2025)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_spaces_the_requests_of_every_thread(self):
+        rate_limiter = metadata.RateLimiter(requests_per_minute=600)  # A request every 0.1 second
+        request_times = []
+        request_times_lock = threading.Lock()
+
+        def send_requests():
+            for index in range(3):
+                rate_limiter.wait()
+                with request_times_lock:
+                    request_times.append(time.time())
+
+        threads = [threading.Thread(target=send_requests) for index in range(3)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        request_times.sort()
+        self.assertEqual(len(request_times), 9)
+        self.assertLess(request_times[0] - start, 0.05)  # The first request is not delayed
+        for index, request_time in enumerate(request_times):  # Every request waits for its turn, a late thread only delays its own request
+            self.assertGreaterEqual(request_time - start, index * 0.1 - 0.01)
+
+    def test_does_not_delay_spaced_requests(self):
+        rate_limiter = metadata.RateLimiter(requests_per_minute=600)
+        rate_limiter.wait()
+        time.sleep(0.15)
+        start = time.time()
+        rate_limiter.wait()
+        self.assertLess(time.time() - start, 0.01)
+
+
+class EnrichTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(latency=0, not_found_ratio=0)
+        cls.api_url = 'http://127.0.0.1:{0}{1}'.format(cls.server.server_port, STORE_PATH)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        metadata.delete_cache()
+        self.server.store_status = 200
+        with self.server.counters_lock:
+            self.server.counters.clear()
+
+    def enrich(self, appids):
+        return metadata.enrich(appids, max_workers=2, requests_per_minute=600, batch_size=2, api_url=self.api_url)
+
+    def test_fetches_and_stores_the_stale_apps(self):
+        appids = [10, 20, 30, 14, 50]  # The stand-in Store has no page for 14
+        start = time.time()
+        self.assertTrue(self.enrich(appids))
+        self.assertGreaterEqual(time.time() - start, 0.4 - 0.01)  # The 5 requests are spaced by 0.1 second, across the batches
+        self.assertEqual(self.server.counters['get_store'], 5)
+        self.assertEqual(metadata.get_stale_appids(appids), [])
+
+        apps_metadata = metadata.get_metadata(appids)
+        self.assertEqual(sorted(apps_metadata), [10, 20, 30, 50])
+        self.assertEqual(apps_metadata[20], {'genre': ['Action'], 'year': 2020, 'studio': ['Studio 20'], 'plot': 'The synthetic game 20'})
+
+        self.assertTrue(self.enrich(appids))  # Every app is stored, nothing is fetched again
+        self.assertEqual(self.server.counters['get_store'], 5)
+
+    def test_stops_when_a_whole_batch_fails(self):
+        self.server.store_status = 429
+        appids = [10, 20, 30, 40, 50]
+        self.assertFalse(self.enrich(appids))
+        self.assertEqual(self.server.counters['get_store'], 2 * (1 + transport.httpRetries))  # Only the first batch was requested
+        self.assertEqual(metadata.get_stale_appids(appids), appids)
+
+        self.server.store_status = 200
+        self.assertTrue(self.enrich(appids))  # The apps are fetched by a later enrichment
+        self.assertEqual(metadata.get_stale_appids(appids), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+'''
+tests of the reading of the requests-cache responses of previous versions, in resources/migrations.py
+'''
+
+import datetime
+import io
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks', 'kodi_stubs'), os.path.dirname(TESTS_FOLDER)]
+
+from resources import migrations  # noqa: E402
+
+
+class Response(object):
+    """
+    Stands for the pickled requests.Response, whose module is not importable by the unpickler
+    """
+
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self._content = content
+
+
+class SlottedResponse(Response):
+    __slots__ = ('elapsed',)
+
+
+class Headers(dict):
+    """
+    Stands for the pickled requests.structures.CaseInsensitiveDict
+    """
+
+
+class Payload(object):
+    """
+    Pickles a call to a function, which the unpickler must not make
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return os.remove, (self.path,)
+
+
+def unpickle(value):
+    return migrations._PermissiveUnpickler(io.BytesIO(pickle.dumps(value, protocol=2)), encoding='latin1').load()
+
+
+class PermissiveUnpicklerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_replaces_unknown_classes_and_keeps_their_attributes(self):
+        response = unpickle(Response('https://cdn.akamai.steamstatic.com/steam/apps/440/header.jpg', 200, b'\xff\xd8'))
+        self.assertIsInstance(response, migrations._LegacyObject)
+        self.assertEqual((response.url, response.status_code, response._content),
+                         ('https://cdn.akamai.steamstatic.com/steam/apps/440/header.jpg', 200, b'\xff\xd8'))
+
+    def test_keeps_the_attributes_of_slotted_classes(self):
+        response = SlottedResponse('https://api.steampowered.com/', 404, b'')
+        response.elapsed = datetime.timedelta(seconds=1)
+        legacy_response = unpickle(response)
+        self.assertEqual((legacy_response.status_code, legacy_response.elapsed), (404, datetime.timedelta(seconds=1)))
+
+    def test_keeps_the_items_of_unknown_dict_classes(self):
+        headers = Headers()
+        headers['ETag'] = '"1234"'
+        self.assertEqual(unpickle(headers)._legacy_items, {'ETag': '"1234"'})
+
+    def test_loads_the_safe_classes(self):
+        created_at = datetime.datetime(2020, 5, 17, 12, 30)
+        self.assertEqual(unpickle((Response('url', 200, b''), created_at))[1], created_at)
+        self.assertEqual(unpickle({'key': [1, 2, frozenset([3])]}), {'key': [1, 2, frozenset([3])]})
+
+    def test_does_not_call_unknown_functions(self):
+        path = os.path.join(self.folder, 'kept')
+        open(path, 'w').close()
+        self.assertIsInstance(unpickle(Payload(path)), migrations._LegacyObject)
+        self.assertTrue(os.path.isfile(path))
+
+    def test_iterates_the_responses_of_a_cache_file(self):
+        cache_path = os.path.join(self.folder, 'cache.sqlite')
+        created_at = datetime.datetime(2020, 5, 17, 12, 30)
+        connection = sqlite3.connect(cache_path)
+        with connection:
+            connection.execute('CREATE TABLE responses (key TEXT PRIMARY KEY, value BLOB)')
+            connection.executemany('INSERT INTO responses (key, value) VALUES (?, ?)', [
+                ('old', pickle.dumps((Response('https://example.com/old', 200, b'old'), created_at), protocol=2)),
+                ('corrupted', b'\x80\x02corrupted'),
+            ])
+        connection.close()
+
+        responses = list(migrations._iter_legacy_responses(cache_path))
+        self.assertEqual(len(responses), 2)
+        response, timestamp = responses[0]
+        self.assertEqual((response.url, response._content), ('https://example.com/old', b'old'))
+        self.assertEqual(timestamp, (created_at - datetime.datetime(1970, 1, 1)).total_seconds())
+        self.assertEqual(responses[1], (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
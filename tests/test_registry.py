@@ -0,0 +1,153 @@
+'''
+tests of the text VDF parser and of the installed apps of resources/registry.py
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks', 'kodi_stubs'), os.path.dirname(TESTS_FOLDER)]
+
+from resources import registry  # noqa: E402
+
+REGISTRY_VDF = '''"Registry"
+{
+	"HKCU"
+	{
+		"Software"
+		{
+			"Valve"
+			{
+				"Steam"
+				{
+					"RunningAppID"		"440"
+					"Apps"
+					{
+						"440"
+						{
+							"Installed"		"1"
+							"name"		"Team Fortress 2"
+						}
+						"570"
+						{
+							"Installed"		"0"
+						}
+					}
+				}
+			}
+		}
+	}
+}
+'''
+
+
+class VdfLoadsTest(unittest.TestCase):
+
+    def test_parses_nested_maps_with_lowercase_keys(self):
+        config = registry.vdf_loads(REGISTRY_VDF)
+        steam = config['registry']['hkcu']['software']['valve']['steam']
+        self.assertEqual(steam['runningappid'], '440')
+        self.assertEqual(steam['apps'], {'440': {'installed': '1', 'name': 'Team Fortress 2'}, '570': {'installed': '0'}})
+
+    def test_values_keep_their_case(self):
+        self.assertEqual(registry.vdf_loads('"AppState" { "Name" "Half-Life" }'), {'appstate': {'name': 'Half-Life'}})
+
+    def test_returns_the_subtree_at_the_path(self):
+        apps = registry.vdf_loads(REGISTRY_VDF, ('registry', 'hkcu', 'software', 'valve', 'steam', 'apps'))
+        self.assertEqual(sorted(apps), ['440', '570'])
+        self.assertEqual(apps['440']['installed'], '1')
+
+    def test_returns_none_when_the_path_is_missing(self):
+        self.assertIsNone(registry.vdf_loads(REGISTRY_VDF, ('registry', 'hklm')))
+        self.assertIsNone(registry.vdf_loads('', ('registry',)))
+
+    def test_parses_an_empty_text(self):
+        self.assertEqual(registry.vdf_loads(''), {})
+
+    def test_parses_empty_values_and_maps(self):
+        self.assertEqual(registry.vdf_loads('"root" { "empty" "" "map" { } }'), {'root': {'empty': '', 'map': {}}})
+
+    def test_unescapes_the_strings(self):
+        config = registry.vdf_loads(r'"root" { "path" "C:\\Program Files\\Steam" "quoted" "say \"hi\"" }')
+        self.assertEqual(config['root'], {'path': 'C:\\Program Files\\Steam', 'quoted': 'say "hi"'})
+
+    def test_ignores_comments_and_conditionals(self):
+        text = '''// comment
+"root"
+{
+	"key"		"value"	[$WIN32]
+	// "ignored" "value"
+	unquoted	value2
+}
+'''
+        self.assertEqual(registry.vdf_loads(text), {'root': {'key': 'value', 'unquoted': 'value2'}})
+
+    def test_both_tokenizers_agree(self):
+        split_strings, split_structures = registry._split_tokens(REGISTRY_VDF)
+        regex_strings, regex_structures = registry._regex_tokens(REGISTRY_VDF)
+        self.assertEqual(split_strings, regex_strings)
+        # The whitespace between the braces is ignored by the parser
+        self.assertEqual([''.join(structure.split()) for structure in split_structures], regex_structures)
+
+    def test_falls_back_to_the_regex_tokenizer(self):
+        self.assertIsNone(registry._split_tokens('"root" { unquoted "value" }'))
+        self.assertIsNone(registry._split_tokens(r'"root" { "key" "\"value\"" }'))
+
+    def test_stops_at_an_unexpected_closing_brace(self):
+        self.assertEqual(registry.vdf_loads('"root" { "key" "value" } } "other" "value"'), {'root': {'key': 'value'}})
+        self.assertIsNone(registry.vdf_loads('"root" { } }', ('other',)))
+
+
+APP_MANIFEST = '"AppState"\n{{\n\t"appid"\t\t"{0}"\n\t"StateFlags"\t\t"{1}"\n\t"SizeOnDisk"\t\t"{2}"\n}}\n'
+
+
+class InstalledAppsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.steam_path = tempfile.mkdtemp(prefix='steam-')
+        self.registry_path = os.path.join(self.steam_path, 'registry.vdf')
+        self.steamapps_folders = [os.path.join(self.steam_path, 'steamapps'), os.path.join(self.steam_path, 'library', 'steamapps')]
+        for steamapps_folder in self.steamapps_folders:
+            os.makedirs(steamapps_folder)
+        with open(os.path.join(self.steamapps_folders[0], 'libraryfolders.vdf'), 'w') as library_folders_file:
+            library_folders_file.write('"libraryfolders"\n{{\n\t"1"\n\t{{\n\t\t"path"\t\t"{0}"\n\t}}\n}}\n'
+                                       .format(os.path.dirname(self.steamapps_folders[1]).replace('\\', '\\\\')))
+        with open(self.registry_path, 'w') as registry_file:
+            registry_file.write(REGISTRY_VDF)
+
+    def tearDown(self):
+        shutil.rmtree(self.steam_path)
+
+    def write_manifest(self, appid, state_flags, size_on_disk, library=0):
+        with open(os.path.join(self.steamapps_folders[library], 'appmanifest_{0}.acf'.format(appid)), 'w') as manifest_file:
+            manifest_file.write(APP_MANIFEST.format(appid, state_flags, size_on_disk))
+
+    def assertInstalled(self, appids):
+        self.assertEqual(sorted(registry.get_installed_steam_apps(self.registry_path)), appids)
+        self.assertEqual(sorted(registry.get_indexed_installed_steam_apps(self.registry_path)), appids)
+
+    def test_is_app_installed(self):
+        for state_flags, size_on_disk, installed in ((4, 1000, True), (6, 1000, True), (1026, 1000, True), (1030, 1000, True),
+                                                     (1026, 0, False), (2, 0, False), (0, 0, False)):
+            with self.subTest(state_flags=state_flags, size_on_disk=size_on_disk):
+                self.assertEqual(registry.is_app_installed(state_flags, size_on_disk), installed)
+
+    def test_updating_apps_stay_installed(self):
+        self.write_manifest(400, 4, 1000)  # Fully installed
+        self.write_manifest(440, 1026, 1000)  # Update running
+        self.write_manifest(570, 6, 1000)  # Update required
+        self.write_manifest(620, 1026, 0)  # First installation running
+        self.assertInstalled(['400', '440', '570'])
+
+    def test_the_installed_manifest_wins(self):
+        self.write_manifest(440, 1026, 1000, library=0)
+        self.write_manifest(440, 1026, 0, library=1)  # Being moved to the second library
+        self.assertEqual(registry.get_app_manifests(self.steam_path), {'440': (1026, 1000)})
+        self.assertInstalled(['440'])
+
+
+if __name__ == '__main__':
+    unittest.main()
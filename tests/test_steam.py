@@ -0,0 +1,79 @@
+'''
+tests of the owned games queries of resources/steam.py, against the stand-in Steam Web API of benchmarks/listings.py
+'''
+
+import json
+import os
+import sys
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks')
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(TESTS_FOLDER), BENCHMARKS_FOLDER]
+
+from listings import start_server  # noqa: E402
+from owned_games import make_response  # noqa: E402
+from resources import steam  # noqa: E402
+
+
+def get_expected_games(body):
+    return [steam.Game.from_entry(entry) for entry in json.loads(body.decode('utf-8'))['response']['games']]
+
+
+class IterGamesTest(unittest.TestCase):
+
+    def test_parses_any_chunk_boundaries(self):
+        body = make_response(50)
+        for chunk_size in (1, 7, 1024, len(body)):
+            with self.subTest(chunk_size=chunk_size):
+                chunks = (body[start:start + chunk_size] for start in range(0, len(body), chunk_size))
+                self.assertEqual(list(steam.iter_games(chunks)), get_expected_games(body))
+
+    def test_private_profile_has_no_games(self):
+        self.assertEqual(list(steam.iter_games([b'{"response": {}}'])), [])
+
+    def test_rejects_a_truncated_response(self):
+        body = make_response(10)
+        with self.assertRaises(IOError):
+            list(steam.iter_games([body[:len(body) // 2]]))
+
+
+class GetUserGamesIfChangedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(latency=0, not_found_ratio=0)
+        cls.web_api_url = steam.WEB_API_URL
+        steam.WEB_API_URL = 'http://127.0.0.1:{0}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        steam.WEB_API_URL = cls.web_api_url
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_streams_the_games(self):
+        # Bigger than a chunk, so that the body is parsed and hashed over several chunks
+        self.server.owned_games_body = make_response(2000)
+        self.assertGreater(len(self.server.owned_games_body), steam.RESPONSE_CHUNK_SIZE)
+        games, validators = steam.get_user_games_if_changed('key', '76561197960434622')
+        self.assertEqual(games, get_expected_games(self.server.owned_games_body))
+        self.assertTrue(validators['content_hash'])
+
+    def test_skips_an_unchanged_body(self):
+        self.server.owned_games_body = make_response(100)
+        games, validators = steam.get_user_games_if_changed('key', '76561197960434622')
+        self.assertEqual(len(games), 100)
+
+        games, unchanged_validators = steam.get_user_games_if_changed('key', '76561197960434622', validators)
+        self.assertIsNone(games)
+        self.assertEqual(unchanged_validators, validators)
+
+        self.server.owned_games_body = make_response(100, seed=1)
+        games, changed_validators = steam.get_user_games_if_changed('key', '76561197960434622', validators)
+        self.assertEqual(games, get_expected_games(self.server.owned_games_body))
+        self.assertNotEqual(changed_validators['content_hash'], validators['content_hash'])
+
+
+if __name__ == '__main__':
+    unittest.main()
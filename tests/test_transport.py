@@ -0,0 +1,76 @@
+'''
+tests of the shared HTTP transport of resources/transport.py, against the stand-in server of benchmarks/listings.py
+'''
+
+import os
+import sys
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_FOLDER = os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks')
+sys.path[:0] = [os.path.join(BENCHMARKS_FOLDER, 'kodi_stubs'), os.path.dirname(TESTS_FOLDER), BENCHMARKS_FOLDER]
+
+from listings import start_server  # noqa: E402
+from resources import transport  # noqa: E402
+
+
+class NormalizeUrlTest(unittest.TestCase):
+
+    def test_upgrades_the_steam_hosts(self):
+        self.assertEqual(transport.normalize_url('http://cdn.akamai.steamstatic.com/steam/apps/440/header.jpg'),
+                         'https://cdn.akamai.steamstatic.com/steam/apps/440/header.jpg')
+        self.assertEqual(transport.normalize_url('http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?format=json'),
+                         'https://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/?format=json')
+        self.assertEqual(transport.normalize_url('http://steamcommunity.com/'), 'https://steamcommunity.com/')
+        self.assertEqual(transport.normalize_url('http://CDN.Cloudflare.SteamStatic.com/'), 'https://CDN.Cloudflare.SteamStatic.com/')
+
+    def test_keeps_the_explicit_ports(self):
+        self.assertEqual(transport.normalize_url('http://steamcdn-a.akamaihd.net:80/a.jpg'), 'https://steamcdn-a.akamaihd.net/a.jpg')
+        self.assertEqual(transport.normalize_url('http://steamcdn-a.akamaihd.net:8080/a.jpg'), 'https://steamcdn-a.akamaihd.net:8080/a.jpg')
+
+    def test_leaves_the_other_hosts_alone(self):
+        for url in ('http://127.0.0.1:8080/steam/apps/440/header.jpg', 'http://evilsteamstatic.com/a.jpg', 'http://steamstatic.com.example.com/a.jpg',
+                    'http://notsteampowered.com/', 'https://cdn.akamai.steamstatic.com/a.jpg'):
+            with self.subTest(url=url):
+                self.assertEqual(transport.normalize_url(url), url)
+
+    def test_is_https_host(self):
+        self.assertTrue(transport.is_https_host('steamstatic.com'))
+        self.assertTrue(transport.is_https_host('cdn.akamai.steamstatic.com.'))
+        self.assertFalse(transport.is_https_host('evilsteamstatic.com'))
+        self.assertFalse(transport.is_https_host('akamaihd.net.example.com'))
+
+
+class PooledSessionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(latency=0, not_found_ratio=0)
+        cls.base_url = 'http://127.0.0.1:{0}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_reuses_the_connections(self):
+        session = transport.create_session(pool_size=2)
+        self.assertIs(session.get_adapter('http://'), session.get_adapter('https://'))
+        self.assertIn(session.get_adapter('http://'), transport._adapters)
+        for index in range(10):
+            self.assertEqual(session.head(self.base_url + '/steam/apps/{0}/header.jpg'.format(index), timeout=5).status_code, 200)
+
+        host_stats = transport.get_pool_stats()['http://127.0.0.1:{0}'.format(self.server.server_port)]
+        self.assertEqual(host_stats['requests'], 10)
+        self.assertEqual(host_stats['connections'], 1)
+        self.assertEqual(self.server.counters['head_art'], 10)
+        session.close()
+
+    def test_retries_the_temporary_errors(self):
+        retry = transport.create_retry(retries=3, backoff=0.5)
+        self.assertEqual((retry.total, retry.connect, retry.read, retry.backoff_factor), (3, 3, 0, 0.5))
+        self.assertIn(503, retry.status_forcelist)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+'''
+tests of the inotify watcher of the installed Steam library, resources/watcher.py : incremental updates, debounce and queue overflow
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(os.path.dirname(TESTS_FOLDER), 'benchmarks', 'kodi_stubs'), os.path.dirname(TESTS_FOLDER)]
+
+import xbmc  # noqa: E402
+import xbmcgui  # noqa: E402
+from resources import registry  # noqa: E402
+from resources import watcher  # noqa: E402
+
+REGISTRY_VDF = '"Registry"\n{\n\t"HKCU"\n\t{\n\t\t"Software"\n\t\t{\n\t\t\t"Valve"\n\t\t\t{\n\t\t\t\t"Steam"\n\t\t\t\t{\n\t\t\t\t\t"RunningAppID"\t\t"0"\n\t\t\t\t}\n\t\t\t}\n\t\t}\n\t}\n}\n'
+APP_MANIFEST = '"AppState"\n{{\n\t"appid"\t\t"{0}"\n\t"StateFlags"\t\t"{1}"\n\t"SizeOnDisk"\t\t"{2}"\n}}\n'
+
+
+class Monitor(object):
+    """
+    Stands in for :class:`xbmc.Monitor`, aborting when the test asks for it. Records the waits instead of sleeping when `sleep` is False
+    """
+
+    def __init__(self, sleep=True):
+        self.abort = threading.Event()
+        self.sleep = sleep
+        self.waits = []
+
+    def abortRequested(self):
+        return self.abort.is_set()
+
+    def waitForAbort(self, timeout=None):
+        self.waits.append(timeout)
+        return self.abort.wait(timeout) if self.sleep else self.abort.is_set()
+
+
+class ScriptedInotify(object):
+    """
+    Stands in for :class:`watcher.Inotify`, returning scripted events, then requesting the abort of the monitor
+    """
+
+    def __init__(self, monitor, events):
+        self.monitor = monitor
+        self.events = list(events)
+        self.watched_folders = {}
+        self.watch_count = 0
+
+    def add_watch(self, folder, mask=watcher.WATCH_MASK):
+        self.watched_folders[len(self.watched_folders) + 1] = folder
+        self.watch_count += 1
+
+    def remove_watches(self):
+        self.watched_folders.clear()
+
+    def read_events(self, timeout):
+        if not self.events:
+            self.monitor.abort.set()
+            return []
+        return self.events.pop(0)
+
+    def close(self):
+        pass
+
+
+class WatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.steam_path = tempfile.mkdtemp(prefix='steam-')
+        self.registry_path = os.path.join(self.steam_path, 'registry.vdf')
+        self.steamapps_folder = os.path.join(self.steam_path, 'steamapps')
+        os.makedirs(self.steamapps_folder)
+        with open(self.registry_path, 'w') as registry_file:
+            registry_file.write(REGISTRY_VDF)
+        self.write_manifest(440, 4, 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.steam_path)
+
+    def get_manifest_path(self, appid):
+        return os.path.join(self.steamapps_folder, 'appmanifest_{0}.acf'.format(appid))
+
+    def write_manifest(self, appid, state_flags, size_on_disk):
+        with open(self.get_manifest_path(appid), 'w') as manifest_file:
+            manifest_file.write(APP_MANIFEST.format(appid, state_flags, size_on_disk))
+
+
+@unittest.skipUnless(watcher.is_supported(), 'inotify is not available')
+class InotifyWatcherTest(WatcherTestCase):
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def test_updates_the_index_as_steam_writes_the_manifests(self):
+        monitor = Monitor()
+        xbmc.info_labels['Container.FolderPath'] = 'plugin://plugin.program.steam.library/installed'
+        del xbmc.executed_builtins[:]
+        watcher_thread = threading.Thread(target=watcher.run, args=(monitor, self.steam_path))
+        watcher_thread.start()
+        try:
+            self.assertTrue(self.wait_for(lambda: xbmcgui.Window(10000).getProperty(watcher.WATCHER_PROPERTY) == self.steam_path))
+            self.assertEqual(registry.get_indexed_installed_steam_apps(self.registry_path), ['440'])
+
+            self.write_manifest(620, 4, 2000)
+            self.assertTrue(self.wait_for(lambda: sorted(registry.get_indexed_installed_steam_apps(self.registry_path)) == ['440', '620']))
+            self.assertTrue(self.wait_for(lambda: 'Container.Refresh' in xbmc.executed_builtins))
+
+            os.remove(self.get_manifest_path(440))
+            self.assertTrue(self.wait_for(lambda: registry.get_indexed_installed_steam_apps(self.registry_path) == ['620']))
+        finally:
+            monitor.abort.set()
+            watcher_thread.join(5)
+            xbmc.info_labels.clear()
+        self.assertFalse(watcher_thread.is_alive())
+        self.assertEqual(xbmcgui.Window(10000).getProperty(watcher.WATCHER_PROPERTY), '')
+
+
+    def test_reads_the_overflow_events(self):
+        inotify = watcher.Inotify()
+        read_fd, write_fd = os.pipe()
+        os.close(inotify.fd)
+        inotify.fd = read_fd
+        inotify.watched_folders = {1: self.steamapps_folder}
+        try:
+            name = b'appmanifest_440.acf\0'
+            os.write(write_fd, watcher.EVENT_HEADER.pack(-1, watcher.IN_Q_OVERFLOW, 0, 0) +
+                     watcher.EVENT_HEADER.pack(1, watcher.IN_CLOSE_WRITE, 0, len(name)) + name)
+            self.assertEqual(inotify.read_events(timeout=1), [(None, watcher.IN_Q_OVERFLOW), (self.get_manifest_path(440), watcher.IN_CLOSE_WRITE)])
+        finally:
+            os.close(write_fd)
+            inotify.close()
+
+
+class ScriptedWatcherTest(WatcherTestCase):
+
+    def run_watcher(self, events):
+        monitor = Monitor(sleep=False)
+        inotify = ScriptedInotify(monitor, events)
+        with mock.patch.object(watcher, 'Inotify', return_value=inotify), \
+                mock.patch.object(registry, 'update_app_manifest', wraps=registry.update_app_manifest) as update_app_manifest, \
+                mock.patch.object(registry, 'get_app_manifests', wraps=registry.get_app_manifests) as get_app_manifests:
+            watcher.run(monitor, self.steam_path)
+        return monitor, inotify, update_app_manifest, get_app_manifests
+
+    def test_debounces_the_events(self):
+        self.write_manifest(620, 4, 2000)
+        manifest_path = self.get_manifest_path(620)
+        # Steam rewrites a manifest several times in a row, the events are gathered and each manifest is only read once
+        events = [[(manifest_path, watcher.IN_CREATE)],
+                  [(manifest_path, watcher.IN_CLOSE_WRITE), (manifest_path + '.tmp', watcher.IN_MOVED_FROM), (manifest_path, watcher.IN_MOVED_TO)]]
+        monitor, inotify, update_app_manifest, get_app_manifests = self.run_watcher(events)
+
+        self.assertIn(watcher.DEBOUNCE_SECONDS, monitor.waits)
+        update_app_manifest.assert_called_once_with(manifest_path)
+        self.assertEqual(get_app_manifests.call_count, 1)  # The initial scan only
+        self.assertIn('620', registry.get_indexed_installed_steam_apps(self.registry_path))
+
+    def test_rescans_the_libraries_after_an_overflow(self):
+        # The events of the new manifest were dropped by the kernel
+        self.write_manifest(620, 4, 2000)
+        monitor, inotify, update_app_manifest, get_app_manifests = self.run_watcher([[(None, watcher.IN_Q_OVERFLOW)]])
+
+        self.assertEqual(get_app_manifests.call_count, 3)  # The initial scan, then the rescan after the overflow and the one of the installed apps
+        self.assertEqual(inotify.watch_count, 4)  # The Steam folder and its library, watched again
+        update_app_manifest.assert_not_called()
+        self.assertEqual(sorted(registry.get_indexed_installed_steam_apps(self.registry_path)), ['440', '620'])
+
+    def test_rescans_the_libraries_when_they_change(self):
+        library_folders_path = os.path.join(self.steamapps_folder, 'libraryfolders.vdf')
+        monitor, inotify, update_app_manifest, get_app_manifests = self.run_watcher([[(library_folders_path, watcher.IN_CLOSE_WRITE)]])
+        self.assertEqual(inotify.watch_count, 4)
+        update_app_manifest.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()